@@ -20,7 +20,11 @@ class ANPRService:
         from alpr_module.license_plate_recognition import recognize_license_plate
         
         license_number, confidence = recognize_license_plate(image_path)
-        
+        return ANPRService.detection_result(license_number, confidence, camera_id)
+    
+    @staticmethod
+    def detection_result(license_number, confidence, camera_id=None):
+        """ANPR result dict for a recognized plate (also used by the async OCR jobs)"""
         return {
             'license_number': license_number,
             'confidence': confidence,
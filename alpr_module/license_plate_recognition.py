@@ -13,6 +13,23 @@ import os
 # Initialize EasyOCR reader (lazy loading)
 _reader = None
 
+# Recognition cascade settings
+PLATE_CHARS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+ACCEPT_CONFIDENCE = float(os.environ.get('OCR_ACCEPT_CONFIDENCE', '0.6'))
+MAX_REGIONS = int(os.environ.get('OCR_MAX_REGIONS', '4'))
+# 0: full-image fallback only when the regions gave no reading at all;
+# 1: also when the best reading is not accepted (more passes, better recall)
+FALLBACK_ON_WEAK = os.environ.get('OCR_FALLBACK_ON_WEAK', '0') == '1'
+PLATE_ASPECT = 4.2  # Indian single-row plate, 500 x 120 mm
+FULL_IMAGE_STAGES = ('gray', 'enhanced', 'threshold')
+
+# Indian registration numbers: MP04AB1234 / DL3CAB1234, and Bharat series 22BH1234AA
+INDIAN_PLATE_PATTERNS = (
+    re.compile(r'^[A-Z]{2}[0-9]{1,2}[A-Z]{0,3}[0-9]{4}$'),
+    re.compile(r'^[0-9]{2}BH[0-9]{4}[A-Z]{1,2}$'),
+)
+INDIAN_PLATE_PREFIX = re.compile(r'^([A-Z]{2}[0-9]|[0-9]{2}BH)')
+
 def get_reader():
     """Initialize and return EasyOCR reader (singleton pattern)"""
     global _reader
@@ -22,6 +39,19 @@ def get_reader():
         _reader = easyocr.Reader(['en'], gpu=False)
     return _reader
 
+def init_ocr_worker(threads=1):
+    """
+    Initializer for OCR pool processes: cap per-process CPU threads so N
+    processes use N cores, then load the EasyOCR model once (warm reader).
+    """
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    get_reader()
+
 def preprocess_image(image_path):
     """Preprocess image for better OCR results"""
     img = cv2.imread(image_path)
@@ -76,6 +106,23 @@ def detect_license_plate_region(image):
     
     return plate_regions
 
+def rank_plate_regions(image, regions):
+    """
+    Order candidate regions by how plate-like their geometry is: aspect
+    ratio close to a standard plate, a plausible share of the frame, and
+    lower in the frame (where plates usually are).
+    """
+    img_h, img_w = image.shape[:2]
+    scored = []
+    for x, y, w, h in regions:
+        aspect_score = max(0.0, 1.0 - abs(w / float(h) - PLATE_ASPECT) / PLATE_ASPECT)
+        area_share = (w * h) / float(img_w * img_h)
+        size_score = 1.0 if 0.002 <= area_share <= 0.15 else 0.3
+        position_score = 0.5 + 0.5 * ((y + h / 2.0) / img_h)
+        scored.append((aspect_score * size_score * position_score, (x, y, w, h)))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [region for _, region in scored]
+
 def clean_license_plate_text(text):
     """Clean and format recognized license plate text"""
     if not text:
@@ -102,6 +149,53 @@ def clean_license_plate_text(text):
     
     return cleaned
 
+def plate_text_likelihood(text):
+    """1.0 for a full Indian registration number, 0.5 for a plausible prefix, else 0.0"""
+    if any(pattern.match(text) for pattern in INDIAN_PLATE_PATTERNS):
+        return 1.0
+    if INDIAN_PLATE_PREFIX.match(text):
+        return 0.5
+    return 0.0
+
+class PlateCandidates:
+    """Best OCR reading so far for one image"""
+
+    def __init__(self, accept_confidence=None):
+        self.accept_confidence = ACCEPT_CONFIDENCE if accept_confidence is None else accept_confidence
+        self.plate = None
+        self.confidence = 0.0
+        self.score = 0.0
+        self.stages = []
+
+    def add(self, results):
+        for (bbox, text, conf) in results:
+            cleaned_text = clean_license_plate_text(text)
+            if not cleaned_text:
+                continue
+            # Readings that look like a registration number win over higher-confidence noise
+            score = conf * (0.5 + 0.5 * plate_text_likelihood(cleaned_text))
+            if score > self.score:
+                self.plate, self.confidence, self.score = cleaned_text, conf, score
+
+    @property
+    def needs_fallback(self):
+        """Whether the full-image stages should run after the region stage"""
+        return self.plate is None or (FALLBACK_ON_WEAK and not self.accepted)
+
+    @property
+    def accepted(self):
+        """Good enough to stop the cascade"""
+        return (self.plate is not None and self.confidence >= self.accept_confidence
+                and plate_text_likelihood(self.plate) == 1.0)
+
+    def result(self):
+        return {
+            'license_number': self.plate,
+            'confidence': self.confidence,
+            'stages': self.stages,
+            'accepted': self.accepted,
+        }
+
 def recognize_license_plate(image_path, use_region_detection=True):
     """
     Main function to recognize license plate from image
@@ -113,64 +207,76 @@ def recognize_license_plate(image_path, use_region_detection=True):
     Returns:
         tuple: (license_plate_text, confidence_score)
     """
+    result = recognize_plate_cascade(image_path, use_region_detection)
+    return result['license_number'], result['confidence']
+
+def recognize_plate_cascade(image_path, use_region_detection=True):
+    """
+    Ranked OCR cascade: the best-ranked plate regions first, then (only if
+    they gave no reading, unless OCR_FALLBACK_ON_WEAK=1) the gray, enhanced
+    and thresholded full image, stopping at the first reading that is a
+    valid Indian registration number with at least OCR_ACCEPT_CONFIDENCE.
+    OCR is restricted to plate characters.
+
+    Returns:
+        dict: license_number, confidence, stages (the stages that ran) and
+        accepted (whether a reading cleared the threshold)
+    """
+    best = PlateCandidates()
     try:
         reader = get_reader()
         
         # Read image
         img = cv2.imread(image_path)
         if img is None:
-            return None, 0.0
-        
-        license_plate = None
-        max_confidence = 0.0
+            return best.result()
         
         if use_region_detection:
-            # Try to detect license plate regions first
-            plate_regions = detect_license_plate_region(img)
-            
-            if plate_regions:
-                # Process each detected region
-                for x, y, w, h in plate_regions:
-                    # Extract region
-                    roi = img[y:y+h, x:x+w]
-                    
-                    # Preprocess ROI
-                    _, _, enhanced, _ = preprocess_image_roi(roi)
-                    
-                    # Perform OCR on region
-                    results = reader.readtext(enhanced)
-                    
-                    for (bbox, text, conf) in results:
-                        cleaned_text = clean_license_plate_text(text)
-                        if cleaned_text and conf > max_confidence:
-                            license_plate = cleaned_text
-                            max_confidence = conf
+            regions = rank_plate_regions(img, detect_license_plate_region(img))[:MAX_REGIONS]
+            if regions:
+                best.stages.append('region')
+            for x, y, w, h in regions:
+                _, _, enhanced = preprocess_image_roi(img[y:y+h, x:x+w])
+                best.add(reader.readtext(enhanced, allowlist=PLATE_CHARS))
+                if best.accepted:
+                    return best.result()
         else:
             # Direct OCR on entire image
-            results = reader.readtext(img)
-            
-            for (bbox, text, conf) in results:
-                cleaned_text = clean_license_plate_text(text)
-                if cleaned_text and conf > max_confidence:
-                    license_plate = cleaned_text
-                    max_confidence = conf
+            best.stages.append('full_image')
+            best.add(reader.readtext(img, allowlist=PLATE_CHARS))
+            if best.accepted:
+                return best.result()
+        
+        if not best.needs_fallback:
+            return best.result()
         
-        # If region detection failed, try full image OCR
-        if not license_plate:
-            preprocessed_images = preprocess_image(image_path)
-            for processed_img in preprocessed_images[1:]:  # Skip original
-                results = reader.readtext(processed_img)
-                for (bbox, text, conf) in results:
-                    cleaned_text = clean_license_plate_text(text)
-                    if cleaned_text and conf > max_confidence:
-                        license_plate = cleaned_text
-                        max_confidence = conf
+        # Fall back to full-image variants, cheapest first
+        for stage, processed_img in full_image_variants(img):
+            best.stages.append(stage)
+            best.add(reader.readtext(processed_img, allowlist=PLATE_CHARS))
+            if best.accepted:
+                break
         
-        return license_plate, max_confidence
+        return best.result()
     
     except Exception as e:
         print(f"Error in license plate recognition: {str(e)}")
-        return None, 0.0
+        return best.result()
+
+def full_image_variants(img):
+    """Yield (stage, image) for FULL_IMAGE_STAGES, computing each only when asked for"""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    yield 'gray', gray
+    
+    denoised = cv2.fastNlMeansDenoising(gray, None, 10, 7, 21)
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    enhanced = clahe.apply(denoised)
+    yield 'enhanced', enhanced
+    
+    yield 'threshold', cv2.adaptiveThreshold(
+        enhanced, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY, 11, 2
+    )
 
 def preprocess_image_roi(roi):
     """Preprocess a region of interest (ROI)"""
@@ -196,18 +302,107 @@ def preprocess_image_roi(roi):
     
     return gray, denoised, enhanced
 
-def batch_process_images(image_paths):
-    """Process multiple images in batch"""
+# Batched pipeline: ROIs are normalized to a few fixed sizes so one detector
+# pass covers many of them (readtext_batched needs equal-sized images)
+ROI_HEIGHT = 96
+ROI_ASPECTS = (2, 3, 4, 5)
+
+def normalize_roi(enhanced):
+    """Resize a preprocessed plate ROI to the nearest standard plate size"""
+    h, w = enhanced.shape[:2]
+    aspect = min(ROI_ASPECTS, key=lambda a: abs(a - w / float(h)))
+    return cv2.resize(enhanced, (ROI_HEIGHT * aspect, ROI_HEIGHT), interpolation=cv2.INTER_CUBIC)
+
+def readtext_grouped(reader, items, batch_size):
+    """
+    Run OCR on [(key, image)] with one readtext_batched call per group of
+    same-sized images (at most batch_size per call).
+
+    Returns:
+        list: (key, text, confidence) for every text box found
+    """
+    by_shape = {}
+    for key, image in items:
+        by_shape.setdefault(image.shape, []).append((key, image))
+    found = []
+    for group in by_shape.values():
+        for start in range(0, len(group), batch_size):
+            chunk = group[start:start + batch_size]
+            results = reader.readtext_batched([image for _, image in chunk], batch_size=batch_size,
+                                              allowlist=PLATE_CHARS)
+            for (key, _), image_results in zip(chunk, results):
+                for (bbox, text, conf) in image_results:
+                    found.append((key, text, conf))
+    return found
+
+def batch_process_images(image_paths, batch_size=16):
+    """
+    Process multiple images in batch
+
+    Same cascade as recognize_plate_cascade, but each stage sends the
+    candidates of many images through the model together. Images are taken
+    a few batches at a time to bound memory.
+    """
     results = []
-    for image_path in image_paths:
-        plate, confidence = recognize_license_plate(image_path)
-        results.append({
-            'image_path': image_path,
-            'license_plate': plate,
-            'confidence': confidence
-        })
+    step = batch_size * 4
+    for start in range(0, len(image_paths), step):
+        chunk = image_paths[start:start + step]
+        for image_path, result in zip(chunk, recognize_batch(chunk, batch_size)):
+            results.append({
+                'image_path': image_path,
+                'license_plate': result['license_number'],
+                'confidence': result['confidence']
+            })
     return results
 
+def recognize_batch(image_paths, batch_size=16):
+    """
+    Batched recognize_plate_cascade
+
+    Returns:
+        list: recognize_plate_cascade result per image, in order
+    """
+    reader = get_reader()
+    best = [PlateCandidates() for _ in image_paths]
+    images = [cv2.imread(image_path) for image_path in image_paths]
+
+    # Stage 1: the best-ranked plate regions of every image
+    rois = []
+    for i, img in enumerate(images):
+        if img is None:
+            continue
+        regions = rank_plate_regions(img, detect_license_plate_region(img))[:MAX_REGIONS]
+        if regions:
+            best[i].stages.append('region')
+        for x, y, w, h in regions:
+            _, _, enhanced = preprocess_image_roi(img[y:y+h, x:x+w])
+            rois.append((i, normalize_roi(enhanced)))
+    try:
+        for i, text, conf in readtext_grouped(reader, rois, batch_size):
+            best[i].add([(None, text, conf)])
+    except Exception as e:
+        print(f"Error in batched plate region OCR: {str(e)}")
+    del rois
+
+    # Stage 2: full-image variants, one batched pass per variant, for images that need them
+    pending = [i for i, img in enumerate(images) if img is not None and best[i].needs_fallback]
+    variants = {i: full_image_variants(images[i]) for i in pending}
+    for stage in FULL_IMAGE_STAGES:
+        if not pending:
+            break
+        items = []
+        for i in pending:
+            best[i].stages.append(stage)
+            items.append((i, next(variants[i])[1]))
+        try:
+            for i, text, conf in readtext_grouped(reader, items, batch_size):
+                best[i].add([(None, text, conf)])
+        except Exception as e:
+            print(f"Error in batched {stage} OCR: {str(e)}")
+        pending = [i for i in pending if not best[i].accepted]
+
+    return [candidates.result() for candidates in best]
+
 # Test function
 if __name__ == '__main__':
     # Example usage
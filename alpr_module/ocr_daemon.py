@@ -0,0 +1,149 @@
+"""
+Shared OCR daemon for AutoFINE
+
+One process loads the EasyOCR model and serves plate recognition to every
+web worker on the host over a Unix socket, so gunicorn workers (and their
+OCR pools) no longer each hold a copy of the weights:
+
+    python -m alpr_module.ocr_daemon            # listens on OCR_SOCKET
+
+The web side (ocr_executor.py) sends jobs here while the socket accepts
+connections and falls back to its own pool otherwise. The daemon must run on
+the same host as the web workers (Procfile `ocr`).
+
+Protocol: one JSON object per line in each direction.
+
+    -> {"id": "...", "image_path": "/abs/path.jpg"}
+    <- {"id": "...", "license_number": "UK07AB1234", "confidence": 0.91,
+        "stages": ["region"], "accepted": true}
+    <- {"id": "...", "error": "..."}
+
+Requests arriving together are batched: the batcher takes up to
+OCR_BATCH_SIZE requests, waiting at most OCR_BATCH_WINDOW_MS for the batch
+to fill, drops duplicate images and recognizes the batch with one batched
+model pass per stage (`recognize_batch`). Up to OCR_DAEMON_THREADS batches
+run at once on the shared reader (OpenCV and torch release the GIL).
+"""
+
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .license_plate_recognition import init_ocr_worker, recognize_batch
+
+SOCKET_PATH = os.environ.get('OCR_SOCKET', '/tmp/autofine-ocr.sock')
+BATCH_SIZE = int(os.environ.get('OCR_BATCH_SIZE', '8'))
+BATCH_WINDOW = float(os.environ.get('OCR_BATCH_WINDOW_MS', '20')) / 1000.0
+THREADS = int(os.environ.get('OCR_DAEMON_THREADS', str(os.cpu_count() or 2)))
+
+
+class _Request:
+    __slots__ = ('id', 'image_path', 'reply')
+
+    def __init__(self, request_id, image_path, reply):
+        self.id = request_id
+        self.image_path = image_path
+        self.reply = reply
+
+
+class Batcher:
+    """Collects queued requests into batches and runs them on the shared reader"""
+
+    def __init__(self, batch_size=BATCH_SIZE, window=BATCH_WINDOW, threads=THREADS):
+        self.batch_size = batch_size
+        self.window = window
+        self.requests = queue.Queue()
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='ocr')
+        # Only form the next batch once a thread is free, so waiting requests keep joining it
+        self.free_threads = threading.Semaphore(threads)
+
+    def put(self, request):
+        self.requests.put(request)
+
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            self.free_threads.acquire()
+            self.pool.submit(self._run_batch, self._next_batch())
+
+    def _run_batch(self, batch):
+        try:
+            by_path = {}
+            for request in batch:
+                by_path.setdefault(request.image_path, []).append(request)
+            try:
+                responses = recognize_batch(list(by_path), batch_size=self.batch_size)
+            except Exception as e:
+                responses = [{'error': str(e)}] * len(by_path)
+            for requests, response in zip(by_path.values(), responses):
+                for request in requests:
+                    request.reply(dict(response, id=request.id))
+        finally:
+            self.free_threads.release()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        write_lock = threading.Lock()
+
+        def reply(message):
+            data = (json.dumps(message) + '\n').encode('utf-8')
+            with write_lock:
+                try:
+                    self.wfile.write(data)
+                    self.wfile.flush()
+                except (OSError, ValueError):
+                    pass  # client went away (its handler may already have closed the stream)
+
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+                self.server.batcher.put(_Request(message.get('id'), message['image_path'], reply))
+            except (ValueError, KeyError) as e:
+                reply({'error': f'Bad request: {e}'})
+
+
+class OCRServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, batcher):
+        if os.path.exists(path):
+            os.unlink(path)  # stale socket from a previous run
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o660)
+        self.batcher = batcher
+
+
+def serve(path=SOCKET_PATH):
+    # The batch threads run concurrently: split the cores between them rather than oversubscribe
+    init_ocr_worker(threads=max(1, (os.cpu_count() or 1) // THREADS))
+    batcher = Batcher()
+    threading.Thread(target=batcher.run, name='ocr-batcher', daemon=True).start()
+    server = OCRServer(path, batcher)
+    print(f"OCR daemon listening on {path} (batch {batcher.batch_size}, {THREADS} threads)")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    serve()
@@ -17,8 +17,21 @@ import json
 import time
 import threading
 import random
-from sms_service import send_sms
-from traffic_rules import calculate_fine
+import click
+from traffic_rules import calculate_fine, calculate_fines
+from challan_queries import parse_challan_filters, paginate_challans, DEFAULT_PAGE_SIZE
+from query_budget import query_budget, init_query_budget
+from outbound import outbound_call, init_outbound, outbound_status, CircuitOpenError, DeadlineExceeded
+from challan_counters import dashboard_stats, status_counts, violation_counts, reconcile_counters
+from challan_search import search_challans, rebuild_search_index, seed_search_index
+from challan_events import read_events, prune_events, latest_seq
+from challan_bulk import issue_challans, MAX_BULK_ITEMS
+from offence_counters import rebuild_offence_counters, seed_offence_counters
+from challan_log import log_challans
+from notification_queue import notification_dispatcher, queue_email, queue_sms, POLL_INTERVAL
+from reference_cache import get_cities, get_violation_types, get_camera
+from realtime_broker import challan_broker, stream_events, format_sse
+from challan_export import stream_challans, negotiate_format, accepts_gzip, EXPORT_MIMETYPES
 import uuid
 
 
@@ -37,29 +50,42 @@ app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Per-route SQL query budgets are always checked in debug mode; set these to check/enforce elsewhere
+app.config['QUERY_BUDGET_ENABLED'] = os.environ.get('QUERY_BUDGET_ENABLED') == '1'
+app.config['QUERY_BUDGET_STRICT'] = os.environ.get('QUERY_BUDGET_STRICT') == '1'
 
 # Initialize extensions
 from models import db
 db.init_app(app)
 bcrypt = Bcrypt(app)
+init_query_budget(app)
+init_outbound(app)
+challan_broker.init_app(app)
+notification_dispatcher.init_app(app)
 
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs('static/uploads', exist_ok=True)
 
 # Import models after db initialization
-from models import User, Vehicle, Challan, Violation, Camera, Notice, Report, DriverLicense, Appeal, PaymentPlan
+from models import User, Vehicle, Challan, Violation, Camera, Notice, Report, DriverLicense, Appeal, PaymentPlan, OcrJob
 
 # Import Gemini service
-from gemini_service import generate_traffic_news, generate_notice_summary, get_traffic_rules_explanation, generate_appeal_guidance, get_predictive_insights, get_gemini_model
+from gemini_service import generate_traffic_news, generate_traffic_notices, generate_notice_summary, get_traffic_rules_explanation, generate_appeal_guidance, get_predictive_insights, get_gemini_model, generate_text, stream_generate
+from content_scheduler import content_scheduler, get_artifact, city_key
+from appeal_guidance import guidance_worker, request_guidance, guidance_for_appeal, guidance_payload, ensure_guidance_link_column
+from ocr_executor import ocr_executor, job_payload, OCRQueueFull, OCRUnavailable, RETRY_AFTER_SECONDS as OCR_RETRY_AFTER_SECONDS
+content_scheduler.init_app(app, cities=lambda: [c['city'] for c in CITY_COORDS.values()])
+guidance_worker.init_app(app)
+ocr_executor.init_app(app)
 
 # Routes
 @app.route('/')
 def index():
     """Home page with Gemini-generated news"""
-    # Get real-time traffic news from Gemini
+    # Pre-generated by the content scheduler; the cached call only covers a cold start
     try:
-        news = generate_traffic_news()
+        news = get_artifact('news') or generate_traffic_news()
     except Exception as e:
         print(f"Error generating news: {e}")
         news = {
@@ -164,6 +190,7 @@ def logout():
     return redirect(url_for('index'))
 
 @app.route('/owner/dashboard')
+@query_budget(3)
 def owner_dashboard():
     """Vehicle owner dashboard"""
     if 'user_id' not in session or session.get('user_type') != 'owner':
@@ -174,11 +201,12 @@ def owner_dashboard():
     
     # Get all challans for user's vehicles
     vehicle_ids = [v.id for v in vehicles]
-    challans = Challan.query.filter(Challan.vehicle_id.in_(vehicle_ids)).order_by(Challan.created_at.desc()).all()
+    challans = Challan.query.options(Challan.with_vehicle()).filter(Challan.vehicle_id.in_(vehicle_ids)).order_by(Challan.created_at.desc()).all()
     
     return render_template('owner/dashboard.html', vehicles=vehicles, challans=challans)
 
 @app.route('/owner/vehicle/<int:vehicle_id>')
+@query_budget(3)
 def owner_vehicle_detail(vehicle_id):
     """Vehicle detail page for owner"""
     if 'user_id' not in session:
@@ -205,11 +233,12 @@ def owner_vehicle_detail(vehicle_id):
 
 
 @app.route('/challan/<int:challan_id>/pay')
+@query_budget(3)
 def challan_pay_page(challan_id):
     """Dedicated payment page for a challan: details, Razorpay button, QR code."""
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    challan = Challan.query.get_or_404(challan_id)
+    challan = Challan.query.options(Challan.with_vehicle()).get_or_404(challan_id)
     if challan.status == 'Paid':
         flash('This challan is already paid.', 'info')
         return redirect(url_for('owner_dashboard'))
@@ -241,43 +270,35 @@ def challan_pay_page(challan_id):
     return render_template('owner/pay_challan.html', challan=challan, qr_base64=qr_base64, payment_page_url=payment_page_url)
 
 @app.route('/admin/dashboard')
+@query_budget(3)
 def admin_dashboard():
     """Admin dashboard"""
     if 'user_id' not in session or session.get('user_type') != 'admin':
         return redirect(url_for('login'))
     
-    # Statistics
-    total_vehicles = Vehicle.query.count()
-    total_challans = Challan.query.count()
-    unpaid_challans = Challan.query.filter_by(status='Unpaid').count()
-    paid_challans = Challan.query.filter_by(status='Paid').count()
+    # Statistics (write-maintained counters, no table scans)
+    stats = dashboard_stats()
     
     # Recent challans
-    recent_challans = Challan.query.order_by(Challan.created_at.desc()).limit(10).all()
-    
-    stats = {
-        'total_vehicles': total_vehicles,
-        'total_challans': total_challans,
-        'unpaid_challans': unpaid_challans,
-        'paid_challans': paid_challans
-    }
+    recent_challans = Challan.query.options(Challan.with_vehicle()).order_by(Challan.created_at.desc()).limit(10).all()
     
     return render_template('admin/dashboard.html', stats=stats, recent_challans=recent_challans)
 
 @app.route('/admin/vehicles')
+@query_budget(3)
 def admin_vehicles():
     """Admin - View all vehicles"""
     if 'user_id' not in session or session.get('user_type') != 'admin':
         return redirect(url_for('login'))
     
     search = request.args.get('search', '')
+    query = Vehicle.query.options(Vehicle.with_owner())
     if search:
-        vehicles = Vehicle.query.filter(
+        query = query.filter(
             (Vehicle.license_number.like(f'%{search}%')) |
             (Vehicle.model.like(f'%{search}%'))
-        ).all()
-    else:
-        vehicles = Vehicle.query.all()
+        )
+    vehicles = query.all()
     
     # Assign random colors to vehicles missing color
     try:
@@ -289,68 +310,77 @@ def admin_vehicles():
                 changed = True
         if changed:
             db.session.commit()
+            # Commit expired every row; reload in one pass instead of one query per vehicle
+            vehicles = query.all()
     except Exception:
         pass
     
-    return render_template('admin/vehicles.html', vehicles=vehicles, search=search)
+    # One grouped COUNT instead of loading every vehicle's challan list in the template
+    counts_query = db.session.query(Challan.vehicle_id, db.func.count(Challan.id))
+    if search:
+        counts_query = counts_query.filter(Challan.vehicle_id.in_([v.id for v in vehicles]))
+    challan_counts = dict(counts_query.group_by(Challan.vehicle_id).all()) if vehicles else {}
+    
+    return render_template('admin/vehicles.html', vehicles=vehicles, search=search, challan_counts=challan_counts)
 
 @app.route('/admin/challans')
+@query_budget(3)
 def admin_challans():
-    """Admin - View all challans"""
+    """Admin - View challans, one keyset page at a time"""
     if 'user_id' not in session or session.get('user_type') != 'admin':
         return redirect(url_for('login'))
     
-    status_filter = request.args.get('status', '')
-    search = request.args.get('search', '')
-    
-    query = Challan.query
-    
-    if status_filter:
-        query = query.filter_by(status=status_filter)
-    
-    if search:
-        query = query.join(Vehicle).filter(Vehicle.license_number.like(f'%{search}%'))
-    
-    challans = query.order_by(Challan.created_at.desc()).all()
-    view_challans = []
-    for ch in challans:
-        try:
-            lic = ch.vehicle.license_number if ch.vehicle else 'N/A'
-        except Exception:
-            lic = 'N/A'
-        try:
-            created_str = ch.created_at.strftime('%Y-%m-%d %H:%M') if ch.created_at else 'N/A'
-        except Exception:
-            created_str = 'N/A'
-        try:
-            due_str = ch.due_date.strftime('%Y-%m-%d') if ch.due_date else 'N/A'
-        except Exception:
-            due_str = 'N/A'
-        view_challans.append({
-            'id': ch.id,
-            'license_number': lic,
-            'violation_type': ch.violation_type,
-            'location': ch.location or 'N/A',
-            'fine_amount': ch.fine_amount,
-            'due_date': due_str,
-            'status': ch.status,
-            'created_at': created_str
-        })
+    filters = parse_challan_filters(request.args)
+    cursor = request.args.get('cursor', '')
+    per_page = request.args.get('per_page', DEFAULT_PAGE_SIZE, type=int)
+    
+    rows, next_cursor = paginate_challans(filters, cursor=cursor, per_page=per_page)
+    view_challans = [{
+        'id': row.id,
+        'license_number': row.license_number or 'N/A',
+        'violation_type': row.violation_type,
+        'location': row.location or 'N/A',
+        'fine_amount': row.fine_amount,
+        'due_date': row.due_date.strftime('%Y-%m-%d') if row.due_date else 'N/A',
+        'status': row.status,
+        'created_at': row.created_at.strftime('%Y-%m-%d %H:%M') if row.created_at else 'N/A'
+    } for row in rows]
+    violation_types = get_violation_types()
     
     try:
-        return render_template('admin/challans.html', challans=view_challans, status_filter=status_filter, search=search)
+        return render_template(
+            'admin/challans.html',
+            challans=view_challans,
+            filters=filters,
+            status_filter=filters['status'],
+            search=filters['plate_prefix'],
+            violation_types=violation_types,
+            cursor=cursor,
+            next_cursor=next_cursor,
+            per_page=per_page
+        )
     except Exception as e:
         return f"Template error: {str(e)}", 500
 
 @app.route('/admin/challans.json')
 def admin_challans_json():
+    """Streaming challan export (JSON / NDJSON / CSV, gzip if accepted); honours the listing filters"""
     if 'user_id' not in session or session.get('user_type') != 'admin':
         return jsonify({'error': 'Unauthorized'}), 401
-    try:
-        challans = Challan.query.order_by(Challan.created_at.desc()).all()
-        return jsonify({'data': [c.to_dict() for c in challans]})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    fmt = negotiate_format(request.args.get('format'), request.headers.get('Accept'))
+    use_gzip = accepts_gzip(request.headers.get('Accept-Encoding'))
+    filters = parse_challan_filters(request.args)
+    headers = {'Vary': 'Accept, Accept-Encoding', 'X-Accel-Buffering': 'no'}
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+    if fmt == 'csv':
+        headers['Content-Disposition'] = f"attachment; filename=challans_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return Response(
+        stream_with_context(stream_challans(filters, fmt=fmt, gzip=use_gzip)),
+        mimetype=EXPORT_MIMETYPES[fmt],
+        headers=headers
+    )
+
 @app.route('/admin/challans/new', methods=['GET', 'POST'])
 def admin_challan_new():
     """Admin - Generate challan manually with full owner and vehicle details"""
@@ -416,88 +446,36 @@ def admin_challan_new():
         due_date=datetime.now() + timedelta(days=30)
     )
     db.session.add(challan)
+    # Queued in the same transaction; sent by the notification workers
+    queue_sms(owner.phone, f"Challan issued for {vehicle.license_number}. Violation: {challan_type}, Fine: ₹{amount}. UIN: {challan.uin}")
     db.session.commit()
-    try:
-        import csv, os
-        csv_dir = os.path.join(os.path.dirname(__file__), 'data')
-        os.makedirs(csv_dir, exist_ok=True)
-        csv_path = os.path.join(csv_dir, 'challan_generation.csv')
-        write_header = not os.path.exists(csv_path)
-        with open(csv_path, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            if write_header:
-                writer.writerow(['timestamp','license_number','owner_name','vehicle_type','challan_type','location','amount','challan_id','uin'])
-            writer.writerow([datetime.now().isoformat(), registration_number, owner_name, vehicle_type, challan_type, location, amount, challan.id, challan.uin])
-    except Exception:
-        pass
-    try:
-        if owner.phone:
-            send_sms(owner.phone, f"Challan issued for {vehicle.license_number}. Violation: {challan_type}, Fine: ₹{amount}. UIN: {challan.uin}")
-    except Exception:
-        pass
+    log_challans([[datetime.now().isoformat(), registration_number, owner_name, vehicle_type, challan_type, location, amount, challan.id, challan.uin]])
     flash(f'Challan created: #{challan.id} for {vehicle.license_number}', 'success')
     return redirect(url_for('admin_challans'))
 
 @app.route('/admin/challan/<int:challan_id>')
+@query_budget(2)
 def admin_challan_detail(challan_id):
     """Admin detailed challan view."""
     if 'user_id' not in session or session.get('user_type') != 'admin':
         return redirect(url_for('login'))
-    challan = Challan.query.get_or_404(challan_id)
+    challan = Challan.query.options(Challan.with_vehicle_owner()).get_or_404(challan_id)
     owner = challan.vehicle.owner if challan.vehicle else None
     return render_template('admin/challan_detail.html', challan=challan, owner=owner)
 
 @app.route('/public/lookup', methods=['GET', 'POST'])
+@query_budget(3)
 def public_lookup():
-    """Public challan lookup by UIN / Vehicle No / DL No with optional city filter."""
-    results = []
+    """Public challan lookup by UIN / Vehicle No / DL No with optional city filter (indexed search)."""
     q = request.values.get('q', '').strip()
     city = request.values.get('city', '').strip()
-    if q:
-        q_norm = q.strip()
-        q_upper = q_norm.upper()
-
-        # Use outerjoin to include challans even if owner has no DL number
-        query = Challan.query.join(Vehicle).outerjoin(User, Vehicle.owner_id == User.id)
-
-        # Support searching by:
-        # - Exact / partial UIN
-        # - Exact / partial Vehicle number
-        # - Exact / partial DL number
-        # - Numeric challan id (e.g., "12" or "#12")
-        or_filters = []
-
-        # numeric challan id
-        q_digits = q_norm.replace('#', '').strip()
-        if q_digits.isdigit():
-            or_filters.append(Challan.id == int(q_digits))
-
-        # use like for partial match (case-insensitive for SQLite compatibility)
-        like = f"%{q_norm}%"
-        like_upper = f"%{q_upper}%"
-        
-        # Search by UIN and Vehicle number (primary search)
-        or_filters.extend([
-            Challan.uin.like(like),
-            Challan.uin.like(like_upper),
-            Vehicle.license_number.like(like),
-            Vehicle.license_number.like(like_upper),
-        ])
-        
-        # Also search by DL number if user exists
-        or_filters.extend([
-            User.dl_number.like(like),
-            User.dl_number.like(like_upper),
-        ])
-
-        query = query.filter(db.or_(*or_filters))
-        if city:
-            query = query.filter(Vehicle.city == city)
-        results = query.order_by(Challan.created_at.desc()).limit(50).all()
-    cities = [r[0] for r in db.session.query(Vehicle.city).distinct().filter(Vehicle.city.isnot(None)).all()]
-    return render_template('public/lookup.html', q=q, city=city, cities=sorted(cities), results=results)
+    # Exact / prefix / suffix match on UIN, vehicle number or DL number, or a numeric challan id
+    results = search_challans(q, city=city or None, limit=50) if q else []
+    cities = get_cities()
+    return render_template('public/lookup.html', q=q, city=city, cities=cities, results=results)
 
 @app.route('/public/notices')
+@query_budget(2)
 def public_notices():
     """Traffic notices (State/Central)."""
     from models import Notice
@@ -505,6 +483,7 @@ def public_notices():
     return render_template('public/notices.html', notices=notices)
 
 @app.route('/public/report', methods=['GET', 'POST'])
+@query_budget(3)
 def public_report():
     """Report illegal activity / mishap."""
     from models import Report
@@ -521,31 +500,27 @@ def public_report():
             details=details
         )
         db.session.add(r)
-        db.session.commit()
 
         # Email the report (configurable SMTP). Sends to karan2609n@gmail.com by default.
-        try:
-            from email_service import send_email
-            import os as _os
-            to_email = _os.environ.get("REPORT_TO_EMAIL", "karan2609n@gmail.com")
-            subject = f"AutoFINE Incident Report - {report_type or 'report'} - {city or 'N/A'}"
-            body = (
-                f"New incident report submitted in AutoFINE.\n\n"
-                f"Type: {report_type}\n"
-                f"City: {city}\n"
-                f"Location: {location}\n"
-                f"Details:\n{details}\n\n"
-                f"Reporter user id: {session.get('user_id')}\n"
-            )
-            send_email(to_email, subject, body)
-        except Exception as e:
-            # Do not block the report if email is not configured
-            print(f"Report email not sent: {e}")
+        # Queued with the report; the notification workers deliver and retry it.
+        import os as _os
+        to_email = _os.environ.get("REPORT_TO_EMAIL", "karan2609n@gmail.com")
+        subject = f"AutoFINE Incident Report - {report_type or 'report'} - {city or 'N/A'}"
+        body = (
+            f"New incident report submitted in AutoFINE.\n\n"
+            f"Type: {report_type}\n"
+            f"City: {city}\n"
+            f"Location: {location}\n"
+            f"Details:\n{details}\n\n"
+            f"Reporter user id: {session.get('user_id')}\n"
+        )
+        queue_email(to_email, subject, body)
+        db.session.commit()
 
         flash('Report submitted successfully.', 'success')
         return redirect(url_for('public_report'))
-    cities = [r[0] for r in db.session.query(Vehicle.city).distinct().filter(Vehicle.city.isnot(None)).all()]
-    return render_template('public/report.html', cities=sorted(cities))
+    cities = get_cities()
+    return render_template('public/report.html', cities=cities)
 
 @app.route('/admin/challan/generate', methods=['POST'])
 def admin_challan_generate():
@@ -596,8 +571,8 @@ def admin_challan_generate():
             db.session.add(vehicle)
             db.session.commit()
         
-        fine_amount = amount if amount > 0 else calculate_fine(challan_type, vehicle.id)[0]
-        _, is_subsequent, court_mandatory = calculate_fine(challan_type, vehicle.id)
+        computed_fine, is_subsequent, court_mandatory = calculate_fine(challan_type, vehicle.id)
+        fine_amount = amount if amount > 0 else computed_fine
         status = 'Court' if court_mandatory else 'Unpaid'
         license_action = "Suspend 3 months" if challan_type == "No Helmet" and is_subsequent else None
         
@@ -611,42 +586,26 @@ def admin_challan_generate():
             due_date=datetime.now() + timedelta(days=30),
         )
         db.session.add(challan)
+        owner = vehicle.owner
+        if owner and owner.phone:
+            if status == "Court":
+                queue_sms(owner.phone, f"Court Challan issued. UIN: {challan.uin}, Vehicle: {vehicle.license_number}, Violation: {challan_type}. Visit court for further process.")
+            else:
+                queue_sms(owner.phone, f"Challan issued. UIN: {challan.uin}, Vehicle: {vehicle.license_number}, Violation: {challan_type}, Fine: ₹{fine_amount}.")
         db.session.commit()
         
-        # Append to CSV log
-        try:
-            import csv, os
-            csv_dir = os.path.join(os.path.dirname(__file__), 'data')
-            os.makedirs(csv_dir, exist_ok=True)
-            csv_path = os.path.join(csv_dir, 'challan_generation.csv')
-            write_header = not os.path.exists(csv_path)
-            with open(csv_path, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                if write_header:
-                    writer.writerow(['timestamp','license_number','owner_name','vehicle_type','challan_type','location','amount','challan_id','uin'])
-                writer.writerow([
-                    datetime.now().isoformat(),
-                    license_number,
-                    owner_name,
-                    vehicle_type,
-                    challan_type,
-                    location,
-                    fine_amount,
-                    challan.id,
-                    challan.uin
-                ])
-        except Exception:
-            pass
-        
-        try:
-            owner = vehicle.owner
-            if owner and owner.phone:
-                if status == "Court":
-                    send_sms(owner.phone, f"Court Challan issued. UIN: {challan.uin}, Vehicle: {vehicle.license_number}, Violation: {challan_type}. Visit court for further process.")
-                else:
-                    send_sms(owner.phone, f"Challan issued. UIN: {challan.uin}, Vehicle: {vehicle.license_number}, Violation: {challan_type}, Fine: ₹{fine_amount}.")
-        except Exception:
-            pass
+        # Buffered; written by the challan log flusher thread
+        log_challans([[
+            datetime.now().isoformat(),
+            license_number,
+            owner_name,
+            vehicle_type,
+            challan_type,
+            location,
+            fine_amount,
+            challan.id,
+            challan.uin
+        ]])
         
         return jsonify({
             'success': True,
@@ -700,8 +659,8 @@ def process_violation_compat():
             )
             db.session.add(vehicle)
             db.session.commit()
-        fine_amount = amount if amount > 0 else calculate_fine(challan_type, vehicle.id)[0]
-        _, is_subsequent, court_mandatory = calculate_fine(challan_type, vehicle.id)
+        computed_fine, is_subsequent, court_mandatory = calculate_fine(challan_type, vehicle.id)
+        fine_amount = amount if amount > 0 else computed_fine
         status = 'Court' if court_mandatory else 'Unpaid'
         challan = Challan(
             vehicle_id=vehicle.id,
@@ -714,19 +673,7 @@ def process_violation_compat():
         )
         db.session.add(challan)
         db.session.commit()
-        try:
-            import csv, os
-            csv_dir = os.path.join(os.path.dirname(__file__), 'data')
-            os.makedirs(csv_dir, exist_ok=True)
-            csv_path = os.path.join(csv_dir, 'challan_generation.csv')
-            write_header = not os.path.exists(csv_path)
-            with open(csv_path, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                if write_header:
-                    writer.writerow(['timestamp','license_number','owner_name','vehicle_type','challan_type','location','amount','challan_id','uin'])
-                writer.writerow([datetime.now().isoformat(), license_number, owner_name, vehicle_type, challan_type, location, fine_amount, challan.id, challan.uin])
-        except Exception:
-            pass
+        log_challans([[datetime.now().isoformat(), license_number, owner_name, vehicle_type, challan_type, location, fine_amount, challan.id, challan.uin]])
         return jsonify({
             'success': True,
             'license_number': license_number,
@@ -739,27 +686,58 @@ def process_violation_compat():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/challans/bulk', methods=['POST'])
+def bulk_issue_challans():
+    """Issue challans for many detections in one request (one commit, per-item results)"""
+    if 'user_id' not in session or session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True)
+    detections = data.get('detections') if isinstance(data, dict) else data
+    if not isinstance(detections, list) or not detections:
+        return jsonify({'error': 'Expected a non-empty list of detections'}), 400
+    if len(detections) > MAX_BULK_ITEMS:
+        return jsonify({'error': f'At most {MAX_BULK_ITEMS} detections per request'}), 413
+    notify = not (isinstance(data, dict) and data.get('notify') is False)
+    
+    try:
+        from sqlalchemy import text
+        res = db.session.execute(text("SELECT id FROM users WHERE user_type='owner' ORDER BY id LIMIT 1")).first()
+        default_owner_id = res[0] if res else session.get('user_id')
+        results = issue_challans(detections, default_owner_id=default_owner_id, notify=notify)
+        issued = sum(1 for r in results if r and r['success'])
+        return jsonify({
+            'success': True,
+            'issued': issued,
+            'failed': len(results) - issued,
+            'results': results
+        })
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/challan/<int:challan_id>/pay', methods=['POST'])
+@query_budget(5)
 def pay_challan(challan_id):
     """Mark challan as paid (payment gateway integration can be added later)"""
-    challan = Challan.query.get_or_404(challan_id)
+    challan = Challan.query.options(Challan.with_vehicle_owner()).get_or_404(challan_id)
     
     if session.get('user_type') == 'admin':
         challan.status = 'Paid'
         challan.paid_at = datetime.now()
+        owner = challan.vehicle.owner if challan.vehicle else None
+        phone = getattr(owner, "phone", None) if owner else None
+        queue_sms(phone, f"Challan #{challan.id} for {challan.vehicle.license_number if challan.vehicle else ''} has been paid. Amount: ₹{challan.fine_amount}.")
         db.session.commit()
-        try:
-            owner = challan.vehicle.owner if challan.vehicle else None
-            phone = getattr(owner, "phone", None) if owner else None
-            if phone:
-                send_sms(phone, f"Challan #{challan.id} for {challan.vehicle.license_number if challan.vehicle else ''} has been paid. Amount: ₹{challan.fine_amount}.")
-        except Exception:
-            pass
         return jsonify({'success': True, 'message': 'Challan marked as paid'})
     
     return jsonify({'error': 'Unauthorized'}), 401
 
 @app.route('/api/payments/mock', methods=['POST'])
+@query_budget(5)
 def mock_payment():
     """Mock payment gateway for challans; marks paid and sends SMS."""
     data = request.get_json() or {}
@@ -770,7 +748,7 @@ def mock_payment():
     payment_ref = data.get('payment_ref', f"UKPAY-{int(time.time())}")
     if not challan_id:
         return jsonify({'error': 'challan_id required'}), 400
-    challan = Challan.query.get_or_404(challan_id)
+    challan = Challan.query.options(Challan.with_vehicle_owner()).get_or_404(challan_id)
     if challan.status == 'Court' or challan.violation_type == 'Drunk Driving':
         return jsonify({'error': 'Court challan cannot be paid online', 'challan_id': challan.id}), 400
     if challan.status == 'Paid':
@@ -778,14 +756,10 @@ def mock_payment():
     challan.status = 'Paid'
     challan.paid_at = datetime.now()
     challan.notes = f"Mock payment ref: {payment_ref}"
+    owner = challan.vehicle.owner if challan.vehicle else None
+    phone = getattr(owner, "phone", None) if owner else None
+    queue_sms(phone, f"Payment received for Challan #{challan.id} ({challan.violation_type}). Amount: ₹{challan.fine_amount}. Ref: {payment_ref}")
     db.session.commit()
-    try:
-        owner = challan.vehicle.owner if challan.vehicle else None
-        phone = getattr(owner, "phone", None) if owner else None
-        if phone:
-            send_sms(phone, f"Payment received for Challan #{challan.id} ({challan.violation_type}). Amount: ₹{challan.fine_amount}. Ref: {payment_ref}")
-    except Exception:
-        pass
     return jsonify({'success': True, 'payment_ref': payment_ref, 'challan_id': challan.id})
 
 
@@ -839,7 +813,8 @@ def razorpay_create_order():
             'receipt': f'challan_{challan.id}_{uuid.uuid4().hex[:8]}',
             'notes': {'challan_id': str(challan.id), 'uin': challan.uin or ''}
         }
-        order = client.order.create(data=order_data)
+        with outbound_call('razorpay') as call:
+            order = client.order.create(data=order_data, timeout=call.timeout)
         return jsonify({
             'success': True,
             'order_id': order['id'],
@@ -849,6 +824,9 @@ def razorpay_create_order():
             'challan_id': challan_id,
             'uin': challan.uin
         })
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        # Same shape as the missing-package case: the page offers mock payment instead
+        return jsonify({'error': f'Payment gateway unavailable: {e}', 'fallback_mock': True}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -869,7 +847,7 @@ def razorpay_verify():
     challan_id = data.get('challan_id')
     if not all([razorpay_payment_id, razorpay_order_id, razorpay_signature, challan_id]):
         return jsonify({'error': 'Missing payment details'}), 400
-    challan = Challan.query.get_or_404(challan_id)
+    challan = Challan.query.options(Challan.with_vehicle_owner()).get_or_404(challan_id)
     if challan.status == 'Paid':
         return jsonify({'success': True, 'message': 'Already paid', 'challan_id': challan.id})
     try:
@@ -888,14 +866,10 @@ def razorpay_verify():
         challan.paid_at = datetime.now()
         challan.payment_ref = razorpay_payment_id
         challan.notes = (challan.notes or '') + f' Razorpay: {razorpay_payment_id}'
+        owner = challan.vehicle.owner if challan.vehicle else None
+        phone = getattr(owner, 'phone', None) if owner else None
+        queue_sms(phone, f"Payment received for Challan #{challan.id}. Amount: ₹{challan.fine_amount}. Ref: {razorpay_payment_id}")
         db.session.commit()
-        try:
-            owner = challan.vehicle.owner if challan.vehicle else None
-            phone = getattr(owner, 'phone', None) if owner else None
-            if phone:
-                send_sms(phone, f"Payment received for Challan #{challan.id}. Amount: ₹{challan.fine_amount}. Ref: {razorpay_payment_id}")
-        except Exception:
-            pass
         return jsonify({
             'success': True,
             'message': 'Payment successful',
@@ -909,67 +883,62 @@ def razorpay_verify():
         return jsonify({'error': str(e)}), 500
 
 
+# Keep proxies (nginx, Heroku router) from buffering or caching event streams
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def _last_event_id():
+    # Browsers resend the header on automatic reconnects; realtime.js passes it as a query arg
+    return request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+
+def _sse_response(stream, subscription):
+    response = Response(stream, mimetype='text/event-stream', headers=SSE_HEADERS)
+    # Runs even if the client goes away before the stream body is first iterated
+    response.call_on_close(lambda: challan_broker.unsubscribe(subscription))
+    return response
+
+def _challan_status_counts(*conditions):
+    return dict(db.session.query(Challan.status, db.func.count(Challan.id)).filter(*conditions).group_by(Challan.status).all())
+
 @app.route('/api/realtime/challans')
 def realtime_challans():
-    """Server-Sent Events endpoint for real-time challan updates"""
+    """Server-Sent Events endpoint for real-time challan updates (fed by the shared challan broker)"""
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    def generate():
-        user_id = session['user_id']
-        user_type = session.get('user_type', 'owner')
-        
-        # Get initial state
-        if user_type == 'owner':
-            vehicles = Vehicle.query.filter_by(owner_id=user_id).all()
-            vehicle_ids = [v.id for v in vehicles]
-            last_count = Challan.query.filter(Challan.vehicle_id.in_(vehicle_ids)).count()
-        else:
-            last_count = Challan.query.count()
-        
-        yield f"data: {json.dumps({'type': 'init', 'count': last_count})}\n\n"
-        
-        while True:
-            try:
-                # Check for new challans every 2 seconds
-                time.sleep(2)
-                
-                if user_type == 'owner':
-                    vehicles = Vehicle.query.filter_by(owner_id=user_id).all()
-                    vehicle_ids = [v.id for v in vehicles]
-                    current_count = Challan.query.filter(Challan.vehicle_id.in_(vehicle_ids)).count()
-                    recent_challans = Challan.query.filter(
-                        Challan.vehicle_id.in_(vehicle_ids)
-                    ).order_by(Challan.created_at.desc()).limit(5).all()
-                else:
-                    current_count = Challan.query.count()
-                    recent_challans = Challan.query.order_by(Challan.created_at.desc()).limit(5).all()
-                
-                if current_count != last_count:
-                    challan_data = [{
-                        'id': c.id,
-                        'license_number': c.vehicle.license_number if c.vehicle else 'N/A',
-                        'violation_type': c.violation_type,
-                        'fine_amount': c.fine_amount,
-                        'status': c.status,
-                        'created_at': c.created_at.isoformat()
-                    } for c in recent_challans]
-                    
-                    yield f"data: {json.dumps({'type': 'update', 'count': current_count, 'challans': challan_data})}\n\n"
-                    last_count = current_count
-                
-                # Send heartbeat
-                yield f"data: {json.dumps({'type': 'heartbeat', 'timestamp': datetime.now().isoformat()})}\n\n"
-                
-            except Exception as e:
-                yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
-                break
-    
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    user_id = session['user_id']
+    user_type = session.get('user_type', 'owner')
+    
+    # State is read once at connect; afterwards the connection only reads its broker queue.
+    # The outbox position is read with the snapshot, and the subscription replays what follows it.
+    snapshot_seq = latest_seq()
+    if user_type == 'owner':
+        vehicle_ids = [vid for (vid,) in db.session.query(Vehicle.id).filter_by(owner_id=user_id)]
+        counts = _challan_status_counts(Challan.vehicle_id.in_(vehicle_ids))
+        recent_query = Challan.query.filter(Challan.vehicle_id.in_(vehicle_ids))
+    else:
+        vehicle_ids = None
+        counts = status_counts()
+        recent_query = Challan.query
+    recent_challans = [{
+        'id': c.id,
+        'license_number': c.vehicle.license_number if c.vehicle else 'N/A',
+        'violation_type': c.violation_type,
+        'fine_amount': c.fine_amount,
+        'status': c.status,
+        'created_at': c.created_at.isoformat() if c.created_at else None
+    } for c in recent_query.options(Challan.with_vehicle()).order_by(Challan.created_at.desc()).limit(5).all()]
+    subscription = challan_broker.subscribe(vehicle_ids, last_event_id=_last_event_id(), snapshot_seq=snapshot_seq)
+    # Nothing below touches the database: give the connection back for the life of the stream
+    db.session.remove()
+    
+    stream = stream_events(subscription, counts, snapshot=recent_challans, fields=(
+        'id', 'license_number', 'violation_type', 'fine_amount', 'status', 'created_at'
+    ))
+    return _sse_response(stream, subscription)
 
 @app.route('/api/realtime/vehicle/<int:vehicle_id>/challans')
 def realtime_vehicle_challans(vehicle_id):
-    """Real-time updates for specific vehicle's challans"""
+    """Real-time updates for specific vehicle's challans (fed by the shared challan broker)"""
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
@@ -977,37 +946,24 @@ def realtime_vehicle_challans(vehicle_id):
     if vehicle.owner_id != session['user_id']:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    def generate():
-        last_count = Challan.query.filter_by(vehicle_id=vehicle_id).count()
-        yield f"data: {json.dumps({'type': 'init', 'count': last_count})}\n\n"
-        
-        while True:
-            try:
-                time.sleep(3)
-                current_count = Challan.query.filter_by(vehicle_id=vehicle_id).count()
-                
-                if current_count != last_count:
-                    challans = Challan.query.filter_by(vehicle_id=vehicle_id).order_by(Challan.created_at.desc()).all()
-                    challan_data = [{
-                        'id': c.id,
-                        'violation_type': c.violation_type,
-                        'location': c.location,
-                        'fine_amount': c.fine_amount,
-                        'status': c.status,
-                        'due_date': c.due_date.isoformat() if c.due_date else None,
-                        'created_at': c.created_at.isoformat()
-                    } for c in challans]
-                    
-                    yield f"data: {json.dumps({'type': 'update', 'count': current_count, 'challans': challan_data})}\n\n"
-                    last_count = current_count
-                
-                yield f"data: {json.dumps({'type': 'heartbeat'})}\n\n"
-                
-            except Exception as e:
-                yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
-                break
-    
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    snapshot_seq = latest_seq()
+    counts = _challan_status_counts(Challan.vehicle_id == vehicle_id)
+    challans = [{
+        'id': c.id,
+        'violation_type': c.violation_type,
+        'location': c.location,
+        'fine_amount': c.fine_amount,
+        'status': c.status,
+        'due_date': c.due_date.isoformat() if c.due_date else None,
+        'created_at': c.created_at.isoformat() if c.created_at else None
+    } for c in Challan.query.filter_by(vehicle_id=vehicle_id).order_by(Challan.created_at.desc()).all()]
+    subscription = challan_broker.subscribe([vehicle_id], last_event_id=_last_event_id(), snapshot_seq=snapshot_seq)
+    db.session.remove()
+    
+    stream = stream_events(subscription, counts, snapshot=challans, fields=(
+        'id', 'violation_type', 'location', 'fine_amount', 'status', 'due_date', 'created_at'
+    ))
+    return _sse_response(stream, subscription)
 
 # ==================== GEMINI-POWERED FEATURES ====================
 
@@ -1015,8 +971,12 @@ def realtime_vehicle_challans(vehicle_id):
 def gemini_news():
     """Get real-time traffic news from Gemini"""
     try:
-        news = generate_traffic_news()
-        return jsonify(news)
+        news = get_artifact('news') or generate_traffic_news()
+        response = jsonify(news)
+        # Polled by gemini-news.js from every open page; the artifact changes every NEWS_EVERY seconds
+        response.cache_control.public = True
+        response.cache_control.max_age = 60
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1048,7 +1008,7 @@ def gemini_appeal_guidance():
     if not challan_id:
         return jsonify({'error': 'challan_id required'}), 400
     
-    challan = Challan.query.get_or_404(challan_id)
+    challan = Challan.query.options(Challan.with_vehicle()).get_or_404(challan_id)
     challan_details = challan.to_dict()
     
     try:
@@ -1074,12 +1034,13 @@ def get_driver_points(dl_number):
     })
 
 @app.route('/api/challan/<int:challan_id>/deduct-points', methods=['POST'])
+@query_budget(5)
 def deduct_points(challan_id):
     """Deduct points from driver license after challan"""
     if 'user_id' not in session or session.get('user_type') != 'admin':
         return jsonify({'error': 'Unauthorized'}), 401
     
-    challan = Challan.query.get_or_404(challan_id)
+    challan = Challan.query.options(Challan.with_vehicle_owner()).get_or_404(challan_id)
     user = challan.vehicle.owner if challan.vehicle else None
     
     if not user or not user.dl_number:
@@ -1103,7 +1064,7 @@ def deduct_points(challan_id):
     # Suspend if points <= 0
     if license.points <= 0:
         license.status = 'Suspended'
-        send_sms(user.phone, f"Your license {license.dl_number} has been suspended due to point deduction.")
+        queue_sms(user.phone, f"Your license {license.dl_number} has been suspended due to point deduction.")
     
     db.session.commit()
     
@@ -1117,6 +1078,7 @@ def deduct_points(challan_id):
 # ==================== VIRTUAL COURT / APPEALS ====================
 
 @app.route('/api/appeals', methods=['POST'])
+@query_budget(9)
 def create_appeal():
     """Create an appeal for a challan"""
     if 'user_id' not in session:
@@ -1129,7 +1091,7 @@ def create_appeal():
     if not challan_id or not reason:
         return jsonify({'error': 'challan_id and reason required'}), 400
     
-    challan = Challan.query.get_or_404(challan_id)
+    challan = Challan.query.options(Challan.with_vehicle()).get_or_404(challan_id)
     
     # Verify ownership
     if challan.vehicle.owner_id != session['user_id']:
@@ -1143,20 +1105,55 @@ def create_appeal():
     )
     db.session.add(appeal)
     challan.status = 'Disputed'
+    # Generated in the background (or reused from an appeal with the same circumstances)
+    guidance = request_guidance(challan)
+    db.session.flush()
+    appeal.guidance_id = guidance.id
     db.session.commit()
     
-    # Get AI guidance
-    try:
-        guidance = generate_appeal_guidance(challan.to_dict())
-    except:
-        guidance = "Your appeal has been submitted. It will be reviewed by authorities."
-    
     return jsonify({
         'success': True,
         'appeal_id': appeal.id,
-        'guidance': guidance
+        **guidance_payload(guidance),
+        'guidance_url': url_for('appeal_guidance', appeal_id=appeal.id),
+        'guidance_stream_url': url_for('appeal_guidance_stream', appeal_id=appeal.id)
     })
 
+def _appeal_for_guidance(appeal_id):
+    """The appeal if the current user may read its guidance, else None"""
+    appeal = Appeal.query.options(db.joinedload(Appeal.challan)).get_or_404(appeal_id)
+    if session.get('user_type') != 'admin' and appeal.user_id != session['user_id']:
+        return None
+    return appeal
+
+@app.route('/api/appeals/<int:appeal_id>/guidance')
+@query_budget(4)
+def appeal_guidance(appeal_id):
+    """AI guidance for an appeal: status 'pending' until the background worker has stored it"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    appeal = _appeal_for_guidance(appeal_id)
+    if appeal is None:
+        return jsonify({'error': 'Unauthorized'}), 403
+    guidance = guidance_for_appeal(appeal)
+    db.session.commit()
+    return jsonify(dict(guidance_payload(guidance), appeal_id=appeal.id))
+
+@app.route('/api/appeals/<int:appeal_id>/guidance/stream')
+def appeal_guidance_stream(appeal_id):
+    """SSE: one 'guidance' event when the appeal's AI guidance is ready"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    appeal = _appeal_for_guidance(appeal_id)
+    if appeal is None:
+        return jsonify({'error': 'Unauthorized'}), 403
+    guidance = guidance_for_appeal(appeal)
+    db.session.commit()
+    stream = guidance_worker.stream(appeal.id, guidance.id)
+    # The stream opens its own short-lived sessions: give the connection back
+    db.session.remove()
+    return Response(stream, mimetype='text/event-stream', headers=SSE_HEADERS)
+
 @app.route('/api/appeals/<int:appeal_id>/review', methods=['POST'])
 def review_appeal(appeal_id):
     """Review an appeal (admin only)"""
@@ -1259,16 +1256,14 @@ def pay_installment(plan_id):
 # ==================== ANALYTICS & PREDICTIVE INSIGHTS ====================
 
 @app.route('/api/analytics/dashboard')
+@query_budget(4)
 def analytics_dashboard():
     """Get analytics data for dashboard"""
     if 'user_id' not in session or session.get('user_type') != 'admin':
         return jsonify({'error': 'Unauthorized'}), 401
     
-    # Get violation statistics
-    violations = db.session.query(
-        Challan.violation_type,
-        db.func.count(Challan.id).label('count')
-    ).group_by(Challan.violation_type).all()
+    # Get violation statistics (from counters)
+    violations = violation_counts()
     
     # Get location hotspots
     hotspots = db.session.query(
@@ -1295,8 +1290,107 @@ def analytics_dashboard():
         'predictive_insights': gemini_insights
     })
 
+@app.route('/api/admin/counters/reconcile', methods=['POST'])
+def reconcile_dashboard_counters():
+    """Detect (and by default repair) drift between dashboard counters and the tables"""
+    if 'user_id' not in session or session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    repair = request.args.get('repair', '1') != '0'
+    try:
+        drift = reconcile_counters(repair=repair)
+        return jsonify({'success': True, 'repaired': repair, 'drift': drift})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/challan-events')
+@query_budget(1)
+def challan_events_feed():
+    """Tail the challan change log: events after ?after=<seq>, oldest first"""
+    if 'user_id' not in session or session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    after = request.args.get('after', 0, type=int)
+    limit = max(1, min(request.args.get('limit', 500, type=int), 5000))
+    events = read_events(after, limit)
+    return jsonify({
+        'events': [ev.to_dict() for ev in events],
+        'next_after': events[-1].seq if events else after
+    })
+
+@app.route('/api/admin/outbound-status')
+@query_budget(0)
+def outbound_status_view():
+    """Circuit-breaker state and deadline of each external dependency (this process)"""
+    if 'user_id' not in session or session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify({'dependencies': outbound_status()})
+
+@app.route('/api/admin/ocr-stats')
+@query_budget(0)
+def ocr_stats_view():
+    """How often each plate recognition stage ran and was accepted (this process)"""
+    if 'user_id' not in session or session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(ocr_executor.stage_stats())
+
+@app.cli.command('prune-challan-events')
+@click.option('--days', default=30, show_default=True, help='Keep events newer than this many days.')
+def prune_challan_events_command(days):
+    """Delete challan change-log entries older than the retention window."""
+    print(f"Removed {prune_events(days)} challan event(s)")
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Rebuild the normalized UIN / plate / DL lookup index."""
+    print(f"Indexed {rebuild_search_index()} search term(s)")
+
+@app.cli.command('rebuild-offence-counters')
+def rebuild_offence_counters_command():
+    """Recompute per-(vehicle, violation) repeat-offence counters from challan history."""
+    print(f"Rebuilt {rebuild_offence_counters()} offence counter(s)")
+
+@app.cli.command('process-notifications')
+@click.option('--once', is_flag=True, help='Drain the queue and exit instead of polling.')
+def process_notifications_command(once):
+    """Send queued SMS / e-mail notifications (runs alongside the in-process workers)."""
+    total = 0
+    while True:
+        processed = notification_dispatcher.run_once()
+        total += processed
+        if not processed:
+            if once:
+                break
+            time.sleep(POLL_INTERVAL)
+    print(f"Processed {total} notification(s)")
+
+@app.cli.command('pregenerate-content')
+@click.option('--force', is_flag=True, help='Regenerate every artifact even if it is not due.')
+def pregenerate_content_command(force):
+    """Generate the stored news, notices and city insights now."""
+    generated = content_scheduler.run_due(force=force)
+    print(f"Generated {len(generated)} artifact(s): {', '.join(generated) or '-'}")
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Recount challans/vehicles and repair drifted dashboard counters."""
+    drift = reconcile_counters(repair=True)
+    for name, values in sorted(drift.items()):
+        print(f"{name}: stored={values['stored']} actual={values['actual']}")
+    print(f"Reconciled {len(drift)} counter(s)")
+
 # ==================== AI CHATBOT FOR GRIEVANCES ====================
 
+def _chatbot_prompt(message, context):
+    return (
+        "Your name is Bob. You are friendly, frank, and helpful. Keep answers simple and approachable. "
+        "Answer any question. If the query is about Indian transportation (traffic rules, challans, RTO, RC/DL, road safety), "
+        "add authoritative details (rule purpose, common violations, penalties) and step-by-step portal guidance where relevant. "
+        "Do not encourage unlawful behavior.\n\n"
+        f"User: {message}\n\n"
+        f"Context: {json.dumps(context)}\n\n"
+        "Provide a concise, professional response that users can easily understand."
+    )
+
 @app.route('/api/chatbot', methods=['POST'])
 def chatbot():
     """AI chatbot for grievances and queries"""
@@ -1312,79 +1406,129 @@ def chatbot():
         return jsonify({'response': 'Chatbot service temporarily unavailable. Please contact support.'})
     
     try:
-        prompt = (
-            "Your name is Bob. You are friendly, frank, and helpful. Keep answers simple and approachable. "
-            "Answer any question. If the query is about Indian transportation (traffic rules, challans, RTO, RC/DL, road safety), "
-            "add authoritative details (rule purpose, common violations, penalties) and step-by-step portal guidance where relevant. "
-            "Do not encourage unlawful behavior.\n\n"
-            f"User: {message}\n\n"
-            f"Context: {json.dumps(context)}\n\n"
-            "Provide a concise, professional response that users can easily understand."
-        )
-        response = model.generate_content(prompt)
-        text = (response.text or '').strip()
+        text = generate_text(_chatbot_prompt(message, context))
         if not text:
             text = "I’m here to help. Please tell me what you’d like to know."
         if "Bob" not in text:
             text = f"{text}\n— Bob"
         return jsonify({'response': text})
+    except (CircuitOpenError, DeadlineExceeded):
+        return jsonify({'response': 'Chatbot service temporarily unavailable. Please contact support.'})
     except Exception as e:
         return jsonify({'response': f'I apologize, but I encountered an error. Please try rephrasing your question. Error: {str(e)}'})
 
+@app.route('/api/chatbot/stream', methods=['POST'])
+def chatbot_stream():
+    """
+    Streaming chatbot: SSE 'token' events as the model produces text, then
+    'done' (or 'error'). Disconnecting closes the generator, which stops the
+    upstream generation.
+    """
+    data = request.get_json() or {}
+    message = data.get('message', '')
+    context = data.get('context', {})
+    
+    if not message:
+        return jsonify({'error': 'message required'}), 400
+    
+    prompt = _chatbot_prompt(message, context)
+    
+    def generate():
+        tokens = stream_generate(prompt)
+        seen_name = False
+        produced = ''
+        try:
+            for text in tokens:
+                # Check across chunk boundaries too
+                seen_name = seen_name or "Bob" in produced[-2:] + text
+                produced += text
+                yield format_sse({'type': 'token', 'text': text})
+            if not produced:
+                yield format_sse({'type': 'token', 'text': "I’m here to help. Please tell me what you’d like to know."})
+            if not seen_name:
+                yield format_sse({'type': 'token', 'text': "\n— Bob"})
+            yield format_sse({'type': 'done'})
+        except Exception as e:
+            yield format_sse({'type': 'error', 'message': f'I apologize, but I encountered an error. Please try rephrasing your question. Error: {str(e)}'})
+        finally:
+            tokens.close()
+    
+    # No database work in the stream: give the connection back
+    db.session.remove()
+    return Response(generate(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
 # ==================== GEMINI NOTICES ====================
 
 @app.route('/api/gemini/notices')
 def gemini_notices():
-    """Generate fresh traffic notices/rules updates using Gemini (AI-generated)."""
+    """Latest AI-generated traffic notices/rules updates (pre-generated by the content scheduler)."""
+    artifact = get_artifact('notices')
+    if artifact is not None:
+        return jsonify({'success': True, 'notices': artifact['notices']})
+    # No batch stored yet: generate (cached) as before the scheduler existed
+    content_scheduler.wake()
+    if not get_gemini_model():
+        return jsonify({'success': False, 'error': 'Gemini not available'}), 503
     try:
-        model = get_gemini_model()
-        if not model:
-            return jsonify({'success': False, 'error': 'Gemini not available'}), 503
-
-        prompt = f"""Generate 6 concise traffic notices for India (mix Central + State, include Uttarakhand). 
-Each notice should be realistic and citizen-friendly.
-
-Return STRICT JSON array. Each item fields:
-- scope: Central or State
-- title
-- body (2-3 lines)
-- state (null for Central)
-- city (null or a city)
-
-Date: {datetime.now().strftime('%Y-%m-%d')}
-"""
-        resp = model.generate_content(prompt)
-        text = (resp.text or '').strip()
-
-        # Extract JSON array from response
-        if '[' in text and ']' in text:
-            start = text.find('[')
-            end = text.rfind(']') + 1
-            arr = json.loads(text[start:end])
-        else:
-            arr = []
-
-        # Normalize
-        out = []
-        for item in arr[:10]:
-            out.append({
-                'scope': item.get('scope') or 'Central',
-                'title': item.get('title') or 'Traffic Notice',
-                'body': item.get('body') or '',
-                'state': item.get('state'),
-                'city': item.get('city'),
-                'published_at': datetime.now().strftime('%Y-%m-%d')
-            })
-
-        return jsonify({'success': True, 'notices': out})
+        published_at = datetime.now().strftime('%Y-%m-%d')
+        notices = [dict(n, published_at=published_at) for n in generate_traffic_notices()]
+        return jsonify({'success': True, 'notices': notices})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # ==================== ADVANCED DETECTION SERVICES ====================
 
+# OCR runs in the bounded process pool (ocr_executor.py). Endpoints answer 202
+# with a job id; ?wait=<seconds> (up to OCR_MAX_WAIT) waits for the result inline.
+OCR_MAX_WAIT = float(os.environ.get('OCR_MAX_WAIT', '10'))
+
+def _submit_ocr_job(kind, filepath, finish):
+    try:
+        job_id = ocr_executor.submit(kind, filepath, finish)
+    except OCRQueueFull as e:
+        response = jsonify({'error': f'OCR queue is full, retry shortly ({e})'})
+        response.headers['Retry-After'] = str(OCR_RETRY_AFTER_SECONDS)
+        return response, 429
+    except OCRUnavailable as e:
+        return jsonify({'error': f'OCR unavailable: {e}'}), 503
+    
+    wait = min(max(request.args.get('wait', 0, type=float), 0), OCR_MAX_WAIT)
+    if wait:
+        payload = ocr_executor.wait(job_id, wait)
+        if payload['status'] == 'done':
+            return jsonify(payload['result'])
+        if payload['status'] == 'failed':
+            return jsonify({'error': payload['error'], 'job_id': job_id}), 500
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('ocr_job_status', job_id=job_id),
+        'stream_url': url_for('ocr_job_stream', job_id=job_id)
+    }), 202
+
+@app.route('/api/ocr/jobs/<job_id>')
+@query_budget(1)
+def ocr_job_status(job_id):
+    """Status of an OCR job; 'result' holds the endpoint's usual response once done"""
+    if 'user_id' not in session or session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    payload = job_payload(db.session.get(OcrJob, job_id))
+    if payload['status'] == 'unknown':
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(payload)
+
+@app.route('/api/ocr/jobs/<job_id>/stream')
+def ocr_job_stream(job_id):
+    """SSE: 'status' events for an OCR job until it is done or failed"""
+    if 'user_id' not in session or session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    # The stream opens its own short-lived sessions: give the connection back
+    db.session.remove()
+    return Response(ocr_executor.stream(job_id), mimetype='text/event-stream', headers=SSE_HEADERS)
+
 @app.route('/api/detection/anpr', methods=['POST'])
 def anpr_detection():
-    """ANPR detection endpoint"""
+    """ANPR detection endpoint (queued on the OCR pool; see _submit_ocr_job)"""
     if 'user_id' not in session or session.get('user_type') != 'admin':
         return jsonify({'error': 'Unauthorized'}), 401
     
@@ -1400,8 +1544,14 @@ def anpr_detection():
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     file.save(filepath)
     
-    try:
-        result = ANPRService.detect_from_image(filepath, camera_id)
+    def finish(license_number, confidence):
+        # Runs in this process once the OCR pool has read the plate
+        result = ANPRService.detection_result(license_number, confidence, camera_id)
+        camera = get_camera(camera_id)
+        if camera:
+            result['camera'] = camera
+            if camera['latitude'] is not None and camera['longitude'] is not None:
+                result['gps_coords'] = {'lat': camera['latitude'], 'lng': camera['longitude']}
         
         # Check for stolen vehicle
         if result['license_number']:
@@ -1414,10 +1564,9 @@ def anpr_detection():
                     result.get('gps_coords', {}),
                     'unknown'
                 )
-        
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return result
+    
+    return _submit_ocr_job('anpr', filepath, finish)
 
 @app.route('/api/detection/speed', methods=['POST'])
 def speed_detection():
@@ -1480,6 +1629,22 @@ def predictive_hotspots():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Basic city -> lat/lon (demo defaults); insights for these are pre-generated
+CITY_COORDS = {
+    'dehradun': {'city': 'Dehradun', 'lat': 30.3165, 'lon': 78.0322},
+    'haldwani': {'city': 'Haldwani', 'lat': 29.2183, 'lon': 79.5130},
+    'almora': {'city': 'Almora', 'lat': 29.5971, 'lon': 79.6591},
+    'khatima': {'city': 'Khatima', 'lat': 28.9216, 'lon': 79.9709},
+    'delhi': {'city': 'Delhi', 'lat': 28.6139, 'lon': 77.2090},
+    'mumbai': {'city': 'Mumbai', 'lat': 19.0760, 'lon': 72.8777},
+    'bengaluru': {'city': 'Bengaluru', 'lat': 12.9716, 'lon': 77.5946},
+    'kolkata': {'city': 'Kolkata', 'lat': 22.5726, 'lon': 88.3639},
+    'chennai': {'city': 'Chennai', 'lat': 13.0827, 'lon': 80.2707},
+    'hyderabad': {'city': 'Hyderabad', 'lat': 17.3850, 'lon': 78.4867},
+    'pune': {'city': 'Pune', 'lat': 18.5204, 'lon': 73.8567},
+    'lucknow': {'city': 'Lucknow', 'lat': 26.8467, 'lon': 80.9462},
+}
+
 @app.route('/api/predictive/city')
 def predictive_city_insights():
     """City-specific AI traffic insights (Gemini-based)."""
@@ -1490,23 +1655,8 @@ def predictive_city_insights():
     if not city:
         return jsonify({'success': False, 'error': 'city is required'}), 400
 
-    # Basic city -> lat/lon (demo defaults)
-    city_coords = {
-        'dehradun': {'city': 'Dehradun', 'lat': 30.3165, 'lon': 78.0322},
-        'haldwani': {'city': 'Haldwani', 'lat': 29.2183, 'lon': 79.5130},
-        'almora': {'city': 'Almora', 'lat': 29.5971, 'lon': 79.6591},
-        'khatima': {'city': 'Khatima', 'lat': 28.9216, 'lon': 79.9709},
-        'delhi': {'city': 'Delhi', 'lat': 28.6139, 'lon': 77.2090},
-        'mumbai': {'city': 'Mumbai', 'lat': 19.0760, 'lon': 72.8777},
-        'bengaluru': {'city': 'Bengaluru', 'lat': 12.9716, 'lon': 77.5946},
-        'kolkata': {'city': 'Kolkata', 'lat': 22.5726, 'lon': 88.3639},
-        'chennai': {'city': 'Chennai', 'lat': 13.0827, 'lon': 80.2707},
-        'hyderabad': {'city': 'Hyderabad', 'lat': 17.3850, 'lon': 78.4867},
-        'pune': {'city': 'Pune', 'lat': 18.5204, 'lon': 73.8567},
-        'lucknow': {'city': 'Lucknow', 'lat': 26.8467, 'lon': 80.9462},
-    }
     key = city.lower().strip()
-    city_info = city_coords.get(key, {'city': city, 'lat': None, 'lon': None})
+    city_info = CITY_COORDS.get(key, {'city': city, 'lat': None, 'lon': None})
 
     # Use existing hotspot analytics as "live" context (from our DB)
     hotspots = db.session.query(
@@ -1515,7 +1665,7 @@ def predictive_city_insights():
     ).filter(Challan.location.isnot(None)).group_by(Challan.location).order_by(db.func.count(Challan.id).desc()).limit(5).all()
 
     try:
-        insights = get_predictive_insights(location=city)
+        insights = get_artifact(city_key(city)) or get_predictive_insights(location=city)
     except Exception:
         insights = {
             "hotspot": "High traffic areas",
@@ -1590,8 +1740,8 @@ def bhopal_no_helmet_detection():
             if not vehicle:
                 return jsonify({'error': 'Vehicle not found. Please register vehicle first.'}), 404
             
-            for violation in result['violations']:
-                fine_amount, is_subsequent, court_mandatory = calculate_fine(violation['violation_type'], vehicle.id)
+            fines = calculate_fines([(v['violation_type'], vehicle.id) for v in result['violations']])
+            for violation, (fine_amount, is_subsequent, court_mandatory) in zip(result['violations'], fines):
                 status = 'Court' if court_mandatory else 'Unpaid'
                 license_action = "Suspend 3 months" if violation['violation_type'] == "No Helmet" and is_subsequent else None
                 
@@ -1608,13 +1758,13 @@ def bhopal_no_helmet_detection():
                     license_action=license_action
                 )
                 db.session.add(challan)
-                challans_created.append(challan.id)
+                challans_created.append(challan)
             
+            # Auto email challan: queued in the same transaction, one INSERT for the batch
+            db.session.flush()
+            challans_created = [c.id for c in challans_created]
+            BhopalITMSService.queue_challan_emails(challans_created)
             db.session.commit()
-            
-            # Auto email challan
-            for challan_id in challans_created:
-                BhopalITMSService.auto_email_challan(challan_id)
         
         return jsonify({
             'success': True,
@@ -1628,7 +1778,7 @@ def bhopal_no_helmet_detection():
 
 @app.route('/api/bhopal-itms/classify-detect', methods=['POST'])
 def bhopal_classify_and_detect():
-    """Classify vehicle and detect all violations (Bhopal ITMS)"""
+    """Classify vehicle and detect all violations (Bhopal ITMS; queued on the OCR pool)"""
     if 'user_id' not in session or session.get('user_type') != 'admin':
         return jsonify({'error': 'Unauthorized'}), 401
     
@@ -1642,23 +1792,22 @@ def bhopal_classify_and_detect():
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     file.save(filepath)
     
-    try:
+    def finish(license_number, confidence):
+        # Runs in this process once the OCR pool has read the plate
         result = BhopalITMSService.classify_and_detect(filepath)
         
         # Also check for license plate
-        anpr_result = ANPRService.detect_from_image(filepath)
-        if anpr_result.get('license_number'):
-            result['license_number'] = anpr_result['license_number']
-            result['anpr_confidence'] = anpr_result.get('confidence')
+        if license_number:
+            result['license_number'] = license_number
+            result['anpr_confidence'] = confidence
             
             # Check if suspected vehicle
-            suspected = BhopalITMSService.check_suspected_vehicle(anpr_result['license_number'])
+            suspected = BhopalITMSService.check_suspected_vehicle(license_number)
             if suspected.get('is_suspected'):
                 result['suspected_vehicle_alert'] = suspected
-        
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return result
+    
+    return _submit_ocr_job('bhopal_classify', filepath, finish)
 
 @app.route('/api/bhopal-itms/suspected-vehicle/<license_number>')
 def check_suspected_vehicle(license_number):
@@ -1873,10 +2022,17 @@ def import_dataset_from_url():
     out_path = os.path.join(upload_dir, out_name)
 
     try:
-        with urllib.request.urlopen(url, timeout=20) as resp:
-            data_bytes = resp.read()
-        with open(out_path, 'wb') as fh:
-            fh.write(data_bytes)
+        with outbound_call('dataset_download') as call:
+            # urlopen's timeout is per socket operation; the chunked read enforces the total
+            with urllib.request.urlopen(url, timeout=call.timeout) as resp, open(out_path, 'wb') as fh:
+                while True:
+                    call.check()
+                    chunk = resp.read(64 * 1024)
+                    if not chunk:
+                        break
+                    fh.write(chunk)
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        return jsonify({'success': False, 'error': f'Download unavailable: {str(e)}'}), 503
     except Exception as e:
         return jsonify({'success': False, 'error': f'Failed to download: {str(e)}'}), 400
 
@@ -1907,6 +2063,7 @@ def import_dataset_from_url():
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        ensure_guidance_link_column()
         # Initialize default admin user
         if not User.query.filter_by(username='admin').first():
             admin_password = bcrypt.generate_password_hash('admin123').decode('utf-8')
@@ -1938,6 +2095,9 @@ if __name__ == '__main__':
                 db.session.add(violation)
         
         db.session.commit()
+        reconcile_counters()
+        seed_offence_counters()
+        seed_search_index()
     
     # Get port from environment variable (Heroku sets this), default to 5000
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,283 @@
+"""
+Deferred AI guidance for virtual-court appeals in AutoFINE
+
+`create_appeal` no longer waits on the model. `request_guidance(challan)`
+adds (or reuses) an `appeal_guidance` row in the appeal's transaction; a
+background worker per process generates the text and stores it on that row.
+Clients fetch it with GET /api/appeals/<id>/guidance or wait for it on
+/api/appeals/<id>/guidance/stream (SSE).
+
+Guidance is keyed by the circumstances the prompt uses (violation type, fine
+amount, location; normalized), so every appeal against a matching challan
+shares one row and only the first one costs a model call. The row is
+recorded on the appeal (`appeals.guidance_id`) when it is filed, so later
+edits to the challan do not change which guidance the appeal shows. Rows are
+claimed with a lease like notification_queue.py, so several processes can
+share the table; failures retry with backoff and end with the generic text
+after GUIDANCE_MAX_ATTEMPTS. A failed row is queued again by the next appeal
+that needs it once GUIDANCE_FAILED_RETRY_SECONDS have passed, so an outage
+does not pin the generic text on those circumstances for good.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, inspect as sa_inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from gemini_service import generate_appeal_guidance
+from llm_cache import normalize
+from models import db, Appeal, AppealGuidance
+from realtime_broker import format_sse, retry_hint
+
+POLL_INTERVAL = float(os.environ.get('GUIDANCE_POLL_INTERVAL', '5'))
+MAX_ATTEMPTS = int(os.environ.get('GUIDANCE_MAX_ATTEMPTS', '3'))
+BACKOFF_SECONDS = float(os.environ.get('GUIDANCE_BACKOFF_SECONDS', '30'))
+LEASE_SECONDS = int(os.environ.get('GUIDANCE_LEASE_SECONDS', '120'))
+STREAM_SECONDS = int(os.environ.get('GUIDANCE_STREAM_SECONDS', '120'))
+STREAM_CHECK_SECONDS = float(os.environ.get('GUIDANCE_STREAM_CHECK_SECONDS', '3'))
+FAILED_RETRY_SECONDS = int(os.environ.get('GUIDANCE_FAILED_RETRY_SECONDS', '3600'))
+
+FALLBACK_GUIDANCE = "Your appeal has been submitted. It will be reviewed by authorities."
+CIRCUMSTANCE_FIELDS = ('violation_type', 'fine_amount', 'location')
+
+
+def challan_circumstances(challan):
+    """The challan fields the guidance prompt uses"""
+    return {
+        'violation_type': challan.violation_type,
+        'fine_amount': challan.fine_amount,
+        'location': challan.location,
+    }
+
+
+def guidance_key(circumstances):
+    """Stable key for a set of circumstances (whitespace-insensitive)"""
+    ident = repr(normalize([circumstances.get(f) for f in CIRCUMSTANCE_FIELDS]))
+    return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+
+def request_guidance(challan):
+    """
+    Make sure guidance for this challan's circumstances exists or is queued,
+    in the current session. Returns the AppealGuidance row.
+    """
+    circumstances = challan_circumstances(challan)
+    key = guidance_key(circumstances)
+    row = AppealGuidance.query.filter_by(guidance_key=key).first()
+    if row is not None:
+        if row.status == 'failed':
+            _requeue_failed(row)
+        return row
+    row = AppealGuidance(
+        guidance_key=key,
+        violation_type=circumstances['violation_type'],
+        fine_amount=circumstances['fine_amount'],
+        location=circumstances['location'],
+    )
+    try:
+        # Savepoint: another request may have queued the same circumstances concurrently
+        with db.session.begin_nested():
+            db.session.add(row)
+    except IntegrityError:
+        row = AppealGuidance.query.filter_by(guidance_key=key).first()
+    return row
+
+
+def _requeue_failed(row):
+    """Queue a failed row again if it failed long enough ago (conditional, so one request wins)"""
+    now = datetime.utcnow()
+    requeued = AppealGuidance.query.filter(
+        AppealGuidance.id == row.id,
+        AppealGuidance.status == 'failed',
+        AppealGuidance.updated_at < now - timedelta(seconds=FAILED_RETRY_SECONDS),
+    ).update({
+        'status': 'pending',
+        'attempts': 0,
+        'next_attempt_at': now,
+        'claimed_until': None,
+        'updated_at': now,
+    }, synchronize_session=False)
+    if requeued:
+        db.session.refresh(row)
+        db.session.info['_guidance_requested'] = True
+
+
+def guidance_for_appeal(appeal):
+    """
+    The AppealGuidance row recorded on the appeal. Appeals filed before the
+    link existed get one from the challan, recorded now (in the current session).
+    """
+    if appeal.guidance_id is not None:
+        row = db.session.get(AppealGuidance, appeal.guidance_id)
+        if row is not None:
+            if row.status == 'failed':
+                _requeue_failed(row)
+            return row
+    row = request_guidance(appeal.challan)
+    db.session.flush()
+    appeal.guidance_id = row.id
+    return row
+
+
+def ensure_guidance_link_column():
+    """Add appeals.guidance_id to databases created before it existed (create_all only adds tables)"""
+    columns = {c['name'] for c in sa_inspect(db.engine).get_columns(Appeal.__tablename__)}
+    if 'guidance_id' not in columns:
+        with db.engine.begin() as conn:
+            conn.execute(text('ALTER TABLE appeals ADD COLUMN guidance_id INTEGER REFERENCES appeal_guidance (id)'))
+
+
+def backoff_delay(attempts):
+    return BACKOFF_SECONDS * (2 ** (attempts - 1))
+
+
+class GuidanceWorker:
+    """Background thread generating pending appeal guidance"""
+
+    def __init__(self):
+        self.app = None
+        self._wakeup = threading.Event()
+        self._ready = threading.Condition()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        # Start on the first request rather than at import, so CLI commands stay single-threaded
+        app.before_request(self._ensure_started)
+
+    def wake(self):
+        self._ensure_started()
+        self._wakeup.set()
+
+    def _ensure_started(self):
+        if self._thread is not None or self.app is None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='appeal-guidance', daemon=True)
+                self._thread.start()
+
+    def _claim(self):
+        now = datetime.utcnow()
+        row = AppealGuidance.query.filter(
+            AppealGuidance.status == 'pending',
+            AppealGuidance.next_attempt_at <= now,
+            db.or_(AppealGuidance.claimed_until.is_(None), AppealGuidance.claimed_until < now),
+        ).order_by(AppealGuidance.id).first()
+        if row is None:
+            db.session.commit()
+            return None
+        # Conditional on the lease still being free, so only one process wins the row
+        claimed = AppealGuidance.query.filter(
+            AppealGuidance.id == row.id,
+            AppealGuidance.status == 'pending',
+            db.or_(AppealGuidance.claimed_until.is_(None), AppealGuidance.claimed_until < now),
+        ).update({'claimed_until': now + timedelta(seconds=LEASE_SECONDS)}, synchronize_session=False)
+        db.session.commit()
+        return db.session.get(AppealGuidance, row.id) if claimed else None
+
+    def run_once(self):
+        """Generate guidance for one pending row; returns True if a row was processed"""
+        row = self._claim()
+        if row is None:
+            return False
+        try:
+            row.guidance = generate_appeal_guidance.uncached({
+                'violation_type': row.violation_type,
+                'fine_amount': row.fine_amount,
+                'location': row.location,
+            })
+            row.status = 'ready'
+        except Exception as e:
+            print(f"Appeal guidance {row.id} failed: {e}")
+            row.attempts = (row.attempts or 0) + 1
+            if row.attempts >= MAX_ATTEMPTS:
+                row.status = 'failed'
+                row.guidance = FALLBACK_GUIDANCE
+            else:
+                row.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff_delay(row.attempts))
+        row.claimed_until = None
+        row.updated_at = datetime.utcnow()
+        db.session.commit()
+        if row.status != 'pending':
+            with self._ready:
+                self._ready.notify_all()
+        return True
+
+    def wait_for_change(self, timeout):
+        """Block until this process finishes a row or `timeout` passes"""
+        with self._ready:
+            self._ready.wait(timeout)
+
+    def _run(self):
+        while True:
+            processed = False
+            try:
+                with self.app.app_context():
+                    try:
+                        processed = self.run_once()
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                print(f"Appeal guidance worker failed: {e}")
+            if not processed:
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def _lookup(self, guidance_id):
+        """Short-lived read for streams, which run without a request-scoped session"""
+        with self.app.app_context():
+            try:
+                row = db.session.get(AppealGuidance, guidance_id)
+                return guidance_payload(row)
+            finally:
+                db.session.remove()
+
+    def stream(self, appeal_id, guidance_id):
+        """SSE body: a 'guidance' event once the text is available, heartbeats until then"""
+        deadline = time.monotonic() + STREAM_SECONDS
+        yield format_sse({'type': 'init', 'appeal_id': appeal_id}, retry=retry_hint())
+        while True:
+            payload = self._lookup(guidance_id)
+            if payload['status'] != 'pending':
+                yield format_sse(dict(payload, type='guidance', appeal_id=appeal_id))
+                return
+            if time.monotonic() >= deadline:
+                yield format_sse({'type': 'timeout', 'appeal_id': appeal_id})
+                return
+            # Woken early when this process finishes a row; other processes' results show up on the re-check
+            self.wait_for_change(STREAM_CHECK_SECONDS)
+            yield format_sse({'type': 'heartbeat', 'timestamp': time.time()})
+
+
+def guidance_payload(row):
+    if row is None:
+        return {'status': 'failed', 'guidance': FALLBACK_GUIDANCE}
+    return {'status': row.status, 'guidance': row.guidance if row.status != 'pending' else None}
+
+
+guidance_worker = GuidanceWorker()
+
+
+# ---- wake the worker when a transaction that queued guidance commits ----
+
+@event.listens_for(db.session, 'before_flush')
+def _note_requested(session, flush_context, instances):
+    if any(isinstance(obj, AppealGuidance) for obj in session.new):
+        session.info['_guidance_requested'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_worker(session):
+    if session.info.pop('_guidance_requested', False):
+        guidance_worker.wake()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_requested(session):
+    session.info.pop('_guidance_requested', None)
@@ -7,6 +7,7 @@ Features: No Helmet Detection, Vehicle Classification, Suspected Vehicle Detecti
 from datetime import datetime
 from models import Vehicle, Challan, db
 from advanced_detection_services import EdgeAnalyticsService, ANPRService
+from notification_queue import queue_many
 
 class BhopalITMSService:
     """Bhopal ITMS Integration Service"""
@@ -244,25 +245,11 @@ class BhopalITMSService:
         }
     
     @staticmethod
-    def auto_email_challan(challan_id):
-        """
-        Auto email challan to vehicle owner (Bhopal ITMS Feature)
-        """
-        challan = Challan.query.get(challan_id)
-        if not challan:
-            return {'success': False, 'message': 'Challan not found'}
-        
+    def _challan_email(challan):
         vehicle = challan.vehicle
         owner = vehicle.owner if vehicle else None
-        
-        if not owner or not owner.email:
-            return {'success': False, 'message': 'Owner email not found'}
-        
-        # In production, this would send email
-        email_data = {
-            'to': owner.email,
-            'subject': f'E-Challan #{challan.id} - {challan.violation_type}',
-            'body': f"""
+        subject = f'E-Challan #{challan.id} - {challan.violation_type}'
+        body = f"""
             Dear {owner.name or 'Vehicle Owner'},
             
             An E-Challan has been issued for your vehicle {vehicle.license_number}.
@@ -278,11 +265,43 @@ class BhopalITMSService:
             Thank you,
             AutoFINE System
             """
-        }
+        return owner.email, subject, body
+    
+    @staticmethod
+    def queue_challan_emails(challan_ids):
+        """
+        Queue challan e-mails for many challans in the current session
+        (one query, one INSERT); the notification workers send them in
+        batches over pooled SMTP sessions. Returns {challan_id: recipient}.
+        """
+        challans = Challan.query.options(Challan.with_vehicle_owner()).filter(Challan.id.in_(list(challan_ids))).all()
+        messages, recipients = [], {}
+        for challan in challans:
+            owner = challan.vehicle.owner if challan.vehicle else None
+            if not owner or not owner.email:
+                continue
+            messages.append(BhopalITMSService._challan_email(challan))
+            recipients[challan.id] = owner.email
+        queue_many('email', messages)
+        return recipients
+    
+    @staticmethod
+    def auto_email_challan(challan_id):
+        """
+        Auto email challan to vehicle owner (Bhopal ITMS Feature)
+        """
+        challan = Challan.query.options(Challan.with_vehicle_owner()).filter_by(id=challan_id).first()
+        if not challan:
+            return {'success': False, 'message': 'Challan not found'}
+        
+        vehicle = challan.vehicle
+        owner = vehicle.owner if vehicle else None
+        
+        if not owner or not owner.email:
+            return {'success': False, 'message': 'Owner email not found'}
         
-        # Mock email sending
-        print(f"[EMAIL] Sending challan to {owner.email}")
-        print(f"Subject: {email_data['subject']}")
+        queue_many('email', [BhopalITMSService._challan_email(challan)])
+        db.session.commit()
         
         return {
             'success': True,
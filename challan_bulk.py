@@ -0,0 +1,191 @@
+"""
+Bulk challan issuance for AutoFINE (camera-scale ingestion)
+
+`issue_challans()` takes a list of detections and issues them in one unit of
+work: plates are resolved with one query per chunk, missing vehicles are
+added together, fines and repeat offences come from one calculate_fines()
+call, every challan is inserted in a single flush and committed once, together with
+the queued SMS notices. The CSV audit rows are handed to the buffered
+challan log in one call.
+
+Each detection is a dict:
+
+    {"license_number": "UK07AB1234", "violation_type": "Speeding",
+     "location": "Rajpur Road", "amount": 0, "camera_id": "CAM-01",
+     "owner_name": "...", "vehicle_type": "Car", "timestamp": "2025-01-01T10:00:00"}
+
+`challan_type` is accepted as an alias of `violation_type`; `amount` > 0
+overrides the computed fine; `location` falls back to the camera's location.
+Results come back per item, in input order.
+"""
+
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from challan_log import log_challans
+from models import db, Challan, User, Vehicle
+from reference_cache import get_camera
+from notification_queue import queue_many
+from traffic_rules import calculate_fines
+
+MAX_BULK_ITEMS = 5000
+# Keep IN (...) lists well under SQLite's bound-parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+
+def _chunks(values, size=LOOKUP_CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _parse_detection(raw):
+    """Normalized detection dict, or raises ValueError with a per-item message"""
+    if not isinstance(raw, dict):
+        raise ValueError('Detection must be an object')
+    plate = (raw.get('license_number') or '').strip().upper()
+    violation_type = (raw.get('violation_type') or raw.get('challan_type') or '').strip()
+    if not plate:
+        raise ValueError('Number plate is required')
+    if not violation_type:
+        raise ValueError('Challan type is required')
+    try:
+        amount = float(raw.get('amount') or 0)
+    except (TypeError, ValueError):
+        raise ValueError('Amount must be a number')
+    created_at = None
+    if raw.get('timestamp'):
+        try:
+            created_at = datetime.fromisoformat(str(raw['timestamp']))
+        except ValueError:
+            raise ValueError('Invalid timestamp')
+        if created_at.tzinfo is not None:
+            # Stored times are naive UTC; an offset like +05:30 would not compare with them
+            created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    camera = get_camera(raw.get('camera_id'))
+    location = raw.get('location') or (camera['location'] if camera else None) or 'Unknown'
+    return {
+        'license_number': plate,
+        'violation_type': violation_type,
+        'location': location,
+        'amount': amount,
+        'owner_name': (raw.get('owner_name') or 'Unknown').strip(),
+        'vehicle_type': (raw.get('vehicle_type') or 'Car').strip(),
+        'created_at': created_at,
+    }
+
+
+def _resolve_vehicles(detections, default_owner_id):
+    """{plate: Vehicle} for every plate, creating missing vehicles (flushed, not committed)"""
+    plates = {d['license_number'] for d in detections}
+    vehicles = {}
+    for chunk in _chunks(plates):
+        for vehicle in Vehicle.query.filter(Vehicle.license_number.in_(chunk)):
+            vehicles[vehicle.license_number] = vehicle
+
+    missing = [d for d in detections if d['license_number'] not in vehicles]
+    if missing:
+        if not default_owner_id:
+            raise ValueError('No owner account to register new vehicles against')
+        now = datetime.now()
+        for d in missing:
+            if d['license_number'] in vehicles:
+                continue
+            vehicle = Vehicle(
+                license_number=d['license_number'],
+                owner_id=default_owner_id,
+                model='Unknown',
+                vehicle_type=d['vehicle_type'],
+                registration_date=now,
+                insurance_expiry=now + timedelta(days=365),
+                state='Uttarakhand',
+                city=d['location'].split(',')[0] if d['location'] else 'Dehradun'
+            )
+            db.session.add(vehicle)
+            vehicles[d['license_number']] = vehicle
+        db.session.flush()
+    return vehicles
+
+
+def _queue_owner_notices(notices):
+    """notices: [(owner_id, result dict)]; one phone lookup per chunk of owners, one INSERT"""
+    phones = {}
+    for chunk in _chunks({owner_id for owner_id, _ in notices}):
+        phones.update(db.session.query(User.id, User.phone).filter(User.id.in_(chunk)).all())
+    messages = []
+    for owner_id, item in notices:
+        if item['status'] == 'Court':
+            text = f"Court Challan issued. UIN: {item['uin']}, Vehicle: {item['license_number']}, Violation: {item['violation_type']}. Visit court for further process."
+        else:
+            text = f"Challan issued. UIN: {item['uin']}, Vehicle: {item['license_number']}, Violation: {item['violation_type']}, Fine: ₹{item['fine_amount']}."
+        messages.append((phones.get(owner_id), None, text))
+    queue_many('sms', messages)
+
+
+def issue_challans(raw_detections, default_owner_id=None, notify=True):
+    """
+    Issue one challan per valid detection and commit once.
+
+    Returns a list of per-item results in input order: either
+    {'index', 'success': True, 'challan_id', 'uin', 'fine_amount', 'status', 'license_number'}
+    or {'index', 'success': False, 'error'}. Invalid items do not stop the batch.
+    """
+    results = [None] * len(raw_detections)
+    detections = []
+    for index, raw in enumerate(raw_detections):
+        try:
+            d = _parse_detection(raw)
+        except ValueError as e:
+            results[index] = {'index': index, 'success': False, 'error': str(e)}
+            continue
+        d['index'] = index
+        detections.append(d)
+    if not detections:
+        return results
+
+    vehicles = _resolve_vehicles(detections, default_owner_id)
+    fines = calculate_fines([(d['violation_type'], vehicles[d['license_number']].id) for d in detections])
+
+    issued = []
+    due_date = datetime.now() + timedelta(days=30)
+    for d, (fine, _, court_mandatory) in zip(detections, fines):
+        vehicle = vehicles[d['license_number']]
+        challan = Challan(
+            vehicle_id=vehicle.id,
+            uin=f"UIN-{uuid.uuid4().hex[:12].upper()}",
+            violation_type=d['violation_type'],
+            location=d['location'],
+            fine_amount=d['amount'] if d['amount'] > 0 else fine,
+            status='Court' if court_mandatory else 'Unpaid',
+            due_date=due_date,
+        )
+        if d['created_at']:
+            challan.created_at = d['created_at']
+        issued.append((challan, vehicle, d))
+    db.session.add_all([challan for challan, _, _ in issued])
+    db.session.flush()
+
+    # Read everything needed from the flushed rows now: after commit each
+    # attribute access would reload its object with a separate query.
+    now = datetime.now().isoformat()
+    log_entries = []
+    notices = []
+    for challan, vehicle, d in issued:
+        result = {
+            'index': d['index'],
+            'success': True,
+            'challan_id': challan.id,
+            'uin': challan.uin,
+            'license_number': vehicle.license_number,
+            'fine_amount': challan.fine_amount,
+            'status': challan.status
+        }
+        results[d['index']] = result
+        log_entries.append([now, vehicle.license_number, d['owner_name'], d['vehicle_type'], d['violation_type'], d['location'], challan.fine_amount, challan.id, challan.uin])
+        notices.append((vehicle.owner_id, dict(result, violation_type=d['violation_type'])))
+    if notify:
+        _queue_owner_notices(notices)
+    db.session.commit()
+
+    log_challans(log_entries)
+    return results
@@ -0,0 +1,217 @@
+"""
+Write-maintained challan counters for AutoFINE dashboards
+
+Every flush that inserts/deletes a Challan or Vehicle, or changes a challan's
+status or violation type, applies +/- deltas to the `challan_counters` table
+on the same connection, i.e. inside the same transaction as the write. The
+admin dashboard and analytics then read a handful of rows instead of running
+COUNT(*) scans. Bulk `query.update()` / raw SQL writes bypass the ORM and are
+not seen here; `reconcile_counters()` detects and repairs that kind of drift.
+The table is seeded at start-up (`seed_counters()`, from the gunicorn worker
+hook, `python app.py` and init_database.py), never on a read path.
+"""
+
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import event, inspect as sa_inspect
+
+from db_upsert import upsert
+from models import db, Challan, ChallanCounter, Vehicle, Violation
+
+TOTAL_CHALLANS = 'challans'
+TOTAL_VEHICLES = 'vehicles'
+DEFAULT_STATUS = 'Unpaid'
+KNOWN_STATUSES = ('Unpaid', 'Paid', 'Disputed', 'Court')
+
+
+STATUS_PREFIX = 'status:'
+
+
+def status_key(status):
+    return f'{STATUS_PREFIX}{status or DEFAULT_STATUS}'
+
+
+def violation_key(violation_type):
+    return f'violation:{violation_type}'
+
+
+def _challan_keys(challan):
+    return [TOTAL_CHALLANS, status_key(challan.status), violation_key(challan.violation_type)]
+
+
+def _history_change(obj, attr):
+    """Return (old, new) if `attr` changed since the last flush, else None"""
+    hist = sa_inspect(obj).attrs[attr].history
+    if not hist.has_changes() or not hist.deleted:
+        return None
+    return hist.deleted[0], (hist.added[0] if hist.added else None)
+
+
+def _collect_deltas(session):
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, Challan):
+            for key in _challan_keys(obj):
+                deltas[key] += 1
+        elif isinstance(obj, Vehicle):
+            deltas[TOTAL_VEHICLES] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Challan):
+            for key in _challan_keys(obj):
+                deltas[key] -= 1
+        elif isinstance(obj, Vehicle):
+            deltas[TOTAL_VEHICLES] -= 1
+    for obj in session.dirty:
+        if not isinstance(obj, Challan) or obj in session.deleted:
+            continue
+        change = _history_change(obj, 'status')
+        if change:
+            deltas[status_key(change[0])] -= 1
+            deltas[status_key(change[1])] += 1
+        change = _history_change(obj, 'violation_type')
+        if change:
+            deltas[violation_key(change[0])] -= 1
+            deltas[violation_key(change[1])] += 1
+    return {k: v for k, v in deltas.items() if v}
+
+
+def _apply_deltas(connection, deltas):
+    table = ChallanCounter.__table__
+    now = datetime.utcnow()
+    missing = []
+    for name, delta in deltas.items():
+        result = connection.execute(
+            table.update()
+            .where(table.c.name == name)
+            .values(value=table.c.value + delta, updated_at=now)
+        )
+        if result.rowcount == 0:
+            missing.append(name)
+    if not missing:
+        return
+    # Until reconcile_counters() has seeded the table a delta alone would be
+    # wrong; after seeding, a missing key really did start from zero.
+    seeded = connection.execute(
+        table.select().where(table.c.name == TOTAL_CHALLANS)
+    ).first() is not None
+    if seeded:
+        for name in missing:
+            # Upsert: another process may be creating the same key
+            upsert(connection, table, {'name': name},
+                   {'value': deltas[name], 'updated_at': now},
+                   {'value': table.c.value + deltas[name], 'updated_at': now})
+
+
+# Make sure the previous value is loaded when these are set on an expired
+# challan, otherwise the attribute history has nothing to subtract from.
+@event.listens_for(Challan.status, 'set', active_history=True)
+@event.listens_for(Challan.violation_type, 'set', active_history=True)
+def _track_previous_value(target, value, oldvalue, initiator):
+    return value
+
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_counter_deltas(session, flush_context, instances):
+    # Collected before the flush, while deleted rows are still loadable
+    pending = session.info.setdefault('_counter_deltas', Counter())
+    pending.update(_collect_deltas(session))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _maintain_counters(session, flush_context):
+    deltas = {k: v for k, v in session.info.pop('_counter_deltas', {}).items() if v}
+    if deltas:
+        _apply_deltas(session.connection(), deltas)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_counter_deltas(session):
+    session.info.pop('_counter_deltas', None)
+
+
+def get_counters():
+    """All counters as a dict, read in one query"""
+    return {c.name: c.value for c in ChallanCounter.query.all()}
+
+
+def dashboard_stats():
+    """The four admin dashboard numbers, from counters (seeded at start-up, see seed_counters)"""
+    counters = get_counters()
+    return {
+        'total_vehicles': counters.get(TOTAL_VEHICLES, 0),
+        'total_challans': counters.get(TOTAL_CHALLANS, 0),
+        'unpaid_challans': counters.get(status_key('Unpaid'), 0),
+        'paid_challans': counters.get(status_key('Paid'), 0)
+    }
+
+
+def status_counts():
+    """{status: count} from counters, non-zero only"""
+    prefix = STATUS_PREFIX
+    counters = get_counters()
+    return {name[len(prefix):]: value for name, value in counters.items() if name.startswith(prefix) and value}
+
+
+def violation_counts():
+    """[(violation_type, count)] from counters, non-zero only"""
+    prefix = violation_key('')
+    return [
+        (name[len(prefix):], value)
+        for name, value in get_counters().items()
+        if name.startswith(prefix) and value
+    ]
+
+
+def compute_true_counts():
+    """Recompute every counter from the base tables (full scans; reconciliation only)"""
+    true_counts = {
+        TOTAL_VEHICLES: Vehicle.query.count(),
+        TOTAL_CHALLANS: Challan.query.count(),
+    }
+    # Pre-create the usual keys at zero so later writes only ever UPDATE
+    for status in KNOWN_STATUSES:
+        true_counts[status_key(status)] = 0
+    for (vtype,) in db.session.query(Violation.violation_type):
+        true_counts[violation_key(vtype)] = 0
+    for status, n in db.session.query(Challan.status, db.func.count(Challan.id)).group_by(Challan.status):
+        key = status_key(status)
+        true_counts[key] = true_counts.get(key, 0) + n
+    for vtype, n in db.session.query(Challan.violation_type, db.func.count(Challan.id)).group_by(Challan.violation_type):
+        true_counts[violation_key(vtype)] = n
+    return true_counts
+
+
+def reconcile_counters(repair=True):
+    """
+    Compare stored counters with true counts.
+
+    Returns {name: {'stored': x, 'actual': y}} for every drifted counter and,
+    when `repair` is set, overwrites the stored values and commits.
+    """
+    actual = compute_true_counts()
+    stored = get_counters()
+    drift = {}
+    for name in set(actual) | set(stored):
+        a, s = actual.get(name, 0), stored.get(name, 0)
+        if a != s or name not in stored:
+            drift[name] = {'stored': s, 'actual': a}
+
+    if repair and drift:
+        now = datetime.utcnow()
+        connection = db.session.connection()
+        table = ChallanCounter.__table__
+        for name, values in drift.items():
+            row = {'value': values['actual'], 'updated_at': now}
+            upsert(connection, table, {'name': name}, row, row)
+        db.session.commit()
+    return drift
+
+
+def seed_counters():
+    """Seed the counters from the base tables if that has never been done; returns True if it seeded"""
+    if db.session.get(ChallanCounter, TOTAL_CHALLANS) is not None:
+        db.session.commit()
+        return False
+    reconcile_counters()
+    return True
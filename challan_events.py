@@ -0,0 +1,119 @@
+"""
+Challan change log (outbox) for AutoFINE
+
+Every ORM flush that inserts a challan, changes its status (payment, appeal,
+court referral, payment-plan completion, ...) or deletes it appends a row to
+`challan_events` on the same connection, so the event commits or rolls back
+together with the change itself. Sequence numbers only grow, which lets
+consumers (realtime streams, notifications, rollups, exports) remember the
+last `seq` they processed and read only what came after it.
+
+Sequence numbers are assigned at insert time, so with concurrent writers a
+lower number can become visible after a higher one, and rolled-back inserts
+leave permanent gaps. `EventTail` handles both: it stops at a gap and only
+skips past it once the gap is older than `gap_timeout` seconds.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, inspect as sa_inspect
+
+from models import db, Challan, ChallanEvent
+
+CREATED = 'created'
+STATUS_CHANGED = 'status_changed'
+DELETED = 'deleted'
+
+DEFAULT_GAP_TIMEOUT = 5.0
+
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_challan_events(session, flush_context, instances):
+    pending = session.info.setdefault('_challan_events', [])
+    for obj in session.new:
+        if isinstance(obj, Challan):
+            # id is only known after the flush
+            pending.append((CREATED, obj, None))
+    for obj in session.dirty:
+        if not isinstance(obj, Challan) or obj in session.deleted:
+            continue
+        history = sa_inspect(obj).attrs.status.history
+        if history.has_changes():
+            old = history.deleted[0] if history.deleted else None
+            if old != obj.status:
+                pending.append((STATUS_CHANGED, obj, old))
+    for obj in session.deleted:
+        if isinstance(obj, Challan):
+            pending.append((DELETED, obj, obj.status))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _write_challan_events(session, flush_context):
+    pending = session.info.pop('_challan_events', None)
+    if not pending:
+        return
+    now = datetime.utcnow()
+    rows = [{
+        'challan_id': obj.id,
+        'vehicle_id': obj.vehicle_id,
+        'event_type': event_type,
+        'old_status': old,
+        'new_status': None if event_type == DELETED else obj.status,
+        'created_at': now
+    } for event_type, obj, old in pending]
+    session.connection().execute(ChallanEvent.__table__.insert(), rows)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_challan_events(session):
+    session.info.pop('_challan_events', None)
+
+
+def latest_seq():
+    """Highest sequence number written so far (0 if the log is empty)"""
+    return db.session.query(db.func.max(ChallanEvent.seq)).scalar() or 0
+
+
+def read_events(after_seq, limit=500, vehicle_ids=None):
+    """Events with seq > `after_seq`, oldest first"""
+    query = ChallanEvent.query.filter(ChallanEvent.seq > after_seq)
+    if vehicle_ids is not None:
+        query = query.filter(ChallanEvent.vehicle_id.in_(vehicle_ids))
+    return query.order_by(ChallanEvent.seq).limit(limit).all()
+
+
+class EventTail:
+    """Incremental reader over `challan_events` that does not skip late commits"""
+
+    def __init__(self, position=0, gap_timeout=DEFAULT_GAP_TIMEOUT):
+        self.position = position
+        self.gap_timeout = gap_timeout
+        self._gap_since = None
+
+    def poll(self, limit=500):
+        """Return the next contiguous batch of events and advance past it"""
+        batch = []
+        expected = self.position + 1
+        for ev in read_events(self.position, limit):
+            if ev.seq != expected:
+                # Either an uncommitted transaction holds `expected` or it was rolled back
+                now = time.monotonic()
+                if self._gap_since is None:
+                    self._gap_since = now
+                if now - self._gap_since < self.gap_timeout:
+                    break
+            self._gap_since = None
+            batch.append(ev)
+            expected = ev.seq + 1
+        if batch:
+            self.position = batch[-1].seq
+        return batch
+
+
+def prune_events(older_than_days=30):
+    """Delete events older than the retention window; returns the number removed"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    removed = ChallanEvent.query.filter(ChallanEvent.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
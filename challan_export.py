@@ -0,0 +1,103 @@
+"""
+Streaming challan export for AutoFINE
+Generates JSON / NDJSON / CSV bytes chunk by chunk, optionally gzip-compressed
+"""
+
+import csv
+import io
+import json
+import zlib
+
+from challan_queries import iter_challans, row_to_dict
+
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_FIELDS = [
+    'id', 'uin', 'vehicle_id', 'license_number', 'violation_type', 'location',
+    'fine_amount', 'status', 'created_at', 'due_date', 'paid_at', 'payment_ref'
+]
+
+EXPORT_MIMETYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def negotiate_format(requested, accept_header):
+    """Pick the export format from ?format= first, then the Accept header; default json"""
+    requested = (requested or '').strip().lower()
+    if requested in EXPORT_MIMETYPES:
+        return requested
+    accept = (accept_header or '').lower()
+    if 'application/x-ndjson' in accept or 'application/jsonl' in accept:
+        return 'ndjson'
+    if 'text/csv' in accept:
+        return 'csv'
+    return 'json'
+
+
+def accepts_gzip(accept_encoding):
+    """True if the client lists gzip in Accept-Encoding (and did not disable it with q=0)"""
+    for part in (accept_encoding or '').lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        if coding.strip() == 'gzip':
+            return params.replace(' ', '') not in ('q=0', 'q=0.0')
+    return False
+
+
+def _json_chunks(filters, chunk_size):
+    # Same document shape the endpoint always returned: {"data": [...]}
+    yield '{"data": ['
+    first = True
+    for rows in iter_challans(filters, chunk_size):
+        parts = []
+        for row in rows:
+            parts.append(('' if first else ',') + json.dumps(row_to_dict(row)))
+            first = False
+        yield ''.join(parts)
+    yield ']}'
+
+
+def _ndjson_chunks(filters, chunk_size):
+    for rows in iter_challans(filters, chunk_size):
+        yield ''.join(json.dumps(row_to_dict(row)) + '\n' for row in rows)
+
+
+def _csv_chunks(filters, chunk_size):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_FIELDS)
+    yield buf.getvalue()
+    for rows in iter_challans(filters, chunk_size):
+        buf.seek(0)
+        buf.truncate()
+        for row in rows:
+            data = row_to_dict(row)
+            writer.writerow([data[f] for f in EXPORT_FIELDS])
+        yield buf.getvalue()
+
+
+def _gzip_stream(chunks):
+    # wbits=31 -> gzip container; sync-flush each chunk so bytes reach the client immediately
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_challans(filters, fmt='json', gzip=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Generator of encoded bytes for a challan export.
+
+    Rows are fetched `chunk_size` at a time and written out before the next
+    chunk is read, so the first bytes go out immediately and memory use does
+    not grow with the number of challans.
+    """
+    producers = {'json': _json_chunks, 'ndjson': _ndjson_chunks, 'csv': _csv_chunks}
+    chunks = (text.encode('utf-8') for text in producers[fmt](filters, chunk_size))
+    if gzip:
+        return _gzip_stream(chunks)
+    return chunks
@@ -0,0 +1,178 @@
+"""
+Buffered challan audit log for AutoFINE (data/challan_generation.csv)
+
+Request handlers call `log_challans(rows)`, which only appends to an
+in-process buffer. A background thread writes the buffer out at least every
+CHALLAN_LOG_FLUSH_SECONDS (sooner once CHALLAN_LOG_FLUSH_ROWS rows are
+waiting), so the request path never touches the file. Remaining rows are
+flushed at interpreter exit.
+
+Each flush holds an exclusive lock on `<log>.lock` (fcntl, where available)
+while it appends and rotates, so gunicorn workers sharing the file never
+interleave rows or write the header twice. The live file is rotated to
+`challan_generation-<YYYYmmdd-HHMMSS>.csv` once it exceeds
+CHALLAN_LOG_MAX_BYTES or its first row is older than
+CHALLAN_LOG_ROTATE_SECONDS (0 disables either check); with CHALLAN_LOG_GZIP=1
+rotated segments are compressed, and CHALLAN_LOG_BACKUPS > 0 limits how many
+are kept.
+"""
+
+import atexit
+import csv
+import gzip
+import io
+import os
+import shutil
+import threading
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows dev server: single process, the in-process lock is enough
+    fcntl = None
+
+LOG_PATH = os.environ.get('CHALLAN_LOG_PATH') or os.path.join(os.path.dirname(__file__), 'data', 'challan_generation.csv')
+FLUSH_SECONDS = float(os.environ.get('CHALLAN_LOG_FLUSH_SECONDS', '1'))
+FLUSH_ROWS = int(os.environ.get('CHALLAN_LOG_FLUSH_ROWS', '500'))
+MAX_BYTES = int(os.environ.get('CHALLAN_LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+ROTATE_SECONDS = int(os.environ.get('CHALLAN_LOG_ROTATE_SECONDS', '86400'))
+GZIP_SEGMENTS = os.environ.get('CHALLAN_LOG_GZIP', '0') == '1'
+BACKUPS = int(os.environ.get('CHALLAN_LOG_BACKUPS', '0'))
+
+CSV_HEADER = ['timestamp', 'license_number', 'owner_name', 'vehicle_type', 'challan_type', 'location', 'amount', 'challan_id', 'uin']
+
+
+class ChallanLogWriter:
+    """In-process row buffer with a background flusher and size/time rotation"""
+
+    def __init__(self, path=LOG_PATH, flush_seconds=FLUSH_SECONDS, flush_rows=FLUSH_ROWS,
+                 max_bytes=MAX_BYTES, rotate_seconds=ROTATE_SECONDS, gzip_segments=GZIP_SEGMENTS,
+                 backups=BACKUPS):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.flush_rows = flush_rows
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.gzip_segments = gzip_segments
+        self.backups = backups
+        self._buffer = []
+        self._lock = threading.Lock()        # guards _buffer and thread start
+        self._write_lock = threading.Lock()  # one flush at a time in this process
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def append(self, rows):
+        """Buffer rows for the next flush; never does file I/O"""
+        rows = [list(r) for r in rows]
+        if not rows:
+            return
+        with self._lock:
+            self._buffer.extend(rows)
+            pending = len(self._buffer)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='challan-log', daemon=True)
+                self._thread.start()
+        if pending >= self.flush_rows:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows out; returns the number written"""
+        with self._write_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+            try:
+                rotated = self._write(rows)
+            except Exception as e:
+                # Keep the rows for the next attempt rather than losing the audit trail
+                with self._lock:
+                    self._buffer[:0] = rows
+                print(f"Challan CSV log flush failed: {e}")
+                return 0
+        if rotated:
+            self._finish_segment(rotated)
+        return len(rows)
+
+    def _write(self, rows):
+        """Append under the cross-process lock; returns the rotated segment path, if any"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerows(rows)
+        data = out.getvalue()
+
+        with open(self.path + '.lock', 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                rotated = self._rotate_if_due()
+                with open(self.path, 'a', newline='', encoding='utf-8') as f:
+                    if f.tell() == 0:
+                        csv.writer(f).writerow(CSV_HEADER)
+                    f.write(data)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return rotated
+
+    def _first_row_time(self):
+        try:
+            with open(self.path, newline='', encoding='utf-8') as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                row = next(reader, None)
+            return datetime.fromisoformat(row[0]) if row else None
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def _rotate_if_due(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return None
+        due = bool(self.max_bytes) and size >= self.max_bytes
+        if not due and self.rotate_seconds:
+            started = self._first_row_time()
+            due = started is not None and (datetime.now() - started).total_seconds() >= self.rotate_seconds
+        if not due:
+            return None
+        base, ext = os.path.splitext(self.path)
+        target = f"{base}-{datetime.now().strftime('%Y%m%d-%H%M%S')}{ext}"
+        suffix = 1
+        while os.path.exists(target) or os.path.exists(target + '.gz'):
+            target = f"{base}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{suffix}{ext}"
+            suffix += 1
+        os.replace(self.path, target)
+        return target
+
+    def _finish_segment(self, segment):
+        """Compress and prune rotated segments (outside the lock; the live file is already free)"""
+        try:
+            if self.gzip_segments:
+                with open(segment, 'rb') as src, gzip.open(segment + '.gz', 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(segment)
+            if self.backups > 0:
+                directory = os.path.dirname(self.path)
+                prefix = os.path.splitext(os.path.basename(self.path))[0] + '-'
+                segments = sorted(name for name in os.listdir(directory) if name.startswith(prefix))
+                for name in segments[:-self.backups]:
+                    os.remove(os.path.join(directory, name))
+        except Exception as e:
+            print(f"Challan CSV log rotation cleanup failed: {e}")
+
+
+challan_log = ChallanLogWriter()
+atexit.register(challan_log.flush)
+
+
+def log_challans(rows):
+    """Buffer challan audit rows (see CSV_HEADER for the columns)"""
+    challan_log.append(rows)
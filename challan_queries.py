@@ -0,0 +1,179 @@
+"""
+Challan listing queries for AutoFINE admin views
+Keyset (created_at, id) pagination with server-side filters
+
+Challans without a created_at (imports, raw inserts) come after all dated
+ones, newest id first; each segment is paged with its own index-friendly query.
+"""
+
+import base64
+from datetime import datetime, timedelta
+
+from models import Challan, Vehicle, db
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(created_at, challan_id):
+    """Encode the (created_at, id) position of a row into an opaque URL-safe token (created_at may be None)"""
+    raw = f"{created_at.isoformat() if created_at else ''}|{challan_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a cursor token; returns (created_at, id) or None if it is missing/invalid"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        ts, challan_id = raw.rsplit('|', 1)
+        return (datetime.fromisoformat(ts) if ts else None), int(challan_id)
+    except Exception:
+        return None
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+
+
+def parse_challan_filters(args):
+    """Read listing filters from request args into a plain dict"""
+    return {
+        'status': (args.get('status') or '').strip(),
+        'violation_type': (args.get('violation_type') or '').strip(),
+        'location': (args.get('location') or '').strip(),
+        'plate_prefix': (args.get('search') or '').strip().upper(),
+        'date_from': (args.get('date_from') or '').strip(),
+        'date_to': (args.get('date_to') or '').strip(),
+    }
+
+
+def challan_list_query(filters):
+    """
+    Build the single Challan JOIN Vehicle query used by the admin listing.
+    Only the columns the views need are selected, so no ORM objects or
+    lazy relationship loads are involved.
+    """
+    query = db.session.query(
+        Challan.id,
+        Challan.uin,
+        Challan.vehicle_id,
+        Vehicle.license_number,
+        Challan.violation_type,
+        Challan.location,
+        Challan.fine_amount,
+        Challan.status,
+        Challan.created_at,
+        Challan.due_date,
+        Challan.paid_at,
+        Challan.payment_ref,
+    ).join(Vehicle, Challan.vehicle_id == Vehicle.id)
+
+    if filters.get('status'):
+        query = query.filter(Challan.status == filters['status'])
+    if filters.get('violation_type'):
+        query = query.filter(Challan.violation_type == filters['violation_type'])
+    if filters.get('location'):
+        # Prefix match so an index on location can be used
+        query = query.filter(Challan.location.like(f"{filters['location']}%"))
+    if filters.get('plate_prefix'):
+        query = query.filter(Vehicle.license_number.like(f"{filters['plate_prefix']}%"))
+
+    date_from = _parse_date(filters.get('date_from'))
+    if date_from:
+        query = query.filter(Challan.created_at >= date_from)
+    date_to = _parse_date(filters.get('date_to'))
+    if date_to:
+        query = query.filter(Challan.created_at < date_to + timedelta(days=1))
+
+    return query
+
+
+def _keyset_page(query, position, limit):
+    """
+    Fetch `limit` rows after `position`: (created_at, id) descending, then
+    rows with no created_at by id descending. A position with created_at None
+    is inside that second segment.
+    """
+    rows = []
+    if position is None or position[0] is not None:
+        dated = query.filter(Challan.created_at.isnot(None))
+        if position:
+            created_at, challan_id = position
+            dated = dated.filter(db.or_(
+                Challan.created_at < created_at,
+                db.and_(Challan.created_at == created_at, Challan.id < challan_id),
+            ))
+        rows = (
+            dated.order_by(Challan.created_at.desc(), Challan.id.desc())
+            .limit(limit)
+            .all()
+        )
+        if len(rows) == limit:
+            return rows
+        position = None  # continue from the top of the undated segment
+
+    undated = query.filter(Challan.created_at.is_(None))
+    if position:
+        undated = undated.filter(Challan.id < position[1])
+    return rows + undated.order_by(Challan.id.desc()).limit(limit - len(rows)).all()
+
+
+def paginate_challans(filters, cursor=None, per_page=DEFAULT_PAGE_SIZE):
+    """
+    Fetch one page of challans, newest first.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    per_page = max(1, min(int(per_page or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    rows = _keyset_page(challan_list_query(filters), decode_cursor(cursor), per_page + 1)
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return rows, next_cursor
+
+
+def iter_challans(filters, chunk_size=1000):
+    """
+    Yield lists of challan rows, newest first, `chunk_size` rows at a time.
+
+    Each chunk is its own short keyset query over plain column rows, so memory
+    stays constant however many challans match.
+    """
+    query = challan_list_query(filters)
+    position = None
+    while True:
+        rows = _keyset_page(query, position, chunk_size)
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]
+        position = (last.created_at, last.id)
+
+
+def row_to_dict(row):
+    """Serialize a listing row with the same keys as Challan.to_dict()"""
+    return {
+        'id': row.id,
+        'uin': row.uin,
+        'vehicle_id': row.vehicle_id,
+        'license_number': row.license_number or 'N/A',
+        'violation_type': row.violation_type,
+        'location': row.location,
+        'fine_amount': row.fine_amount,
+        'status': row.status,
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+        'due_date': row.due_date.isoformat() if row.due_date else None,
+        'paid_at': row.paid_at.isoformat() if row.paid_at else None,
+        'payment_ref': row.payment_ref
+    }
@@ -0,0 +1,209 @@
+"""
+Indexed public challan search for AutoFINE
+
+UINs, vehicle numbers and DL numbers are stored in `search_terms` in a
+normalized form (upper-case, letters and digits only) together with the
+reversed term. Both columns carry plain B-tree indexes, so an exact,
+prefix ("UK07AB...") or suffix ("...1234") lookup is an index range scan on
+SQLite and Postgres alike instead of six LIKE '%q%' scans over three tables.
+
+Rows are kept in sync from session flush hooks whenever a challan, vehicle
+or user is inserted, deleted or has its key changed. `seed_search_index()`
+runs at start-up (gunicorn worker init, `python app.py`, init_database.py)
+and rebuilds the index when its refs no longer match the base tables, e.g.
+for rows written before the index existed or by bulk SQL that bypasses the
+session.
+"""
+
+import re
+
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import contains_eager
+
+from models import db, Challan, SearchTerm, User, Vehicle
+
+# kind -> (model, attribute holding the searchable key)
+INDEXED_KEYS = {
+    'uin': (Challan, 'uin'),
+    'plate': (Vehicle, 'license_number'),
+    'dl': (User, 'dl_number'),
+}
+
+# Cap per term lookup so a one-character prefix cannot expand to the whole table
+MAX_TERM_HITS = 200
+# Keep IN (...) lists well under SQLite's bound-parameter limit
+DELETE_CHUNK_SIZE = 500
+
+
+def normalize_term(value):
+    """'uk07 ab-1234' -> 'UK07AB1234'"""
+    return re.sub(r'[^A-Z0-9]', '', (value or '').upper())
+
+
+def _successor(term):
+    # Smallest string greater than every string starting with `term` (terms are [A-Z0-9])
+    return term[:-1] + chr(ord(term[-1]) + 1)
+
+
+def _kind_for(obj):
+    for kind, (model, attr) in INDEXED_KEYS.items():
+        if isinstance(obj, model):
+            return kind, attr
+    return None, None
+
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_search_ops(session, flush_context, instances):
+    ops = session.info.setdefault('_search_ops', [])
+    for obj in session.new:
+        kind, attr = _kind_for(obj)
+        if kind:
+            ops.append(('upsert', kind, obj, attr))
+    for obj in session.dirty:
+        kind, attr = _kind_for(obj)
+        if kind and obj not in session.deleted and sa_inspect(obj).attrs[attr].history.has_changes():
+            ops.append(('upsert', kind, obj, attr))
+    for obj in session.deleted:
+        kind, _ = _kind_for(obj)
+        if kind:
+            ops.append(('delete', kind, obj.id, None))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _apply_search_ops(session, flush_context):
+    ops = session.info.pop('_search_ops', [])
+    if not ops:
+        return
+    table = SearchTerm.__table__
+    connection = session.connection()
+    # One DELETE per kind and one executemany INSERT, however many rows were flushed
+    stale = {}
+    rows = []
+    for action, kind, target, attr in ops:
+        ref_id = target if action == 'delete' else target.id
+        stale.setdefault(kind, set()).add(ref_id)
+        if action == 'upsert':
+            term = normalize_term(getattr(target, attr))
+            if term:
+                rows.append({'kind': kind, 'ref_id': ref_id, 'term': term, 'rterm': term[::-1]})
+    for kind, ref_ids in stale.items():
+        ref_ids = list(ref_ids)
+        for i in range(0, len(ref_ids), DELETE_CHUNK_SIZE):
+            connection.execute(table.delete().where(
+                table.c.kind == kind, table.c.ref_id.in_(ref_ids[i:i + DELETE_CHUNK_SIZE])
+            ))
+    # A key renamed twice in one flush would otherwise be inserted twice
+    rows = list({(r['kind'], r['ref_id']): r for r in rows}.values())
+    if rows:
+        connection.execute(table.insert(), rows)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_search_ops(session):
+    session.info.pop('_search_ops', None)
+
+
+def rebuild_search_index(batch_size=5000):
+    """Recreate every search term from the base tables; returns the number of rows written"""
+    table = SearchTerm.__table__
+    db.session.execute(table.delete())
+    written = 0
+    for kind, (model, attr) in INDEXED_KEYS.items():
+        column = getattr(model, attr)
+        rows = []
+        for ref_id, value in db.session.query(model.id, column).filter(column.isnot(None)).yield_per(batch_size):
+            term = normalize_term(value)
+            if term:
+                rows.append({'kind': kind, 'ref_id': ref_id, 'term': term, 'rterm': term[::-1]})
+            if len(rows) >= batch_size:
+                db.session.execute(table.insert(), rows)
+                written += len(rows)
+                rows = []
+        if rows:
+            db.session.execute(table.insert(), rows)
+            written += len(rows)
+    db.session.commit()
+    return written
+
+
+def search_index_drift():
+    """
+    {kind: {'indexed': x, 'live': y, 'expected': z}} for every kind whose
+    terms do not cover the base table: `indexed` terms of that kind, `live`
+    of them still pointing at an existing row, `expected` rows with a key.
+    """
+    drift = {}
+    for kind, (model, attr) in INDEXED_KEYS.items():
+        column = getattr(model, attr)
+        expected = db.session.query(db.func.count(model.id)).filter(column.isnot(None), column != '').scalar()
+        indexed = db.session.query(db.func.count(SearchTerm.id)).filter(SearchTerm.kind == kind).scalar()
+        live = (
+            db.session.query(db.func.count(SearchTerm.id))
+            .join(model, model.id == SearchTerm.ref_id)
+            .filter(SearchTerm.kind == kind)
+            .scalar()
+        )
+        if not indexed == live == expected:
+            drift[kind] = {'indexed': indexed, 'live': live, 'expected': expected}
+    return drift
+
+
+def seed_search_index():
+    """Rebuild the index if it has drifted from the base tables; returns True if it rebuilt"""
+    if not search_index_drift():
+        db.session.commit()
+        return False
+    try:
+        rebuild_search_index()
+    except IntegrityError:
+        # Another worker rebuilt the index concurrently; its rows are current
+        db.session.rollback()
+        return False
+    return True
+
+
+def _matching_refs(term):
+    """{kind: set(ref_id)}: exact matches first, then prefix and suffix matches up to the cap"""
+    refs = {kind: set() for kind in INDEXED_KEYS}
+    exact = db.session.query(SearchTerm.kind, SearchTerm.ref_id).filter(SearchTerm.term == term)
+    for kind, ref_id in exact.limit(MAX_TERM_HITS):
+        refs[kind].add(ref_id)
+
+    rterm = term[::-1]
+    ranged = db.session.query(SearchTerm.kind, SearchTerm.ref_id).filter(db.or_(
+        db.and_(SearchTerm.term > term, SearchTerm.term < _successor(term)),
+        db.and_(SearchTerm.rterm >= rterm, SearchTerm.rterm < _successor(rterm)),
+    ))
+    for kind, ref_id in ranged.limit(MAX_TERM_HITS):
+        refs[kind].add(ref_id)
+    return refs
+
+
+def search_challans(q, city=None, limit=50):
+    """
+    Challans matching a UIN / vehicle number / DL number (exact, prefix or
+    suffix) or a numeric challan id ("12" / "#12"), newest first.
+    """
+    term = normalize_term(q)
+    if not term:
+        return []
+
+    refs = _matching_refs(term)
+    conditions = []
+    q_digits = (q or '').replace('#', '').strip()
+    if q_digits.isdigit():
+        refs['uin'].add(int(q_digits))
+    if refs['uin']:
+        conditions.append(Challan.id.in_(refs['uin']))
+    if refs['plate']:
+        conditions.append(Challan.vehicle_id.in_(refs['plate']))
+    if refs['dl']:
+        conditions.append(Vehicle.owner_id.in_(refs['dl']))
+    if not conditions:
+        return []
+
+    query = Challan.query.join(Vehicle).options(contains_eager(Challan.vehicle)).filter(db.or_(*conditions))
+    if city:
+        query = query.filter(Vehicle.city == city)
+    return query.order_by(Challan.created_at.desc()).limit(limit).all()
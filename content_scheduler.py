@@ -0,0 +1,187 @@
+"""
+Background pre-generation of Gemini content for AutoFINE
+
+The home-page news, the AI notices batch and insights for the configured
+cities (the app's CITY_COORDS) are generated
+on a fixed cadence by a scheduler thread and stored in `generated_content`
+(notices are also written to the `notices` table, replacing the previous AI
+batch). `/`, `/api/gemini/news`, `/api/gemini/notices` and
+`/api/predictive/city` read the stored artifact with one primary-key lookup
+instead of calling the model.
+
+Every process runs the scheduler, but an artifact is regenerated by only one
+of them: the process that wins a conditional UPDATE on `claimed_until` does
+the work, the others skip it. A failed run keeps the previous artifact and is
+retried after CONTENT_RETRY_SECONDS. `flask pregenerate-content` runs one
+pass from the CLI.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from gemini_service import generate_traffic_news, generate_traffic_notices, get_predictive_insights
+from models import db, GeneratedContent, Notice
+
+TICK_SECONDS = float(os.environ.get('CONTENT_TICK_SECONDS', '60'))
+NEWS_EVERY = int(os.environ.get('CONTENT_NEWS_SECONDS', '1800'))
+NOTICES_EVERY = int(os.environ.get('CONTENT_NOTICES_SECONDS', str(6 * 3600)))
+INSIGHTS_EVERY = int(os.environ.get('CONTENT_INSIGHTS_SECONDS', str(6 * 3600)))
+RETRY_SECONDS = int(os.environ.get('CONTENT_RETRY_SECONDS', '300'))
+LEASE_SECONDS = int(os.environ.get('CONTENT_LEASE_SECONDS', '600'))
+
+
+def city_key(city):
+    return f"city_insights:{(city or '').strip().lower()}"
+
+
+def get_artifact(name):
+    """Stored payload for `name` (decoded JSON), or None if it has not been generated yet"""
+    row = db.session.get(GeneratedContent, name)
+    if row is None or row.payload is None:
+        return None
+    return json.loads(row.payload)
+
+
+def _claim(name, every, force=False):
+    """Take the right to regenerate `name` if it is due and nobody else holds it"""
+    if db.session.get(GeneratedContent, name) is None:
+        try:
+            db.session.add(GeneratedContent(name=name))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+    now = datetime.utcnow()
+    query = GeneratedContent.query.filter(
+        GeneratedContent.name == name,
+        db.or_(GeneratedContent.claimed_until.is_(None), GeneratedContent.claimed_until < now),
+    )
+    if not force:
+        query = query.filter(db.or_(
+            GeneratedContent.generated_at.is_(None),
+            GeneratedContent.generated_at <= now - timedelta(seconds=every),
+        ))
+    claimed = query.update({'claimed_until': now + timedelta(seconds=LEASE_SECONDS)}, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def _store(name, payload):
+    row = db.session.get(GeneratedContent, name)
+    row.payload = json.dumps(payload)
+    row.generated_at = datetime.utcnow()
+    row.claimed_until = None
+    db.session.commit()
+
+
+def _release_after_failure(name, error):
+    db.session.rollback()
+    print(f"Pre-generating {name} failed: {error}")
+    GeneratedContent.query.filter_by(name=name).update(
+        {'claimed_until': datetime.utcnow() + timedelta(seconds=RETRY_SECONDS)}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+def _generate_news():
+    return generate_traffic_news.uncached()
+
+
+def _generate_notices():
+    notices = generate_traffic_notices.uncached()
+    if not notices:
+        raise ValueError('Gemini returned no notices')
+    previous = get_artifact('notices') or {}
+    stale_ids = previous.get('notice_ids') or []
+    if stale_ids:
+        Notice.query.filter(Notice.id.in_(stale_ids)).delete(synchronize_session=False)
+    published_at = datetime.utcnow()
+    rows = [Notice(scope=n['scope'], title=n['title'][:200], body=n['body'], state=n['state'],
+                   city=n['city'], published_at=published_at) for n in notices]
+    db.session.add_all(rows)
+    db.session.flush()
+    day = published_at.strftime('%Y-%m-%d')
+    return {
+        'notice_ids': [r.id for r in rows],
+        'notices': [dict(n, published_at=day) for n in notices],
+    }
+
+
+class ContentScheduler:
+    """Regenerates due artifacts from a background thread (one per process)"""
+
+    def __init__(self):
+        self.app = None
+        self.cities = lambda: []
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app, cities=None):
+        """`cities` returns the city names to pre-generate insights for"""
+        self.app = app
+        if cities is not None:
+            self.cities = cities
+        if os.environ.get('CONTENT_SCHEDULER', '1') != '0':
+            # Start on the first request rather than at import, so CLI commands stay single-threaded
+            app.before_request(self._ensure_started)
+
+    def wake(self):
+        self._ensure_started()
+        self._wakeup.set()
+
+    def _ensure_started(self):
+        if self._thread is not None or self.app is None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='content-scheduler', daemon=True)
+                self._thread.start()
+
+    def jobs(self):
+        """[(artifact name, cadence seconds, generator)]"""
+        jobs = [
+            ('news', NEWS_EVERY, _generate_news),
+            ('notices', NOTICES_EVERY, _generate_notices),
+        ]
+        # Only the configured cities: scheduling every vehicle registration city would
+        # grow model calls with user data. Other cities use the cached on-demand call.
+        cities = {}
+        for city in self.cities():
+            if city and city.strip():
+                cities.setdefault(city_key(city), city.strip())
+        for name, city in sorted(cities.items()):
+            jobs.append((name, INSIGHTS_EVERY, lambda city=city: get_predictive_insights.uncached(location=city)))
+        return jobs
+
+    def run_due(self, force=False):
+        """Regenerate every due artifact this process can claim; returns the names generated"""
+        generated = []
+        for name, every, generate in self.jobs():
+            if not _claim(name, every, force):
+                continue
+            try:
+                _store(name, generate())
+                generated.append(name)
+            except Exception as e:
+                _release_after_failure(name, e)
+        return generated
+
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    try:
+                        self.run_due()
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                print(f"Content scheduler failed: {e}")
+            self._wakeup.wait(TICK_SECONDS)
+            self._wakeup.clear()
+
+
+content_scheduler = ContentScheduler()
@@ -0,0 +1,44 @@
+"""
+Insert-or-update for AutoFINE's write-maintained counter tables
+
+A counter row is created by whichever transaction first writes its key, so
+two processes can race to insert the same primary key. `upsert` uses the
+database's INSERT ... ON CONFLICT DO UPDATE on SQLite and PostgreSQL; other
+databases get UPDATE, then INSERT inside a savepoint, then UPDATE again if
+another transaction inserted the row in between.
+"""
+
+from sqlalchemy.exc import IntegrityError
+
+
+def _native_insert(dialect_name):
+    if dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    return None
+
+
+def upsert(connection, table, key, insert_values, update_values):
+    """
+    Insert `key` + `insert_values` into `table`, or apply `update_values` to
+    the existing row. `key` maps the primary-key column names to values;
+    `update_values` may use expressions over the existing row (table.c.x + 1).
+    """
+    insert = _native_insert(connection.dialect.name)
+    if insert is not None:
+        connection.execute(
+            insert(table).values(**key, **insert_values)
+            .on_conflict_do_update(index_elements=list(key), set_=update_values)
+        )
+        return
+    where = [table.c[name] == value for name, value in key.items()]
+    if connection.execute(table.update().where(*where).values(**update_values)).rowcount:
+        return
+    try:
+        with connection.begin_nested():
+            connection.execute(table.insert().values(**key, **insert_values))
+    except IntegrityError:
+        connection.execute(table.update().where(*where).values(**update_values))
@@ -7,15 +7,28 @@ To enable emailing reports, set environment variables:
 - SMTP_USER (sender email)
 - SMTP_PASS (app password / smtp password)
 - REPORT_TO_EMAIL (default receiver; optional)
+
+Authenticated sessions are pooled per process and reused across messages:
+- SMTP_POOL_SIZE (idle sessions kept, default 2)
+- SMTP_IDLE_SECONDS (an idle session older than this is closed, default 60)
+- SMTP_MAX_MESSAGES (messages per session before it is recycled, default 100)
+- SMTP_STARTTLS (set to 0 for a plain local relay, default 1)
 """
 
 import os
 import smtplib
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", "2"))
+IDLE_SECONDS = float(os.environ.get("SMTP_IDLE_SECONDS", "60"))
+MAX_MESSAGES = int(os.environ.get("SMTP_MAX_MESSAGES", "100"))
+TIMEOUT = 20
 
-def send_email(to_email: str, subject: str, body: str) -> None:
+
+def _smtp_settings():
     host = os.environ.get("SMTP_HOST")
     port = int(os.environ.get("SMTP_PORT", "587"))
     user = os.environ.get("SMTP_USER")
@@ -23,15 +36,168 @@ def send_email(to_email: str, subject: str, body: str) -> None:
 
     if not host or not user or not pwd:
         raise RuntimeError("Email not configured (set SMTP_HOST/SMTP_USER/SMTP_PASS).")
+    return host, port, user, pwd
 
+
+def _build_message(sender: str, to_email: str, subject: str, body: str) -> str:
     msg = MIMEMultipart()
-    msg["From"] = user
+    msg["From"] = sender
     msg["To"] = to_email
     msg["Subject"] = subject
     msg.attach(MIMEText(body, "plain", "utf-8"))
+    return msg.as_string()
+
+
+class _Session:
+    """One authenticated SMTP connection plus its bookkeeping"""
+
+    def __init__(self, settings):
+        host, port, user, pwd = settings
+        self.settings = settings
+        self.sender = user
+        self.server = smtplib.SMTP(host, port, timeout=TIMEOUT)
+        if os.environ.get("SMTP_STARTTLS", "1") != "0":
+            self.server.starttls()
+        self.server.login(user, pwd)
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.server.quit()
+        except Exception:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+
+
+class SMTPPool:
+    """
+    Per-process pool of authenticated SMTP sessions.
+
+    A session is checked out for one send or one `send_many()` batch and
+    returned afterwards. Sessions idle longer than IDLE_SECONDS, sessions that
+    have sent MAX_MESSAGES, and sessions opened with different settings are
+    closed instead of reused.
+    """
+
+    def __init__(self, size=POOL_SIZE, idle_seconds=IDLE_SECONDS, max_messages=MAX_MESSAGES):
+        self.size = size
+        self.idle_seconds = idle_seconds
+        self.max_messages = max_messages
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _usable(self, s, settings):
+        return (
+            s.settings == settings
+            and time.monotonic() - s.last_used < self.idle_seconds
+            and s.sent < self.max_messages
+        )
+
+    def acquire(self):
+        settings = _smtp_settings()
+        stale = []
+        session = None
+        with self._lock:
+            while self._idle:
+                candidate = self._idle.pop()
+                if self._usable(candidate, settings):
+                    session = candidate
+                    break
+                stale.append(candidate)
+        for s in stale:
+            s.close()
+        return session or _Session(settings)
+
+    def release(self, session, broken=False):
+        session.last_used = time.monotonic()
+        if not broken and session.sent < self.max_messages:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(session)
+                    return
+        session.close()
+
+    def recycle_idle(self):
+        """Close sessions that have been idle too long; returns the number closed"""
+        now = time.monotonic()
+        with self._lock:
+            stale = [s for s in self._idle if now - s.last_used >= self.idle_seconds]
+            self._idle = [s for s in self._idle if s not in stale]
+        for s in stale:
+            s.close()
+        return len(stale)
+
+    def close_all(self):
+        with self._lock:
+            sessions, self._idle = self._idle, []
+        for s in sessions:
+            s.close()
+
+    def send_many(self, messages) -> list:
+        """
+        Send (to_email, subject, body) tuples over pooled sessions.
+        Returns one error string (or None on success) per message. A dropped
+        connection is reopened once and the remaining messages continue on it.
+        """
+        messages = list(messages)
+        errors = []
+        session = None
+        reconnected = False
+        try:
+            for to_email, subject, body in messages:
+                if session is None:
+                    session = self.acquire()
+                elif session.sent >= self.max_messages:
+                    self.release(session)
+                    session = self.acquire()
+                try:
+                    session.server.sendmail(session.sender, [to_email], _build_message(session.sender, to_email, subject, body))
+                    session.sent += 1
+                    errors.append(None)
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException) as e:
+                    session.sent += 1
+                    errors.append(str(e))
+                except (smtplib.SMTPServerDisconnected, OSError) as e:
+                    # A pooled session may have been dropped by the server; retry once on a fresh one
+                    self.release(session, broken=True)
+                    session = None
+                    if reconnected:
+                        errors.append(str(e))
+                        continue
+                    reconnected = True
+                    session = self.acquire()
+                    try:
+                        session.server.sendmail(session.sender, [to_email], _build_message(session.sender, to_email, subject, body))
+                        session.sent += 1
+                        errors.append(None)
+                    except Exception as retry_error:
+                        self.release(session, broken=True)
+                        session = None
+                        errors.append(str(retry_error))
+        except Exception as e:
+            # Could not connect / authenticate: everything not yet attempted fails
+            errors.extend([str(e)] * (len(messages) - len(errors)))
+            if session is not None:
+                self.release(session, broken=True)
+                session = None
+        finally:
+            if session is not None:
+                self.release(session)
+        return errors
+
+
+smtp_pool = SMTPPool()
+
+
+def send_email(to_email: str, subject: str, body: str) -> None:
+    error = smtp_pool.send_many([(to_email, subject, body)])[0]
+    if error is not None:
+        raise RuntimeError(f"Email to {to_email} not sent: {error}")
 
-    with smtplib.SMTP(host, port, timeout=20) as server:
-        server.starttls()
-        server.login(user, pwd)
-        server.sendmail(user, [to_email], msg.as_string())
 
+def send_many(messages) -> list:
+    """Send many (to_email, subject, body) over pooled SMTP sessions; one error (or None) per message"""
+    return smtp_pool.send_many(messages)
@@ -1,12 +1,25 @@
 """
 Gemini API Service for Real-time Traffic Updates and News Generation
+
+Responses are cached per process by llm_cache (per-function TTLs,
+single-flight, stale-while-revalidate) and one model client is reused.
+Every model call runs under the 'gemini' deadline and circuit breaker
+(outbound.py); a failing Gemini makes the cached functions serve their
+fallbacks without waiting.
 """
 
 import google.generativeai as genai
 import os
+import threading
 from datetime import datetime
 import json
 
+from llm_cache import llm_cached
+from outbound import outbound_call
+
+# Whole-answer deadline for streamed responses (the stream outlives the request budget)
+STREAM_TIMEOUT = float(os.environ.get('GEMINI_STREAM_TIMEOUT', '60'))
+
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
 if GEMINI_API_KEY:
     try:
@@ -14,27 +27,80 @@ if GEMINI_API_KEY:
     except Exception as e:
         print(f"Gemini configure error: {e}")
 
+_model = None
+_model_lock = threading.Lock()
+
 def get_gemini_model():
-    """Get Gemini model instance"""
-    try:
-        return genai.GenerativeModel('gemini-pro')
-    except Exception as e:
-        print(f"Error initializing Gemini: {e}")
-        return None
+    """Get the shared Gemini model instance (created once per process)"""
+    global _model
+    if _model is not None:
+        return _model
+    with _model_lock:
+        if _model is None:
+            try:
+                _model = genai.GenerativeModel('gemini-pro')
+            except Exception as e:
+                print(f"Error initializing Gemini: {e}")
+                return None
+    return _model
 
-def generate_traffic_news():
-    """Generate daily traffic news and updates using Gemini"""
+def generate_text(prompt):
+    """
+    Run a prompt on the shared model under the 'gemini' deadline and circuit
+    breaker; raises when Gemini is unavailable, slow or failing.
+    """
+    model = get_gemini_model()
+    if not model:
+        raise RuntimeError("Gemini model not available")
+    with outbound_call('gemini') as call:
+        return (model.generate_content(prompt, request_options={'timeout': call.timeout}).text or '').strip()
+
+def stream_generate(prompt):
+    """
+    Yield the model's text as it is produced. Closing the generator (e.g. the
+    client went away) stops the upstream stream instead of reading it to the end.
+    """
     model = get_gemini_model()
     if not model:
-        return {
-            "title": "Traffic Update",
-            "content": "System updates available. Check your challans regularly.",
-            "type": "info",
-            "timestamp": datetime.now().isoformat()
-        }
-    
+        raise RuntimeError("Gemini model not available")
+    call = outbound_call('gemini', timeout=STREAM_TIMEOUT)
+    response = None
     try:
-        prompt = f"""Generate a brief traffic news update for India (max 100 words) covering:
+        with call:
+            response = model.generate_content(prompt, stream=True, request_options={'timeout': call.timeout})
+            for chunk in response:
+                text = getattr(chunk, 'text', '')
+                if text:
+                    yield text
+    finally:
+        # Best effort: the SDK exposes no public cancel, but its gRPC stream iterator has one
+        iterator = getattr(response, '_iterator', None)
+        cancel = getattr(iterator, 'cancel', None)
+        if callable(cancel):
+            try:
+                cancel()
+            except Exception:
+                pass
+
+def _extract_json(text):
+    json_start = text.find('{')
+    json_end = text.rfind('}') + 1
+    return json.loads(text[json_start:json_end])
+
+def _news_fallback():
+    return {
+        "title": "Traffic Update",
+        "content": "Stay updated with latest traffic rules. Drive safely.",
+        "type": "info",
+        "timestamp": datetime.now().isoformat()
+    }
+
+# The home page never waits: a miss shows the fallback while the news is fetched
+@llm_cached(ttl=1800, stale=6 * 3600, fallback=_news_fallback,
+            key=lambda: datetime.now().strftime('%Y-%m-%d'), wait_on_miss=False)
+def generate_traffic_news():
+    """Generate daily traffic news and updates using Gemini"""
+    prompt = f"""Generate a brief traffic news update for India (max 100 words) covering:
 - Current traffic rules updates
 - Important notices from state/central government
 - Safety reminders
@@ -43,58 +109,34 @@ def generate_traffic_news():
 Format as JSON with: title, content, type (info/warning/alert), timestamp
 Date: {datetime.now().strftime('%Y-%m-%d')}
 """
-        response = model.generate_content(prompt)
-        text = response.text.strip()
-        
-        # Try to parse JSON from response
-        if '{' in text:
-            json_start = text.find('{')
-            json_end = text.rfind('}') + 1
-            json_str = text[json_start:json_end]
-            news_data = json.loads(json_str)
-            news_data['timestamp'] = datetime.now().isoformat()
-            return news_data
-        else:
-            return {
-                "title": "Traffic Update",
-                "content": text[:200],
-                "type": "info",
-                "timestamp": datetime.now().isoformat()
-            }
-    except Exception as e:
-        print(f"Error generating news: {e}")
-        return {
-            "title": "Traffic Update",
-            "content": "Stay updated with latest traffic rules. Drive safely.",
-            "type": "info",
-            "timestamp": datetime.now().isoformat()
-        }
+    text = generate_text(prompt)
 
+    # Try to parse JSON from response
+    if '{' in text:
+        news_data = _extract_json(text)
+        news_data['timestamp'] = datetime.now().isoformat()
+        return news_data
+    return {
+        "title": "Traffic Update",
+        "content": text[:200],
+        "type": "info",
+        "timestamp": datetime.now().isoformat()
+    }
+
+@llm_cached(ttl=7 * 86400, stale=7 * 86400, fallback=lambda notice_text: notice_text[:100] + "...")
 def generate_notice_summary(notice_text):
     """Generate a summary of a traffic notice using Gemini"""
-    model = get_gemini_model()
-    if not model:
-        return notice_text[:100] + "..."
-    
-    try:
-        prompt = f"""Summarize this traffic notice in 2-3 sentences:
+    prompt = f"""Summarize this traffic notice in 2-3 sentences:
 {notice_text}
 
 Provide only the summary, no additional text."""
-        response = model.generate_content(prompt)
-        return response.text.strip()
-    except Exception as e:
-        print(f"Error summarizing notice: {e}")
-        return notice_text[:100] + "..."
+    return generate_text(prompt)
 
+@llm_cached(ttl=7 * 86400, stale=30 * 86400,
+            fallback=lambda violation_type: f"Violation: {violation_type}. Follow traffic rules for safety.")
 def get_traffic_rules_explanation(violation_type):
     """Get explanation of traffic rules for a violation type"""
-    model = get_gemini_model()
-    if not model:
-        return f"Violation: {violation_type}. Please follow traffic rules."
-    
-    try:
-        prompt = f"""Explain the traffic rule violation for: {violation_type}
+    prompt = f"""Explain the traffic rule violation for: {violation_type}
 Include:
 - What the violation means
 - Fine amount (as per Indian Motor Vehicles Act)
@@ -102,20 +144,15 @@ Include:
 - How to avoid it
 
 Keep it brief (3-4 sentences)."""
-        response = model.generate_content(prompt)
-        return response.text.strip()
-    except Exception as e:
-        print(f"Error explaining rule: {e}")
-        return f"Violation: {violation_type}. Follow traffic rules for safety."
+    return generate_text(prompt)
 
+# Only the fields used in the prompt identify a response (not challan id, dates, ...)
+@llm_cached(ttl=86400, stale=7 * 86400,
+            fallback=lambda challan_details: "You can appeal this challan through the virtual court system.",
+            key=lambda challan_details: [challan_details.get(f) for f in ('violation_type', 'fine_amount', 'location')])
 def generate_appeal_guidance(challan_details):
     """Generate guidance for appealing a challan"""
-    model = get_gemini_model()
-    if not model:
-        return "You can appeal this challan through the virtual court system."
-    
-    try:
-        prompt = f"""Provide guidance for appealing a traffic challan with these details:
+    prompt = f"""Provide guidance for appealing a traffic challan with these details:
 Violation: {challan_details.get('violation_type', 'Unknown')}
 Amount: ₹{challan_details.get('fine_amount', 0)}
 Location: {challan_details.get('location', 'Unknown')}
@@ -127,24 +164,21 @@ Explain:
 - Grounds for appeal
 
 Keep it concise and actionable."""
-        response = model.generate_content(prompt)
-        return response.text.strip()
-    except Exception as e:
-        print(f"Error generating appeal guidance: {e}")
-        return "You can appeal this challan through the virtual court system."
+    return generate_text(prompt)
+
+def _insights_fallback(location=None):
+    return {
+        "hotspot": "High traffic areas",
+        "peak_time": "Rush hours",
+        "common_violation": "Traffic violations",
+        "recommendation": "Drive safely and follow rules"
+    }
 
+@llm_cached(ttl=6 * 3600, stale=86400, fallback=_insights_fallback,
+            key=lambda location=None: location or '')
 def get_predictive_insights(location=None):
     """Get predictive insights about traffic violations"""
-    model = get_gemini_model()
-    if not model:
-        return {
-            "hotspot": "High traffic areas",
-            "peak_time": "Morning rush hour",
-            "common_violation": "Signal jumping"
-        }
-    
-    try:
-        prompt = f"""Based on traffic violation patterns in India, provide insights:
+    prompt = f"""Based on traffic violation patterns in India, provide insights:
 - Common violation hotspots
 - Peak violation times
 - Most frequent violation types
@@ -152,26 +186,46 @@ def get_predictive_insights(location=None):
 
 Location context: {location or 'All India'}
 Format as JSON with: hotspot, peak_time, common_violation, recommendation"""
-        response = model.generate_content(prompt)
-        text = response.text.strip()
-        
-        if '{' in text:
-            json_start = text.find('{')
-            json_end = text.rfind('}') + 1
-            json_str = text[json_start:json_end]
-            return json.loads(json_str)
-        else:
-            return {
-                "hotspot": "Urban intersections",
-                "peak_time": "8-10 AM, 5-7 PM",
-                "common_violation": "Signal jumping",
-                "recommendation": "Follow traffic signals and speed limits"
-            }
-    except Exception as e:
-        print(f"Error getting insights: {e}")
-        return {
-            "hotspot": "High traffic areas",
-            "peak_time": "Rush hours",
-            "common_violation": "Traffic violations",
-            "recommendation": "Drive safely and follow rules"
-        }
+    text = generate_text(prompt)
+
+    if '{' in text:
+        return _extract_json(text)
+    return {
+        "hotspot": "Urban intersections",
+        "peak_time": "8-10 AM, 5-7 PM",
+        "common_violation": "Signal jumping",
+        "recommendation": "Follow traffic signals and speed limits"
+    }
+
+@llm_cached(ttl=6 * 3600, stale=86400, key=lambda: datetime.now().strftime('%Y-%m-%d'))
+def generate_traffic_notices():
+    """Generate a batch of traffic notices (normalized dicts); raises when Gemini is unavailable"""
+    prompt = f"""Generate 6 concise traffic notices for India (mix Central + State, include Uttarakhand). 
+Each notice should be realistic and citizen-friendly.
+
+Return STRICT JSON array. Each item fields:
+- scope: Central or State
+- title
+- body (2-3 lines)
+- state (null for Central)
+- city (null or a city)
+
+Date: {datetime.now().strftime('%Y-%m-%d')}
+"""
+    text = generate_text(prompt)
+
+    # Extract JSON array from response
+    if '[' in text and ']' in text:
+        start = text.find('[')
+        end = text.rfind(']') + 1
+        arr = json.loads(text[start:end])
+    else:
+        arr = []
+
+    return [{
+        'scope': item.get('scope') or 'Central',
+        'title': item.get('title') or 'Traffic Notice',
+        'body': item.get('body') or '',
+        'state': item.get('state'),
+        'city': item.get('city'),
+    } for item in arr[:10]]
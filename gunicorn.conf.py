@@ -0,0 +1,63 @@
+"""
+Gunicorn settings for AutoFINE
+
+The default worker class is gevent: every request (and every open realtime
+EventSource) runs in a green thread, so long-lived SSE streams cost a few KB
+of memory each instead of a whole worker. The realtime views read their
+initial state, return the DB connection to the pool and from then on only
+wait on the shared challan broker's queue.
+
+Environment overrides:
+    GUNICORN_WORKER_CLASS   gevent (default) or sync
+    WEB_CONCURRENCY         worker processes (default 2)
+    WORKER_CONNECTIONS      concurrent connections per gevent worker (default 10000)
+    PORT                    bind port (default 5000)
+
+Raise the open-file limit (ulimit -n) above WORKER_CONNECTIONS when running
+this many streams on one node.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+# Read by the app to size per-process pools (ocr_executor.py)
+os.environ['WEB_CONCURRENCY'] = str(workers)
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', '10000'))
+# SSE streams send a heartbeat every 15s; sync workers would need a longer timeout
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+keepalive = 75
+
+
+def post_fork(server, worker):
+    # Make psycopg2 (Postgres) cooperative under gevent if psycogreen is installed
+    if worker_class != 'gevent':
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        pass
+
+
+def post_worker_init(worker):
+    # Seed the dashboard and offence counters and backfill the search index at
+    # start-up rather than on the first dashboard request, fine or public search
+    from app import app
+    from challan_counters import seed_counters
+    from challan_search import seed_search_index
+    from offence_counters import seed_offence_counters
+    with app.app_context():
+        try:
+            seed_counters()
+        except Exception as e:
+            worker.log.warning("Could not seed challan counters: %s", e)
+        try:
+            seed_search_index()
+        except Exception as e:
+            worker.log.warning("Could not backfill the search index: %s", e)
+        try:
+            seed_offence_counters()
+        except Exception as e:
+            worker.log.warning("Could not seed offence counters: %s", e)
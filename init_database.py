@@ -5,6 +5,7 @@ Creates tables and populates with sample data from CSV
 
 from app import app, db, bcrypt
 from models import User, Vehicle, Challan, Violation, Camera, Notice
+from appeal_guidance import ensure_guidance_link_column
 from datetime import datetime, timedelta
 import csv
 import random
@@ -17,6 +18,7 @@ def init_database():
         # Create all tables
         print("Creating database tables...")
         db.create_all()
+        ensure_guidance_link_column()
         
         # Create admin user if not exists
         if not User.query.filter_by(username='admin').first():
@@ -245,6 +247,15 @@ def init_database():
             print(f"Error importing datasets: {e}")
             print("Continuing with basic initialization...")
         
+        # Seed/repair the write-maintained dashboard counters
+        from challan_counters import reconcile_counters
+        drift = reconcile_counters()
+        print(f"Reconciled {len(drift)} dashboard counter(s)")
+        from offence_counters import rebuild_offence_counters
+        print(f"Rebuilt {rebuild_offence_counters()} offence counter(s)")
+        from challan_search import rebuild_search_index
+        print(f"Indexed {rebuild_search_index()} search term(s)")
+        
         print("\nDatabase initialization complete!")
         print("\nDefault credentials:")
         print("  Admin: username=admin, password=admin123")
@@ -0,0 +1,174 @@
+"""
+In-process response cache for Gemini calls in AutoFINE
+
+`@llm_cached(ttl, ...)` wraps a function that calls the model and raises
+on failure. Results are keyed by function name and normalized arguments
+(surrounding and repeated whitespace, dict ordering; case is kept, since it
+can matter in plate numbers and place names), and:
+
+- fresh entries (younger than `ttl`) are returned directly;
+- stale entries (younger than `ttl + stale`) are returned immediately while
+  one background thread refreshes them (stale-while-revalidate);
+- concurrent misses for the same key share one call (single-flight);
+- with `wait_on_miss=False` a miss returns `fallback(*args)` at once and
+  fills the cache in the background, so the caller never waits on the model;
+- a failure is remembered for ERROR_TTL seconds, during which the last good
+  value (or the fallback) is served without calling the model again.
+
+The cache is per process, like reference_cache.py. GEMINI_CACHE=0 disables it.
+"""
+
+import json
+import os
+import threading
+import time
+
+ENABLED = os.environ.get('GEMINI_CACHE', '1') != '0'
+ERROR_TTL = float(os.environ.get('GEMINI_CACHE_ERROR_TTL', '30'))
+MAX_ENTRIES = int(os.environ.get('GEMINI_CACHE_MAX_ENTRIES', '1000'))
+MISS_WAIT_SECONDS = float(os.environ.get('GEMINI_CACHE_MISS_WAIT', '30'))
+
+_lock = threading.Lock()
+_entries = {}   # key -> _Entry
+_inflight = {}  # key -> threading.Event set when the call finishes
+
+
+class _Entry:
+    __slots__ = ('value', 'has_value', 'fresh_until', 'stale_until', 'error_until')
+
+    def __init__(self):
+        self.value = None
+        self.has_value = False
+        self.fresh_until = 0.0
+        self.stale_until = 0.0
+        self.error_until = 0.0
+
+
+def normalize(value):
+    """Canonical, hashable form of an argument: trims/collapses whitespace, sorts dicts"""
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), normalize(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize(v) for v in value)
+    if value is None or isinstance(value, (int, float, bool)):
+        return value
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _evict(now):
+    """Drop expired entries, then the oldest ones, once the cache is over MAX_ENTRIES (holding _lock)"""
+    if len(_entries) <= MAX_ENTRIES:
+        return
+    for key in [k for k, e in _entries.items() if e.stale_until <= now and e.error_until <= now]:
+        del _entries[key]
+    while len(_entries) > MAX_ENTRIES:
+        del _entries[next(iter(_entries))]
+
+
+def llm_cached(ttl, stale=0, fallback=None, key=None, wait_on_miss=True):
+    """
+    Cache a model-calling function.
+
+    `ttl` / `stale` are seconds; `fallback(*args, **kwargs)` supplies the value
+    when the call fails and nothing is cached; `key(*args, **kwargs)` selects
+    the arguments that identify a response (default: all of them).
+    """
+    def decorator(func):
+        name = func.__name__
+
+        def call(cache_key, args, kwargs):
+            """Run the real call for cache_key; exactly one caller per key at a time"""
+            try:
+                value = func(*args, **kwargs)
+            except Exception as e:
+                print(f"Gemini call {name} failed: {e}")
+                with _lock:
+                    entry = _entries.setdefault(cache_key, _Entry())
+                    entry.error_until = time.monotonic() + ERROR_TTL
+                raise
+            else:
+                now = time.monotonic()
+                with _lock:
+                    entry = _entries.pop(cache_key, None) or _Entry()
+                    entry.value, entry.has_value = value, True
+                    entry.fresh_until = now + ttl
+                    entry.stale_until = now + ttl + stale
+                    entry.error_until = 0.0
+                    _entries[cache_key] = entry
+                    _evict(now)
+                return value
+            finally:
+                with _lock:
+                    done = _inflight.pop(cache_key, None)
+                if done:
+                    done.set()
+
+        def refresh_in_background(cache_key, args, kwargs):
+            def run():
+                try:
+                    call(cache_key, args, kwargs)
+                except Exception:
+                    pass
+            threading.Thread(target=run, name=f'gemini-{name}', daemon=True).start()
+
+        def use_fallback(args, kwargs, error=None):
+            if fallback is None:
+                raise error or RuntimeError(f"{name}: no cached response")
+            return fallback(*args, **kwargs)
+
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    return use_fallback(args, kwargs, e)
+
+            ident = key(*args, **kwargs) if key else (args, kwargs)
+            cache_key = (name, normalize(ident))
+            while True:
+                now = time.monotonic()
+                with _lock:
+                    entry = _entries.get(cache_key)
+                    pending = _inflight.get(cache_key)
+                    if entry and entry.has_value and now < entry.fresh_until:
+                        return entry.value
+                    erroring = entry is not None and now < entry.error_until
+                    if entry and entry.has_value and (now < entry.stale_until or erroring):
+                        if pending is None and not erroring:
+                            _inflight[cache_key] = threading.Event()
+                            refresh_in_background(cache_key, args, kwargs)
+                        return entry.value
+                    if erroring:
+                        return use_fallback(args, kwargs)
+                    if pending is None:
+                        _inflight[cache_key] = threading.Event()
+                        if not wait_on_miss:
+                            refresh_in_background(cache_key, args, kwargs)
+                            return use_fallback(args, kwargs)
+                        owner = True
+                    else:
+                        owner = False
+                if owner:
+                    try:
+                        return call(cache_key, args, kwargs)
+                    except Exception as e:
+                        return use_fallback(args, kwargs, e)
+                if not wait_on_miss:
+                    return use_fallback(args, kwargs)
+                # Another request is already asking the model the same thing: wait for its answer
+                if not pending.wait(MISS_WAIT_SECONDS):
+                    return use_fallback(args, kwargs)
+
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+
+def clear():
+    """Forget every cached response"""
+    with _lock:
+        _entries.clear()
@@ -3,6 +3,8 @@ Database Models for AutoFINE System
 """
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import joinedload, selectinload
 from datetime import datetime
 
 # Create db instance - will be initialized by app.py
@@ -49,6 +51,12 @@ class Vehicle(db.Model):
     def __repr__(self):
         return f'<Vehicle {self.license_number}>'
     
+    # Loader options, applied per endpoint with .options(...)
+    @staticmethod
+    def with_owner():
+        """Load owners with one extra IN query (many vehicles share few owners)"""
+        return selectinload(Vehicle.owner)
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -94,6 +102,13 @@ class Violation(db.Model):
 class Challan(db.Model):
     """Challan/Ticket model"""
     __tablename__ = 'challans'
+    __table_args__ = (
+        # Keyset pagination order for admin listings: (created_at, id)
+        db.Index('ix_challans_created_at_id', 'created_at', 'id'),
+        db.Index('ix_challans_status_created_at', 'status', 'created_at'),
+        # Offence history per vehicle and type (offence counter rebuilds)
+        db.Index('ix_challans_vehicle_violation_created', 'vehicle_id', 'violation_type', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     uin = db.Column(db.String(40), unique=True, index=True)  # Unique Identification Number
@@ -111,8 +126,22 @@ class Challan(db.Model):
     notes = db.Column(db.Text)
     
     def __repr__(self):
+        # Never trigger a lazy load just to print the object
+        if 'vehicle' in sa_inspect(self).unloaded:
+            return f'<Challan {self.id} - vehicle_id={self.vehicle_id}>'
         return f'<Challan {self.id} - {self.vehicle.license_number if self.vehicle else "N/A"}>'
     
+    # Loader options, applied per endpoint with .options(...)
+    @staticmethod
+    def with_vehicle():
+        """Join the vehicle into the challan query"""
+        return joinedload(Challan.vehicle)
+    
+    @staticmethod
+    def with_vehicle_owner():
+        """Join the vehicle and its owner into the challan query"""
+        return joinedload(Challan.vehicle).joinedload(Vehicle.owner)
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -137,6 +166,131 @@ class Challan(db.Model):
         return False
 
 
+class ChallanCounter(db.Model):
+    """Write-maintained aggregate counts (see challan_counters.py)"""
+    __tablename__ = 'challan_counters'
+    
+    name = db.Column(db.String(120), primary_key=True)  # 'challans', 'vehicles', 'status:Paid', 'violation:Speeding'
+    value = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ChallanCounter {self.name}={self.value}>'
+
+
+class OffenceCounter(db.Model):
+    """Challans per (vehicle, violation type) for repeat-offence checks (see offence_counters.py)"""
+    __tablename__ = 'offence_counters'
+    
+    vehicle_id = db.Column(db.Integer, primary_key=True)
+    violation_type = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    first_seen = db.Column(db.DateTime)
+    last_seen = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<OffenceCounter {self.vehicle_id}/{self.violation_type}={self.count}>'
+
+
+class SearchTerm(db.Model):
+    """Normalized lookup keys (UIN / plate / DL) for public search (see challan_search.py)"""
+    __tablename__ = 'search_terms'
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'ref_id', name='uq_search_terms_kind_ref'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)  # 'uin' -> challans.id, 'plate' -> vehicles.id, 'dl' -> users.id
+    ref_id = db.Column(db.Integer, nullable=False)
+    term = db.Column(db.String(60), nullable=False, index=True)  # upper-case, alphanumeric only
+    rterm = db.Column(db.String(60), nullable=False, index=True)  # term reversed, for suffix lookups
+    
+    def __repr__(self):
+        return f'<SearchTerm {self.kind}:{self.term}>'
+
+
+class ChallanEvent(db.Model):
+    """Append-only challan change log with a monotonic sequence (see challan_events.py)"""
+    __tablename__ = 'challan_events'
+    __table_args__ = {'sqlite_autoincrement': True}  # never reuse a sequence number
+    
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    challan_id = db.Column(db.Integer, nullable=False, index=True)
+    vehicle_id = db.Column(db.Integer, index=True)
+    event_type = db.Column(db.String(20), nullable=False)  # created, status_changed, deleted
+    old_status = db.Column(db.String(20))
+    new_status = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'seq': self.seq,
+            'challan_id': self.challan_id,
+            'vehicle_id': self.vehicle_id,
+            'event_type': self.event_type,
+            'old_status': self.old_status,
+            'new_status': self.new_status,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+    
+    def __repr__(self):
+        return f'<ChallanEvent {self.seq} {self.event_type} challan={self.challan_id}>'
+
+
+class Notification(db.Model):
+    """Queued outbound SMS / e-mail (see notification_queue.py)"""
+    __tablename__ = 'notifications'
+    __table_args__ = (
+        db.Index('ix_notifications_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(10), nullable=False)  # 'sms' or 'email'
+    recipient = db.Column(db.String(200), nullable=False)
+    subject = db.Column(db.String(255))
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claim_token = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<Notification {self.id} {self.channel} {self.status}>'
+
+
+class GeneratedContent(db.Model):
+    """Pre-generated Gemini artifacts served by the public endpoints (see content_scheduler.py)"""
+    __tablename__ = 'generated_content'
+    
+    name = db.Column(db.String(120), primary_key=True)  # 'news', 'notices', 'city_insights:<city>'
+    payload = db.Column(db.Text)  # JSON
+    generated_at = db.Column(db.DateTime)
+    claimed_until = db.Column(db.DateTime)  # a process is (re)generating it until then
+    
+    def __repr__(self):
+        return f'<GeneratedContent {self.name} {self.generated_at}>'
+
+
+class OcrJob(db.Model):
+    """Asynchronous ANPR / OCR job (see ocr_executor.py)"""
+    __tablename__ = 'ocr_jobs'
+    
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    kind = db.Column(db.String(30), nullable=False)  # 'anpr', 'bhopal_classify'
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, done, failed
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<OcrJob {self.id} {self.kind} {self.status}>'
+
+
 class Notice(db.Model):
     __tablename__ = 'notices'
 
@@ -189,11 +343,36 @@ class Appeal(db.Model):
     submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
     reviewed_at = db.Column(db.DateTime)
     reviewer_notes = db.Column(db.Text)
+    # Guidance row chosen when the appeal was filed (see appeal_guidance.py)
+    guidance_id = db.Column(db.Integer, db.ForeignKey('appeal_guidance.id'))
     
     # Relationships
     challan = db.relationship('Challan', backref='appeals')
     user = db.relationship('User', backref='appeals')
 
+class AppealGuidance(db.Model):
+    """AI appeal guidance shared by appeals with the same circumstances (see appeal_guidance.py)"""
+    __tablename__ = 'appeal_guidance'
+    __table_args__ = (
+        db.Index('ix_appeal_guidance_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    guidance_key = db.Column(db.String(40), unique=True, nullable=False)  # sha1 of normalized circumstances
+    violation_type = db.Column(db.String(100))
+    fine_amount = db.Column(db.Float)
+    location = db.Column(db.String(200))
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, ready, failed
+    guidance = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_until = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<AppealGuidance {self.id} {self.status}>'
+
 class PaymentPlan(db.Model):
     """Installment Payment Plans"""
     __tablename__ = 'payment_plans'
@@ -0,0 +1,254 @@
+"""
+Durable outbound notification queue for AutoFINE (SMS and e-mail)
+
+Request handlers call `queue_sms()` / `queue_email()`, which only add a
+`notifications` row to the current session: the message is committed
+together with the change it reports (or not at all), and the request never
+waits on a gateway. A small pool of background workers per process claims
+due rows in batches, sends them through the channel's sender under a
+per-channel rate limit, and retries failures with exponential backoff.
+
+Rows are claimed with a token, so any number of processes (gunicorn
+workers, `flask process-notifications`) can drain the same table without
+sending a message twice; a claim left behind by a crashed worker is taken
+over after NOTIFY_LEASE_SECONDS.
+"""
+
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from email_service import send_many, smtp_pool
+from models import db, Notification
+from sms_service import send_sms
+
+WORKERS = int(os.environ.get('NOTIFY_WORKERS', '2'))
+BATCH_SIZE = int(os.environ.get('NOTIFY_BATCH_SIZE', '50'))
+POLL_INTERVAL = float(os.environ.get('NOTIFY_POLL_INTERVAL', '5'))
+MAX_ATTEMPTS = int(os.environ.get('NOTIFY_MAX_ATTEMPTS', '5'))
+BACKOFF_SECONDS = float(os.environ.get('NOTIFY_BACKOFF_SECONDS', '30'))
+LEASE_SECONDS = int(os.environ.get('NOTIFY_LEASE_SECONDS', '300'))
+# Messages per second per channel, per process
+RATE_LIMITS = {
+    'sms': float(os.environ.get('NOTIFY_SMS_PER_SECOND', '10')),
+    'email': float(os.environ.get('NOTIFY_EMAIL_PER_SECOND', '2')),
+}
+
+
+def queue_sms(phone, message):
+    """Queue an SMS in the current session (sent after commit); returns the row or None"""
+    if not phone:
+        return None
+    notification = Notification(channel='sms', recipient=phone, body=message)
+    db.session.add(notification)
+    return notification
+
+
+def queue_email(to_email, subject, body):
+    """Queue an e-mail in the current session (sent after commit); returns the row or None"""
+    if not to_email:
+        return None
+    notification = Notification(channel='email', recipient=to_email, subject=subject, body=body)
+    db.session.add(notification)
+    return notification
+
+
+def queue_many(channel, messages):
+    """
+    Queue many messages with one executemany INSERT in the current session.
+
+    `messages` is a list of (recipient, subject, body); entries without a
+    recipient are skipped. Returns the number queued.
+    """
+    now = datetime.utcnow()
+    rows = [{
+        'channel': channel, 'recipient': recipient, 'subject': subject, 'body': body,
+        'status': 'pending', 'attempts': 0, 'next_attempt_at': now, 'created_at': now
+    } for recipient, subject, body in messages if recipient]
+    if rows:
+        db.session.execute(Notification.__table__.insert(), rows)
+        db.session.info['_notifications_queued'] = True
+    return len(rows)
+
+
+# ---- channel senders: take a batch, return one error (or None) per message ----
+
+def _send_sms_batch(notifications):
+    errors = []
+    for n in notifications:
+        try:
+            errors.append(None if send_sms(n.recipient, n.body) else 'SMS gateway rejected the message')
+        except Exception as e:
+            errors.append(str(e))
+    return errors
+
+
+def _send_email_batch(notifications):
+    # Pipelined over pooled SMTP sessions (email_service.send_many)
+    return send_many([(n.recipient, n.subject or '', n.body) for n in notifications])
+
+
+SENDERS = {
+    'sms': _send_sms_batch,
+    'email': _send_email_batch,
+}
+
+
+class RateLimiter:
+    """Token bucket shared by the workers of one process"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def backoff_delay(attempts):
+    """Seconds before retry number `attempts`: exponential, with +/-50% jitter"""
+    return BACKOFF_SECONDS * (2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+
+
+class NotificationDispatcher:
+    """Background worker pool draining the notifications table"""
+
+    def __init__(self, workers=WORKERS):
+        self.app = None
+        self.workers = workers
+        self.limiters = {channel: RateLimiter(rate) for channel, rate in RATE_LIMITS.items()}
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        # Start on the first request rather than at import, so CLI commands stay single-threaded
+        app.before_request(self._ensure_started)
+
+    def wake(self):
+        self._ensure_started()
+        self._wakeup.set()
+
+    def _ensure_started(self):
+        if self._threads or not self.workers or self.app is None:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'notify-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _claim(self):
+        """Claim up to BATCH_SIZE due notifications for this worker"""
+        now = datetime.utcnow()
+        due = db.or_(
+            db.and_(Notification.status == 'pending', Notification.next_attempt_at <= now),
+            db.and_(Notification.status == 'sending', Notification.claimed_at < now - timedelta(seconds=LEASE_SECONDS)),
+        )
+        ids = [nid for (nid,) in db.session.query(Notification.id).filter(due).order_by(Notification.id).limit(BATCH_SIZE)]
+        if not ids:
+            db.session.commit()
+            return []
+        token = uuid.uuid4().hex
+        # Re-check the condition in the UPDATE so a row claimed concurrently is skipped
+        Notification.query.filter(Notification.id.in_(ids), due).update(
+            {'status': 'sending', 'claim_token': token, 'claimed_at': now}, synchronize_session=False
+        )
+        db.session.commit()
+        return Notification.query.filter_by(claim_token=token, status='sending').order_by(Notification.id).all()
+
+    def run_once(self):
+        """Claim and send one batch; returns the number of notifications processed"""
+        batch = self._claim()
+        by_channel = {}
+        for n in batch:
+            by_channel.setdefault(n.channel, []).append(n)
+
+        for channel, notifications in by_channel.items():
+            sender = SENDERS.get(channel)
+            limiter = self.limiters.get(channel)
+            if sender is None:
+                errors = [f'Unknown channel {channel}'] * len(notifications)
+            else:
+                if limiter:
+                    for _ in notifications:
+                        limiter.acquire()
+                errors = sender(notifications)
+            now = datetime.utcnow()
+            for n, error in zip(notifications, errors):
+                n.attempts += 1
+                n.claim_token = None
+                if error is None:
+                    n.status = 'sent'
+                    n.sent_at = now
+                    n.last_error = None
+                elif n.attempts >= MAX_ATTEMPTS:
+                    n.status = 'failed'
+                    n.last_error = error
+                else:
+                    n.status = 'pending'
+                    n.last_error = error
+                    n.next_attempt_at = now + timedelta(seconds=backoff_delay(n.attempts))
+        if batch:
+            db.session.commit()
+        return len(batch)
+
+    def _run(self):
+        while True:
+            processed = 0
+            try:
+                with self.app.app_context():
+                    try:
+                        processed = self.run_once()
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                print(f"Notification worker failed: {e}")
+            if not processed:
+                smtp_pool.recycle_idle()
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+
+
+notification_dispatcher = NotificationDispatcher()
+
+
+# ---- wake the workers when a transaction that queued something commits ----
+
+@event.listens_for(db.session, 'before_flush')
+def _note_queued(session, flush_context, instances):
+    if any(isinstance(obj, Notification) for obj in session.new):
+        session.info['_notifications_queued'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_dispatcher(session):
+    if session.info.pop('_notifications_queued', False):
+        notification_dispatcher.wake()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_queued(session):
+    session.info.pop('_notifications_queued', None)
@@ -0,0 +1,307 @@
+"""
+Bounded OCR executor and job store for AutoFINE (ANPR)
+
+Plate recognition (denoise, Canny, several EasyOCR passes) is CPU-heavy and
+never runs in the web process. When the shared OCR daemon is running
+(alpr_module/ocr_daemon.py, socket OCR_SOCKET) jobs are sent to it, so the
+model is loaded once per host and web workers hold no weights. The daemon
+is used while a probe connect to its socket succeeds (re-checked every
+OCR_DAEMON_RECHECK_SECONDS); a job that cannot reach it falls back to the
+local pool. Otherwise (OCR_BACKEND=pool, or no daemon listening) jobs run in
+a per-web-process pool of OCR_WORKERS spawned processes, each with its
+EasyOCR reader loaded once at start-up and its OpenCV/torch threads capped. Every gunicorn worker has
+its own pool, so the default OCR_WORKERS is the host's cores minus one
+divided by WEB_CONCURRENCY; set it per web process when overriding.
+
+`submit(kind, image_path, finish)` records an `ocr_jobs` row and hands the
+image to the pool; when recognition completes, `finish(license_number,
+confidence)` runs back in the web process (inside an app context) and its
+dict is stored as the job result. `stage_stats()` counts which recognition
+cascade stages ran for those jobs, i.e. how often each fallback fires.
+Jobs live in the database, so the status/SSE endpoints answer on any
+gunicorn worker. When OCR_MAX_PENDING jobs are already queued or running in
+this process, `submit` raises OCRQueueFull and the endpoint answers 429.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+import multiprocessing
+
+from models import db, OcrJob
+from realtime_broker import format_sse, retry_hint
+
+# Per web process: the host's cores (minus one for the web workers) shared by WEB_CONCURRENCY pools
+WEB_PROCESSES = max(1, int(os.environ.get('WEB_CONCURRENCY', '1')))
+WORKERS = int(os.environ.get('OCR_WORKERS', str(max(1, ((os.cpu_count() or 2) - 1) // WEB_PROCESSES))))
+MAX_PENDING = int(os.environ.get('OCR_MAX_PENDING', str(WORKERS * 4)))
+THREADS_PER_WORKER = int(os.environ.get('OCR_THREADS_PER_WORKER', '1'))
+JOB_RETENTION_SECONDS = int(os.environ.get('OCR_JOB_RETENTION_SECONDS', '86400'))
+STREAM_SECONDS = int(os.environ.get('OCR_STREAM_SECONDS', '120'))
+STREAM_CHECK_SECONDS = float(os.environ.get('OCR_STREAM_CHECK_SECONDS', '1'))
+RETRY_AFTER_SECONDS = 5
+# 'daemon': shared OCR daemon only; 'pool': per-process pool; 'auto': daemon while it answers, else the pool
+BACKEND = os.environ.get('OCR_BACKEND', 'auto')
+SOCKET_PATH = os.environ.get('OCR_SOCKET', '/tmp/autofine-ocr.sock')
+DAEMON_TIMEOUT = float(os.environ.get('OCR_DAEMON_TIMEOUT', '60'))
+DAEMON_PROBE_TIMEOUT = float(os.environ.get('OCR_DAEMON_PROBE_TIMEOUT', '0.5'))
+DAEMON_RECHECK_SECONDS = float(os.environ.get('OCR_DAEMON_RECHECK_SECONDS', '30'))
+
+
+class OCRQueueFull(RuntimeError):
+    """Too many OCR jobs pending in this process; the caller should retry later"""
+
+
+class OCRUnavailable(RuntimeError):
+    """The OCR pool could not be started"""
+
+
+def _recognize(image_path):
+    # Imported in the pool process only; the web process never loads EasyOCR
+    from alpr_module.license_plate_recognition import recognize_plate_cascade
+    return recognize_plate_cascade(image_path)
+
+
+def _recognize_via_daemon(image_path):
+    """recognize_plate_cascade result from the shared OCR daemon (alpr_module/ocr_daemon.py)"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(DAEMON_TIMEOUT)
+        sock.connect(SOCKET_PATH)
+        sock.sendall((json.dumps({'id': 1, 'image_path': os.path.abspath(image_path)}) + '\n').encode('utf-8'))
+        with sock.makefile('rb') as stream:
+            line = stream.readline()
+    if not line:
+        raise ConnectionResetError('OCR daemon closed the connection')
+    response = json.loads(line)
+    if response.get('error'):
+        raise RuntimeError(response['error'])
+    return response
+
+
+def _daemon_reachable():
+    """True if something accepts connections on the daemon socket (a stale socket file does not)"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(DAEMON_PROBE_TIMEOUT)
+        try:
+            sock.connect(SOCKET_PATH)
+        except OSError:
+            return False
+    return True
+
+
+def _init_worker(threads):
+    from alpr_module.license_plate_recognition import init_ocr_worker
+    init_ocr_worker(threads)
+
+
+class OCRExecutor:
+    """OCR backend (daemon client threads or process pool) plus the in-process pending count that bounds it"""
+
+    def __init__(self, workers=WORKERS, max_pending=MAX_PENDING):
+        self.app = None
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._pool = None
+        self._clients = None
+        self._daemon_up = False
+        self._daemon_checked = None
+        self._lock = threading.Lock()
+        self._ready = threading.Condition()
+        self._last_prune = 0.0
+        self.stage_runs = Counter()
+        self.stage_accepts = Counter()
+        self.images = 0
+
+    def init_app(self, app):
+        self.app = app
+
+    def use_daemon(self):
+        """Whether to send the next job to the daemon; call with self._lock held"""
+        if BACKEND != 'auto':
+            return BACKEND == 'daemon'
+        now = time.monotonic()
+        if self._daemon_checked is None or now - self._daemon_checked >= DAEMON_RECHECK_SECONDS:
+            self._daemon_up = _daemon_reachable()
+            self._daemon_checked = now
+        return self._daemon_up
+
+    def _get_pool(self):
+        if self._pool is None:
+            # spawn: do not fork a web worker's threads, sockets and gevent hub into the pool
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(THREADS_PER_WORKER,),
+            )
+        return self._pool
+
+    def _get_clients(self):
+        if self._clients is None:
+            # The daemon does the work: threads here only wait on its socket (no model in this process)
+            self._clients = ThreadPoolExecutor(max_workers=self.max_pending, thread_name_prefix='ocr-client')
+        return self._clients
+
+    def _submit_local(self, image_path):
+        """Run on this process's pool; call with self._lock held"""
+        try:
+            return self._get_pool().submit(_recognize, image_path)
+        except BrokenProcessPool:
+            # A pool process died (e.g. OOM); start a fresh pool once
+            self._pool = None
+            return self._get_pool().submit(_recognize, image_path)
+
+    def _recognize_remote(self, image_path):
+        """Daemon client thread: ask the daemon, or the local pool if the daemon cannot be reached"""
+        try:
+            return _recognize_via_daemon(image_path)
+        except socket.timeout:
+            raise  # reachable but busy; running the image again here would double the load
+        except OSError as e:
+            if BACKEND == 'daemon':
+                raise
+            print(f"OCR daemon unreachable ({e}); using the local pool")
+            with self._lock:
+                self._daemon_up = False
+                self._daemon_checked = time.monotonic()
+                future = self._submit_local(image_path)
+        return future.result()
+
+    def submit(self, kind, image_path, finish):
+        """Queue OCR for image_path; returns the job id. Raises OCRQueueFull / OCRUnavailable."""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise OCRQueueFull(f"{self.pending} OCR jobs pending")
+            self.pending += 1
+        job_id = uuid.uuid4().hex
+        try:
+            db.session.add(OcrJob(id=job_id, kind=kind, status='queued'))
+            db.session.commit()
+            with self._lock:
+                if self.use_daemon():
+                    future = self._get_clients().submit(self._recognize_remote, image_path)
+                else:
+                    future = self._submit_local(image_path)
+        except Exception as e:
+            with self._lock:
+                self.pending -= 1
+            self._store(job_id, 'failed', error=str(e))
+            raise OCRUnavailable(str(e))
+        future.add_done_callback(lambda f: self._finish(job_id, f, finish))
+        return job_id
+
+    def _finish(self, job_id, future, finish):
+        with self._lock:
+            self.pending -= 1
+        try:
+            recognition = future.result()
+            self._count_stages(recognition)
+            with self.app.app_context():
+                try:
+                    result = finish(recognition.get('license_number'), recognition.get('confidence', 0.0))
+                    self._store(job_id, 'done', result=result)
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            print(f"OCR job {job_id} failed: {e}")
+            with self.app.app_context():
+                try:
+                    self._store(job_id, 'failed', error=str(e))
+                finally:
+                    db.session.remove()
+        with self._ready:
+            self._ready.notify_all()
+
+    def _count_stages(self, recognition):
+        stages = recognition.get('stages') or []
+        with self._lock:
+            self.images += 1
+            self.stage_runs.update(stages)
+            if recognition.get('accepted') and stages:
+                self.stage_accepts[stages[-1]] += 1
+
+    def stage_stats(self):
+        """How often each cascade stage ran and ended the cascade (jobs finished in this process)"""
+        with self._lock:
+            return {
+                'images': self.images,
+                'stages': {stage: {'ran': runs, 'accepted': self.stage_accepts[stage]}
+                           for stage, runs in self.stage_runs.items()},
+            }
+
+    def _store(self, job_id, status, result=None, error=None):
+        OcrJob.query.filter_by(id=job_id).update({
+            'status': status,
+            'result': json.dumps(result) if result is not None else None,
+            'error': error,
+            'finished_at': datetime.utcnow(),
+        }, synchronize_session=False)
+        now = time.monotonic()
+        if now - self._last_prune > 600:
+            self._last_prune = now
+            cutoff = datetime.utcnow() - timedelta(seconds=JOB_RETENTION_SECONDS)
+            OcrJob.query.filter(OcrJob.created_at < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+
+    def wait(self, job_id, timeout):
+        """Wait up to `timeout` seconds for a job this process is running; returns its payload"""
+        deadline = time.monotonic() + timeout
+        while True:
+            payload = job_payload(db.session.get(OcrJob, job_id))
+            remaining = deadline - time.monotonic()
+            if payload['status'] in ('done', 'failed') or remaining <= 0:
+                return payload
+            db.session.commit()  # end the read transaction so the next read sees the update
+            with self._ready:
+                self._ready.wait(min(remaining, STREAM_CHECK_SECONDS))
+
+    def _lookup(self, job_id):
+        """Short-lived read for streams, which run without a request-scoped session"""
+        with self.app.app_context():
+            try:
+                return job_payload(db.session.get(OcrJob, job_id))
+            finally:
+                db.session.remove()
+
+    def stream(self, job_id):
+        """SSE body: 'status' events until the job is done or failed"""
+        deadline = time.monotonic() + STREAM_SECONDS
+        last_status = None
+        yield format_sse({'type': 'init', 'job_id': job_id}, retry=retry_hint())
+        while True:
+            payload = self._lookup(job_id)
+            if payload['status'] != last_status:
+                last_status = payload['status']
+                yield format_sse(dict(payload, type='status'))
+            if payload['status'] in ('done', 'failed', 'unknown'):
+                return
+            if time.monotonic() >= deadline:
+                yield format_sse({'type': 'timeout', 'job_id': job_id})
+                return
+            with self._ready:
+                self._ready.wait(STREAM_CHECK_SECONDS)
+
+
+def job_payload(job):
+    if job is None:
+        return {'status': 'unknown'}
+    return {
+        'job_id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+ocr_executor = OCRExecutor()
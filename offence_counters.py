@@ -0,0 +1,177 @@
+"""
+Per-(vehicle, violation type) offence counters for AutoFINE
+
+`offence_counters` holds, for every vehicle and violation type, how many
+challans exist together with the first and last offence time. The fine
+engine reads one row per pair to decide whether an offence is a repeat,
+including windowed rules ("a previous offence within 12 months"), instead
+of counting the vehicle's challan history.
+
+Rows are maintained from session flush hooks in the same transaction as the
+challan write: inserts bump count and first/last seen; deletes and
+violation-type changes recompute the affected pairs from the challans
+table (an index range scan). `seed_offence_counters()` runs at start-up
+(gunicorn worker init, `python app.py`) and backfills existing history if
+the totals do not add up.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.exc import IntegrityError
+
+from db_upsert import upsert
+from models import db, Challan, OffenceCounter
+
+# Keep IN (...) lists well under SQLite's bound-parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_offences(session, flush_context, instances):
+    pending = session.info.setdefault('_offences', {'new': [], 'recount': set()})
+    for obj in session.new:
+        if isinstance(obj, Challan):
+            pending['new'].append(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Challan):
+            pending['recount'].add((obj.vehicle_id, obj.violation_type))
+    for obj in session.dirty:
+        if not isinstance(obj, Challan) or obj in session.deleted:
+            continue
+        state = sa_inspect(obj).attrs
+        changed = False
+        # The pair the challan counted under before this flush, from every attribute's history
+        old = dict(vehicle_id=obj.vehicle_id, violation_type=obj.violation_type)
+        for attr in ('violation_type', 'vehicle_id', 'created_at'):
+            history = state[attr].history
+            if history.has_changes():
+                changed = True
+                if attr in old and history.deleted:
+                    old[attr] = history.deleted[0]
+        if changed:
+            pending['recount'].add((old['vehicle_id'], old['violation_type']))
+            pending['recount'].add((obj.vehicle_id, obj.violation_type))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _maintain_offences(session, flush_context):
+    pending = session.info.pop('_offences', None)
+    if not pending or not (pending['new'] or pending['recount']):
+        return
+    connection = session.connection()
+    recount = pending['recount']
+
+    added = {}
+    for challan in pending['new']:
+        key = (challan.vehicle_id, challan.violation_type)
+        if key in recount:
+            continue
+        seen = challan.created_at or datetime.utcnow()
+        n, first, last = added.get(key, (0, seen, seen))
+        added[key] = (n + 1, min(first, seen), max(last, seen))
+
+    table = OffenceCounter.__table__
+    for (vehicle_id, violation_type), (n, first, last) in added.items():
+        # Upsert: another process may be inserting the first offence for this pair too
+        upsert(
+            connection, table,
+            {'vehicle_id': vehicle_id, 'violation_type': violation_type},
+            {'count': n, 'first_seen': first, 'last_seen': last},
+            {
+                'count': table.c.count + n,
+                'first_seen': db.case((table.c.first_seen < first, table.c.first_seen), else_=first),
+                'last_seen': db.case((table.c.last_seen > last, table.c.last_seen), else_=last),
+            },
+        )
+    for vehicle_id, violation_type in recount:
+        _recount(connection, vehicle_id, violation_type)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_offences(session):
+    session.info.pop('_offences', None)
+
+
+def _recount(connection, vehicle_id, violation_type):
+    table = OffenceCounter.__table__
+    where = (table.c.vehicle_id == vehicle_id) & (table.c.violation_type == violation_type)
+    n, first, last = connection.execute(
+        db.select(db.func.count(Challan.id), db.func.min(Challan.created_at), db.func.max(Challan.created_at))
+        .where(Challan.vehicle_id == vehicle_id, Challan.violation_type == violation_type)
+    ).one()
+    if not n:
+        connection.execute(table.delete().where(where))
+        return
+    values = {'count': n, 'first_seen': first, 'last_seen': last}
+    upsert(connection, table, {'vehicle_id': vehicle_id, 'violation_type': violation_type}, values, values)
+
+
+def rebuild_offence_counters():
+    """Recreate every counter from the challans table; returns the number of rows written"""
+    table = OffenceCounter.__table__
+    db.session.execute(table.delete())
+    rows = db.session.query(
+        Challan.vehicle_id, Challan.violation_type,
+        db.func.count(Challan.id), db.func.min(Challan.created_at), db.func.max(Challan.created_at)
+    ).group_by(Challan.vehicle_id, Challan.violation_type).all()
+    if rows:
+        db.session.execute(table.insert(), [
+            {'vehicle_id': v, 'violation_type': t, 'count': n, 'first_seen': first, 'last_seen': last}
+            for v, t, n, first, last in rows
+        ])
+    db.session.commit()
+    return len(rows)
+
+
+def seed_offence_counters():
+    """Rebuild the counters if they do not cover every challan; returns True if it rebuilt"""
+    counted = db.session.query(db.func.coalesce(db.func.sum(OffenceCounter.count), 0)).scalar()
+    if counted == Challan.query.count():
+        db.session.commit()
+        return False
+    try:
+        rebuild_offence_counters()
+    except IntegrityError:
+        # Another worker rebuilt the counters concurrently; its rows are current
+        db.session.rollback()
+        return False
+    return True
+
+
+def offence_history(pairs):
+    """
+    {(vehicle_id, violation_type): (count, first_seen, last_seen)} for the
+    pairs that have any offence. Counts include future-dated challans; the
+    repeat check (traffic_rules.is_repeat) only counts offences before now.
+    """
+    pairs = set(pairs)
+    history = {}
+    if not pairs:
+        return history
+    vehicle_ids = sorted({vehicle_id for vehicle_id, _ in pairs})
+    violation_types = sorted({violation_type for _, violation_type in pairs})
+    for i in range(0, len(vehicle_ids), LOOKUP_CHUNK_SIZE):
+        rows = db.session.query(
+            OffenceCounter.vehicle_id, OffenceCounter.violation_type, OffenceCounter.count,
+            OffenceCounter.first_seen, OffenceCounter.last_seen
+        ).filter(
+            OffenceCounter.vehicle_id.in_(vehicle_ids[i:i + LOOKUP_CHUNK_SIZE]),
+            OffenceCounter.violation_type.in_(violation_types)
+        )
+        for vehicle_id, violation_type, n, first_seen, last_seen in rows:
+            if n and (vehicle_id, violation_type) in pairs:
+                history[(vehicle_id, violation_type)] = (n, first_seen, last_seen)
+    return history
+
+
+def has_offence_between(vehicle_id, violation_type, start, end):
+    """Whether a challan for the pair was created in [start, end) (index range scan)"""
+    return db.session.query(
+        Challan.query.filter(
+            Challan.vehicle_id == vehicle_id,
+            Challan.violation_type == violation_type,
+            Challan.created_at >= start,
+            Challan.created_at < end,
+        ).exists()
+    ).scalar()
@@ -0,0 +1,226 @@
+"""
+Outbound-call guard for AutoFINE (deadlines + circuit breakers)
+
+Calls to external services go through `outbound_call(name)`:
+
+    with outbound_call('razorpay') as call:
+        order = client.order.create(data=order_data, timeout=call.timeout)
+
+On entry the dependency's circuit breaker is checked; an open breaker
+raises CircuitOpenError immediately, so callers fall straight through to
+their existing fallback instead of tying up a worker. `call.timeout` is the
+dependency's deadline (OUTBOUND_<NAME>_TIMEOUT), cut down to what is left of
+the current request's total budget (OUTBOUND_REQUEST_BUDGET seconds, set by
+`init_outbound(app)`); the caller passes it to the client library. A request
+that has already spent its budget gets DeadlineExceeded without calling out.
+
+Only exceptions that say the dependency is unhealthy count as failures:
+timeouts, connection errors and 5xx answers (`is_dependency_failure`).
+Client errors (a rejected order, a blocked prompt, a 404) and local errors
+(e.g. writing the download) pass through without touching the breaker.
+After OUTBOUND_<NAME>_FAILURES consecutive failures the breaker opens for
+OUTBOUND_<NAME>_RESET seconds, then lets one trial call through (half-open):
+success closes it, failure opens it again. Breakers are per process.
+Dependencies whose endpoint is user-supplied (dataset downloads) get the
+deadline only, no breaker, so one bad URL cannot block every other host.
+"""
+
+import logging
+import os
+import threading
+import time
+import urllib.error
+
+from flask import g, has_request_context
+
+try:
+    import requests
+    _REQUESTS_FAILURES = (requests.exceptions.Timeout, requests.exceptions.ConnectionError)
+except ImportError:
+    _REQUESTS_FAILURES = ()
+
+try:
+    # Raised when the client library's own retries ran out of time
+    from google.api_core.exceptions import RetryError
+    _GOOGLE_FAILURES = (RetryError,)
+except ImportError:
+    _GOOGLE_FAILURES = ()
+
+try:
+    from razorpay.errors import GatewayError, ServerError
+    _RAZORPAY_FAILURES = (GatewayError, ServerError)
+except ImportError:
+    _RAZORPAY_FAILURES = ()
+
+logger = logging.getLogger('autofine.outbound')
+
+DEFAULT_REQUEST_BUDGET = float(os.environ.get('OUTBOUND_REQUEST_BUDGET', '20'))
+
+
+class CircuitOpenError(RuntimeError):
+    """The dependency is failing; the call was not attempted"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request has no time left for another outbound call"""
+
+
+class Dependency:
+    """Deadline and circuit-breaker state for one external service"""
+
+    def __init__(self, name, timeout, failure_threshold=5, reset_after=30, breaker=True):
+        self.name = name
+        self.breaker = breaker
+        self.timeout = float(os.environ.get(f'OUTBOUND_{name.upper()}_TIMEOUT', timeout))
+        self.failure_threshold = int(os.environ.get(f'OUTBOUND_{name.upper()}_FAILURES', failure_threshold))
+        self.reset_after = float(os.environ.get(f'OUTBOUND_{name.upper()}_RESET', reset_after))
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self):
+        if not self.breaker:
+            return
+        with self._lock:
+            state = self.state
+            if state == 'open' or (state == 'half-open' and self.trial_in_flight):
+                raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+            if state == 'half-open':
+                self.trial_in_flight = True
+
+    def record_success(self):
+        if not self.breaker:
+            return
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("%s circuit closed", self.name)
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_neutral(self):
+        """The call ended in a client or local error: no verdict, but free the half-open trial"""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_failure(self, error):
+        if not self.breaker:
+            return
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("%s circuit opened after %d failures: %s", self.name, self.failures, error)
+                self.opened_at = time.monotonic()
+
+    def to_dict(self):
+        return {'state': self.state if self.breaker else 'no-breaker', 'failures': self.failures,
+                'timeout': self.timeout}
+
+
+DEPENDENCIES = {
+    'gemini': Dependency('gemini', timeout=15),
+    'razorpay': Dependency('razorpay', timeout=8),
+    # Admin-supplied URLs on arbitrary hosts: deadline only
+    'dataset_download': Dependency('dataset_download', timeout=15, breaker=False),
+}
+
+
+def _http_status(error):
+    """HTTP status carried by a client-library exception, if any"""
+    for value in (getattr(error, 'code', None), getattr(error, 'status_code', None),
+                  getattr(getattr(error, 'response', None), 'status_code', None)):
+        if isinstance(value, int) and 100 <= value < 600:
+            return value
+    return None
+
+
+def is_dependency_failure(error):
+    """True for timeouts, connection errors and 5xx answers; False for client and local errors"""
+    if isinstance(error, (TimeoutError, ConnectionError) + _REQUESTS_FAILURES + _GOOGLE_FAILURES + _RAZORPAY_FAILURES):
+        return True
+    status = _http_status(error)
+    if status is not None:
+        return status >= 500
+    # urllib wraps DNS failures, refused and reset connections in URLError (HTTPError has a status)
+    return isinstance(error, urllib.error.URLError)
+
+
+def request_time_left():
+    """Seconds left in the current request's outbound budget (None outside a request)"""
+    if not has_request_context():
+        return None
+    deadline = g.get('_outbound_deadline')
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+class _Call:
+    def __init__(self, dependency, timeout):
+        self.dependency = dependency
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout
+
+    @property
+    def timeout(self):
+        """Seconds allowed for this call (fixed at entry)"""
+        return max(self.deadline - self.started, 0.001)
+
+    def remaining(self):
+        """Seconds left before the deadline; for callers that do their own chunked I/O"""
+        return self.deadline - time.monotonic()
+
+    def check(self):
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(f"{self.dependency.name} call exceeded its deadline")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # A closed generator (client went away) says nothing about the dependency's health
+        if exc_type is None or issubclass(exc_type, GeneratorExit):
+            self.dependency.record_success()
+        elif is_dependency_failure(exc):
+            self.dependency.record_failure(exc)
+        else:
+            self.dependency.record_neutral()
+        return False
+
+
+def outbound_call(name, timeout=None):
+    """Guard one call to dependency `name`; see the module docstring"""
+    dependency = DEPENDENCIES[name]
+    allowed = dependency.timeout if timeout is None else timeout
+    left = request_time_left()
+    if left is not None:
+        if left <= 0:
+            raise DeadlineExceeded(f"Request time budget spent; not calling {name}")
+        allowed = min(allowed, left)
+    dependency.before_call()
+    return _Call(dependency, allowed)
+
+
+def outbound_status():
+    """{name: {'state', 'failures', 'timeout'}} for every dependency"""
+    return {name: dep.to_dict() for name, dep in DEPENDENCIES.items()}
+
+
+def init_outbound(app):
+    """Start each request's outbound time budget"""
+    app.config.setdefault('OUTBOUND_REQUEST_BUDGET', DEFAULT_REQUEST_BUDGET)
+
+    @app.before_request
+    def _start_outbound_budget():
+        g._outbound_deadline = time.monotonic() + float(app.config['OUTBOUND_REQUEST_BUDGET'])
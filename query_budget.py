@@ -0,0 +1,69 @@
+"""
+Per-request SQL query budget for AutoFINE (debug aid)
+
+Routes declare how many SQL statements they are allowed to run:
+
+    @app.route('/admin/dashboard')
+    @query_budget(6)
+    def admin_dashboard(): ...
+
+When the app runs in debug mode (or QUERY_BUDGET_ENABLED is set), every
+statement executed inside a request is counted and compared against the
+declared budget after the view returns. Over-budget routes are logged; with
+QUERY_BUDGET_STRICT set they fail with a 500 so N+1 regressions are caught
+in development. Statements issued while a streamed response body is being
+generated happen after the check and are not counted.
+"""
+
+import logging
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('autofine.query_budget')
+
+
+class QueryBudgetExceeded(RuntimeError):
+    """Raised in strict mode when a route runs more queries than it declared"""
+
+
+def query_budget(max_queries):
+    """Decorator declaring the maximum number of SQL statements a view may run"""
+    def decorator(view):
+        view._query_budget = max_queries
+        return view
+    return decorator
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g._query_count = g.get('_query_count', 0) + 1
+
+
+def init_query_budget(app):
+    """Register the statement counter and the after-request budget check"""
+    app.config.setdefault('QUERY_BUDGET_ENABLED', False)
+    app.config.setdefault('QUERY_BUDGET_STRICT', False)
+
+    if not event.contains(Engine, 'before_cursor_execute', _count_statement):
+        event.listen(Engine, 'before_cursor_execute', _count_statement)
+
+    @app.after_request
+    def _check_query_budget(response):
+        if not (app.debug or app.config['QUERY_BUDGET_ENABLED']):
+            return response
+        if g.get('_query_budget_checked'):
+            # Already reported; this is the error response for that failure
+            return response
+        g._query_budget_checked = True
+        view = app.view_functions.get(request.endpoint)
+        budget = getattr(view, '_query_budget', None)
+        used = g.get('_query_count', 0)
+        response.headers['X-Query-Count'] = str(used)
+        if budget is not None and used > budget:
+            message = f"{request.endpoint} ran {used} SQL queries (budget {budget})"
+            if app.config['QUERY_BUDGET_STRICT']:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
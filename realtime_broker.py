@@ -0,0 +1,371 @@
+"""
+Shared challan change notifier for AutoFINE realtime (SSE) endpoints
+
+One background poller per process tails the `challan_events` outbox (see
+challan_events.py) and fans new or changed challans out to subscribed
+connections, routed by vehicle id (owners subscribe with all of their
+vehicles, admins receive everything). An open EventSource then costs a queue
+read instead of its own polling queries every couple of seconds, and changes
+committed by any process or worker are seen.
+
+Events use the outbox sequence number as their id and are kept in a bounded
+replay log, so a reconnecting client that sends Last-Event-ID receives only
+the deltas it missed instead of a fresh snapshot, from memory or, for older
+ids, from the outbox itself (on any worker). `stream_events()` renders a
+subscription as an SSE body, including a jittered `retry:` hint that spreads
+reconnects out after a restart.
+"""
+
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+from challan_events import CREATED, DELETED, EventTail, latest_seq
+from models import db, Challan, ChallanEvent, Vehicle
+
+POLL_INTERVAL = float(os.environ.get('REALTIME_POLL_INTERVAL', '1.0'))
+SUBSCRIBER_QUEUE_SIZE = 256
+POLL_BATCH_SIZE = 500
+REPLAY_LOG_SIZE = int(os.environ.get('REALTIME_REPLAY_SIZE', '1000'))
+HEARTBEAT_SECONDS = 15
+# Clients reconnect after RETRY_BASE_MS plus up to RETRY_JITTER_MS
+RETRY_BASE_MS = int(os.environ.get('REALTIME_RETRY_MS', '3000'))
+RETRY_JITTER_MS = int(os.environ.get('REALTIME_RETRY_JITTER_MS', '7000'))
+
+
+def challan_event_payload(row):
+    """JSON-ready challan dict for realtime events"""
+    return {
+        'id': row.id,
+        'uin': row.uin,
+        'vehicle_id': row.vehicle_id,
+        'license_number': row.license_number or 'N/A',
+        'violation_type': row.violation_type,
+        'location': row.location,
+        'fine_amount': row.fine_amount,
+        'status': row.status,
+        'due_date': row.due_date.isoformat() if row.due_date else None,
+        'created_at': row.created_at.isoformat() if row.created_at else None
+    }
+
+
+class Subscription:
+    """One connection's view of the broker: a bounded queue of events"""
+
+    def __init__(self, vehicle_ids=None):
+        # None = admin (all vehicles)
+        self.vehicle_ids = set(vehicle_ids) if vehicle_ids is not None else None
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        # Set when the events missed since Last-Event-ID were replayed into the queue
+        self.resumed = False
+        # Events with seq <= skip_upto are already on the client; those <= counted_upto are in its counts
+        self.skip_upto = 0
+        self.counted_upto = 0
+        self.start_event_id = None
+        self.closed = False
+
+    def wants(self, event):
+        return self.vehicle_ids is None or event['challan']['vehicle_id'] in self.vehicle_ids
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Slow consumer: drop the oldest event rather than block the poller
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.queue.put_nowait(event)
+
+    def wait(self, timeout):
+        """Block up to `timeout` seconds; returns a (possibly empty) list of events"""
+        try:
+            events = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+
+class ChallanBroker:
+    """Tails the challan outbox once per process and fans events out to subscribers"""
+
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        self.app = None
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._by_vehicle = {}  # vehicle_id -> set(Subscription)
+        self._admins = set()
+        self._subscribers = 0
+        self._tail = None
+        self._seq = 0  # outbox position published so far
+        self._log = deque()  # (seq, event), at most REPLAY_LOG_SIZE entries
+        self._log_floor = 0  # the log holds every event with seq > _log_floor
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+
+    def _ensure_position(self):
+        # The poller sleeps while nobody is subscribed; the first subscriber
+        # after that fast-forwards to the end of the outbox instead of being
+        # sent the backlog on top of its fresh snapshot.
+        if self._tail is not None and self._subscribers:
+            return
+        position = latest_seq()
+        with self._lock:
+            if self._tail is None:
+                self._tail = EventTail(position)
+            elif self._subscribers or position <= self._tail.position:
+                return
+            self._tail.position = self._seq = self._log_floor = position
+            self._log.clear()
+
+    def last_event_id(self):
+        return str(self._seq)
+
+    # ---- subscriptions ----
+
+    def _events_from_outbox(self, sub, after, upto):
+        """Published-style events for seq in (after, upto], or None if there are too many"""
+        query = ChallanEvent.query.filter(
+            ChallanEvent.seq > after, ChallanEvent.seq <= upto, ChallanEvent.event_type != DELETED
+        )
+        if sub.vehicle_ids is not None:
+            query = query.filter(ChallanEvent.vehicle_id.in_(sub.vehicle_ids))
+        rows = query.order_by(ChallanEvent.seq).limit(SUBSCRIBER_QUEUE_SIZE + 1).all()
+        if len(rows) > SUBSCRIBER_QUEUE_SIZE:
+            return None
+        return self._build_events(rows)
+
+    def subscribe(self, vehicle_ids=None, last_event_id=None, snapshot_seq=None):
+        """
+        Register a connection (call from a request, after reading its snapshot).
+
+        `snapshot_seq` is the outbox position (latest_seq()) the caller's
+        snapshot and counts were read at: events after it are queued, so
+        nothing committed while the snapshot was read is lost or counted
+        twice. With `last_event_id`, events missed since then are queued
+        instead and `sub.resumed` is set; otherwise the caller should send
+        its snapshot.
+        """
+        self._ensure_position()
+        sub = Subscription(vehicle_ids)
+        position = self._seq if snapshot_seq is None else snapshot_seq
+        after = int(last_event_id) if (last_event_id or '').isdigit() else None
+        starts = []
+        if after is not None and after <= max(position, self._seq):
+            starts.append((after, True))
+        starts.append((position, False))
+        for start, resume in starts:
+            floor = self._log_floor
+            missed = [] if start >= floor else self._events_from_outbox(sub, start, floor)
+            if missed is None:
+                continue
+            with self._lock:
+                if self._log_floor > max(start, floor):
+                    continue  # the replay log moved past what was read from the outbox
+                missed += [e for s, e in self._log if s > max(start, floor) and sub.wants(e)]
+                if len(missed) > SUBSCRIBER_QUEUE_SIZE:
+                    continue
+                for event in missed:
+                    sub.put(event)
+                sub.resumed = resume
+                sub.skip_upto, sub.counted_upto = start, position
+                self._register(sub)
+            break
+        else:
+            # Too much to replay: the snapshot stands and live events start from here
+            with self._lock:
+                sub.skip_upto = sub.counted_upto = max(position, self._seq)
+                self._register(sub)
+        sub.start_event_id = str(sub.skip_upto)
+        self._ensure_started()
+        return sub
+
+    def _register(self, sub):
+        # Call with self._lock held
+        self._subscribers += 1
+        if sub.vehicle_ids is None:
+            self._admins.add(sub)
+        else:
+            for vid in sub.vehicle_ids:
+                self._by_vehicle.setdefault(vid, set()).add(sub)
+
+    def unsubscribe(self, sub):
+        """Release a connection; safe to call more than once"""
+        with self._lock:
+            if sub.closed:
+                return
+            sub.closed = True
+            self._subscribers -= 1
+            self._admins.discard(sub)
+            for vid in sub.vehicle_ids or ():
+                subs = self._by_vehicle.get(vid)
+                if subs:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._by_vehicle[vid]
+
+    def subscriber_count(self):
+        return self._subscribers
+
+    # ---- publishing ----
+
+    def publish(self, event):
+        with self._lock:
+            seq = int(event['id'])
+            self._seq = max(self._seq, seq)
+            self._log.append((seq, event))
+            while len(self._log) > REPLAY_LOG_SIZE:
+                self._log_floor = self._log.popleft()[0]
+            targets = set(self._admins) | set(self._by_vehicle.get(event['challan']['vehicle_id'], ()))
+        for sub in targets:
+            sub.put(event)
+
+    # ---- poller ----
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='challan-broker', daemon=True)
+            self._thread.start()
+
+    def _query(self):
+        return db.session.query(
+            Challan.id, Challan.uin, Challan.vehicle_id, Vehicle.license_number,
+            Challan.violation_type, Challan.location, Challan.fine_amount,
+            Challan.status, Challan.due_date, Challan.created_at
+        ).join(Vehicle, Challan.vehicle_id == Vehicle.id)
+
+    def _build_events(self, outbox_rows):
+        """Turn outbox rows into realtime events (one challan query per batch)"""
+        outbox_rows = [ev for ev in outbox_rows if ev.event_type != DELETED]
+        if not outbox_rows:
+            return []
+        ids = {ev.challan_id for ev in outbox_rows}
+        challans = {row.id: row for row in self._query().filter(Challan.id.in_(ids))}
+        events = []
+        for ev in outbox_rows:
+            row = challans.get(ev.challan_id)
+            if row is None:
+                continue  # deleted since
+            payload = challan_event_payload(row)
+            payload['status'] = ev.new_status  # status as of this event, not as of now
+            events.append({
+                'id': str(ev.seq),
+                'type': 'created' if ev.event_type == CREATED else 'changed',
+                'challan': payload,
+                'previous_status': ev.old_status
+            })
+        return events
+
+    def poll_once(self):
+        """One pass over new outbox rows; returns the number of events published"""
+        if self._tail is None:
+            self._ensure_position()
+        batch = self._tail.poll(POLL_BATCH_SIZE)
+        events = self._build_events(batch)
+        for event in events:
+            self.publish(event)
+        if batch:
+            with self._lock:
+                self._seq = max(self._seq, batch[-1].seq)
+        return len(events)
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            if not self.subscriber_count():
+                continue
+            try:
+                with self.app.app_context():
+                    try:
+                        self.poll_once()
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                print(f"Challan broker poll failed: {e}")
+
+
+challan_broker = ChallanBroker()
+
+
+# ---- SSE rendering ----
+
+def format_sse(data, event_id=None, retry=None):
+    lines = []
+    if retry is not None:
+        lines.append(f'retry: {retry}')
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def retry_hint():
+    """Reconnect delay in ms, jittered per connection so clients do not reconnect in lockstep"""
+    return RETRY_BASE_MS + random.randint(0, RETRY_JITTER_MS)
+
+
+def apply_status_counts(counts, event):
+    """Adjust a {status: n} dict for one created/changed event"""
+    status = event['challan']['status']
+    if event['type'] == 'created':
+        counts[status] = counts.get(status, 0) + 1
+    elif event.get('previous_status') and event['previous_status'] != status:
+        counts[event['previous_status']] = counts.get(event['previous_status'], 0) - 1
+        counts[status] = counts.get(status, 0) + 1
+
+
+def stream_events(subscription, counts, snapshot=None, fields=None):
+    """
+    SSE body for one subscription.
+
+    `counts` is {status: n} as of the subscription's snapshot position. A new
+    connection first gets an 'init' event with the totals and `snapshot`
+    (list of challan dicts); a resumed one only gets the deltas it missed.
+    Afterwards each change is one 'challan_added' or 'challan_changed' event
+    carrying the challan and the updated totals. The caller releases the
+    subscription when the response closes (Response.call_on_close), which
+    also covers clients that disconnect before the first event is sent.
+    """
+    counts = dict(counts)
+    if subscription.resumed:
+        yield format_sse({'type': 'resume', 'count': sum(counts.values()), 'counts': counts}, retry=retry_hint())
+    else:
+        yield format_sse(
+            {'type': 'init', 'count': sum(counts.values()), 'counts': counts, 'challans': snapshot or []},
+            event_id=subscription.start_event_id, retry=retry_hint()
+        )
+    while True:
+        events = subscription.wait(HEARTBEAT_SECONDS)
+        if not events:
+            yield format_sse({'type': 'heartbeat', 'timestamp': time.time()})
+            continue
+        for event in events:
+            seq = int(event['id'])
+            if seq <= subscription.skip_upto:
+                continue  # already on the client: in its snapshot or sent before it reconnected
+            if seq > subscription.counted_upto:
+                apply_status_counts(counts, event)
+            challan = event['challan']
+            if fields:
+                challan = {k: challan[k] for k in fields}
+            yield format_sse({
+                'type': 'challan_added' if event['type'] == 'created' else 'challan_changed',
+                'challan': challan,
+                'count': sum(counts.values()),
+                'counts': counts
+            }, event_id=event['id'])
@@ -0,0 +1,162 @@
+"""
+In-process reference-data cache for AutoFINE
+
+Small, read-mostly lookups (vehicle cities, violation fines, camera metadata)
+are loaded once and served from memory until their TTL expires or a
+committed write to Vehicle / Violation / Camera invalidates them. The cache
+is per process: other gunicorn workers pick up a change when their own TTL
+runs out (REFERENCE_CACHE_TTL seconds, default 300).
+
+Modules that cache their own data here declare what invalidates it with
+`invalidate_on(Model, name)`. Every invalidation bumps the entry's
+generation, and a load that started before the latest invalidation is
+returned to its caller but not stored, so it cannot overwrite the change.
+"""
+
+import os
+import threading
+import time
+
+from sqlalchemy import event, inspect as sa_inspect
+
+from models import db, Camera, Vehicle, Violation
+
+DEFAULT_TTL = int(os.environ.get('REFERENCE_CACHE_TTL', '300'))
+
+_lock = threading.Lock()
+_entries = {}  # name -> (expires_at, value)
+_loaders = {}  # name -> (loader, ttl)
+_generations = {}  # name -> invalidation count
+_clear_generation = 0  # invalidate() with no names
+_watchers = []  # (model, attrs or None, names) from invalidate_on()
+
+
+def _generation(name):
+    return (_clear_generation, _generations.get(name, 0))
+
+
+def reference_data(name, ttl=None):
+    """Register `loader` as cached reference data under `name`"""
+    def decorator(loader):
+        _loaders[name] = (loader, DEFAULT_TTL if ttl is None else ttl)
+
+        def get():
+            now = time.monotonic()
+            entry = _entries.get(name)
+            if entry and entry[0] > now:
+                return entry[1]
+            with _lock:
+                generation = _generation(name)
+            value = loader()
+            with _lock:
+                # Invalidated while loading: the value may predate the write, do not keep it
+                if _generation(name) == generation:
+                    _entries[name] = (now + _loaders[name][1], value)
+            return value
+
+        get.__name__ = loader.__name__
+        get.__doc__ = loader.__doc__
+        return get
+    return decorator
+
+
+def invalidate(*names):
+    """Drop the named entries (all entries if no names are given)"""
+    global _clear_generation
+    with _lock:
+        if not names:
+            _clear_generation += 1
+            _entries.clear()
+        for name in names:
+            _generations[name] = _generations.get(name, 0) + 1
+            _entries.pop(name, None)
+
+
+def invalidate_on(model, *names, attrs=None):
+    """
+    Drop `names` after a commit that inserts or deletes `model` rows, or
+    updates one (only changes to `attrs` count, if given).
+    """
+    _watchers.append((model, attrs, names))
+
+
+@reference_data('cities')
+def get_cities():
+    """Sorted distinct vehicle cities"""
+    rows = db.session.query(Vehicle.city).distinct().filter(Vehicle.city.isnot(None)).all()
+    return sorted(r[0] for r in rows)
+
+
+@reference_data('violation_fines')
+def get_violation_fines():
+    """{violation_type: fine_amount} from the Violation table"""
+    return {v_type: fine for v_type, fine in db.session.query(Violation.violation_type, Violation.fine_amount)}
+
+
+def get_violation_types():
+    """Sorted violation type names"""
+    return sorted(get_violation_fines())
+
+
+@reference_data('cameras')
+def get_cameras():
+    """{camera_id code: camera metadata dict} for every camera"""
+    return {
+        c.camera_id: {
+            'id': c.id,
+            'camera_id': c.camera_id,
+            'location': c.location,
+            'latitude': c.latitude,
+            'longitude': c.longitude,
+            'is_active': c.is_active
+        }
+        for c in Camera.query.all()
+    }
+
+
+def get_camera(camera_id):
+    """Metadata for one camera code, or None"""
+    return get_cameras().get(camera_id) if camera_id else None
+
+
+# ---- invalidation on committed writes ----
+
+invalidate_on(Vehicle, 'cities', attrs=('city',))
+invalidate_on(Violation, 'violation_fines')
+invalidate_on(Camera, 'cameras')
+
+
+def _touched_entries(session):
+    names = set()
+    for obj in list(session.new) + list(session.deleted):
+        for model, attrs, watched in _watchers:
+            if isinstance(obj, model):
+                names.update(watched)
+    for obj in session.dirty:
+        for model, attrs, watched in _watchers:
+            if not isinstance(obj, model):
+                continue
+            if attrs is None:
+                names.update(watched)
+                continue
+            state = sa_inspect(obj).attrs
+            if any(state[attr].history.has_changes() for attr in attrs):
+                names.update(watched)
+    return names
+
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_invalidations(session, flush_context, instances):
+    session.info.setdefault('_reference_invalidations', set()).update(_touched_entries(session))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_invalidations(session):
+    names = session.info.pop('_reference_invalidations', None)
+    if names:
+        invalidate(*names)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_invalidations(session):
+    session.info.pop('_reference_invalidations', None)
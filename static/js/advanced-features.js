@@ -48,8 +48,13 @@ class AppealsSystem {
             const data = await response.json();
             
             if (data.success) {
-                // Show AI guidance
-                this.showAppealGuidance(data.guidance);
+                // AI guidance is generated in the background unless it is already known
+                if (data.status === 'pending') {
+                    this.showAppealGuidance('Preparing AI guidance for your appeal...');
+                    this.waitForGuidance(data);
+                } else {
+                    this.showAppealGuidance(data.guidance);
+                }
                 return true;
             }
             return false;
@@ -59,6 +64,35 @@ class AppealsSystem {
         }
     }
 
+    static waitForGuidance(appeal) {
+        if (window.EventSource) {
+            const source = new EventSource(appeal.guidance_stream_url);
+            source.onmessage = (e) => {
+                const event = JSON.parse(e.data);
+                if (event.type === 'guidance') {
+                    this.showAppealGuidance(event.guidance);
+                    source.close();
+                } else if (event.type === 'timeout') {
+                    source.close();
+                }
+            };
+            source.onerror = () => source.close();
+            return;
+        }
+        // No SSE support: poll a few times
+        let tries = 0;
+        const poll = async () => {
+            const response = await fetch(appeal.guidance_url);
+            const data = await response.json();
+            if (data.status && data.status !== 'pending') {
+                this.showAppealGuidance(data.guidance);
+            } else if (++tries < 20) {
+                setTimeout(poll, 3000);
+            }
+        };
+        setTimeout(poll, 3000);
+    }
+
     static showAppealModal(challanId) {
         const modal = document.createElement('div');
         modal.className = 'modal fade';
@@ -99,8 +133,9 @@ class AppealsSystem {
             
             const success = await this.createAppeal(challanId, reason);
             if (success) {
-                bsModal.hide();
-                modal.remove();
+                // Keep the modal open so the AI guidance can be read when it arrives
+                e.target.style.display = 'none';
+                modal.addEventListener('hidden.bs.modal', () => modal.remove());
                 showNotification('Appeal submitted successfully!', 'success');
             }
         };
@@ -193,6 +228,7 @@ class PaymentPlans {
 class AIChatbot {
     constructor() {
         this.chatContainer = null;
+        this.controller = null;
         this.init();
     }
 
@@ -219,7 +255,7 @@ class AIChatbot {
         chatWindow.innerHTML = `
             <div class="card-header d-flex justify-content-between align-items-center" style="background: rgba(240,248,255,0.85); border-bottom: 1px solid var(--border-light);">
                 <h6 class="mb-0"><i class="bi bi-person-lines-fill"></i> AI Assistant</h6>
-                <button class="btn-close" onclick="document.getElementById('chatbot-window').style.display='none'"></button>
+                <button class="btn-close" onclick="document.getElementById('chatbot-window').style.display='none'; window.chatbot.cancelStream()"></button>
             </div>
             <div id="chat-messages" class="flex-grow-1 p-3" style="overflow-y: auto; max-height: 420px; background: rgba(255,255,255,0.6);"></div>
             <div class="card-footer" style="background: rgba(245,245,245,0.85); border-top: 1px solid var(--border-light);">
@@ -238,6 +274,7 @@ class AIChatbot {
     toggleChat() {
         const window = document.getElementById('chatbot-window');
         window.style.display = window.style.display === 'none' ? 'flex' : 'none';
+        if (window.style.display === 'none') this.cancelStream();
         
         if (window.style.display !== 'none') {
             this.addWelcomeMessage();
@@ -261,6 +298,61 @@ class AIChatbot {
         // Show typing indicator
         const typingId = this.addMessage('assistant', 'Thinking...', true);
         
+        // A new question (or closing the window) cancels the answer still streaming
+        this.cancelStream();
+        this.controller = new AbortController();
+        
+        try {
+            const response = await fetch('/api/chatbot/stream', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({message: message}),
+                signal: this.controller.signal
+            });
+            if (!response.ok || !response.body) throw new Error('Streaming unavailable');
+            
+            // Replace the typing indicator with the answer as tokens arrive
+            const bubble = document.getElementById(typingId).firstChild;
+            let text = '';
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const {value, done} = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, {stream: true});
+                const events = buffer.split('\n\n');
+                buffer = events.pop();
+                for (const raw of events) {
+                    const line = raw.split('\n').find(l => l.startsWith('data: '));
+                    if (!line) continue;
+                    const event = JSON.parse(line.slice(6));
+                    if (event.type === 'token') {
+                        text += event.text;
+                    } else if (event.type === 'error') {
+                        text = event.message;
+                    }
+                    bubble.textContent = text || 'Thinking...';
+                    this.chatContainer.scrollTop = this.chatContainer.scrollHeight;
+                }
+            }
+            if (!text) bubble.textContent = 'I apologize, but I could not process your request.';
+        } catch (error) {
+            if (error.name === 'AbortError') return;
+            await this.sendMessageWithoutStreaming(message, typingId);
+        } finally {
+            this.controller = null;
+        }
+    }
+    
+    cancelStream() {
+        if (this.controller) {
+            this.controller.abort();
+            this.controller = null;
+        }
+    }
+    
+    async sendMessageWithoutStreaming(message, typingId) {
         try {
             const response = await fetch('/api/chatbot', {
                 method: 'POST',
@@ -17,8 +17,8 @@ class GeminiNewsWidget {
         // Load initial news
         this.loadNews();
         
-        // Set up auto-refresh
-        setInterval(() => this.loadNews(), this.updateInterval);
+        // Set up auto-refresh (only while the tab is visible)
+        setInterval(() => { if (!document.hidden) this.loadNews(); }, this.updateInterval);
     }
 
     createNewsWidget() {
@@ -8,12 +8,30 @@ class RealtimeUpdater {
         this.url = options.url || '/api/realtime/challans';
         this.eventSource = null;
         this.callbacks = {
+            onInit: options.onInit || null,
             onUpdate: options.onUpdate || null,
             onError: options.onError || null,
             onConnect: options.onConnect || null
         };
         this.reconnecting = false;
         this.reconnectInterval = options.reconnectInterval || 3000;
+        this.maxReconnectInterval = options.maxReconnectInterval || 60000;
+        this.reconnectAttempts = 0;
+        this.lastEventId = null;
+    }
+
+    streamUrl() {
+        // A new EventSource does not send Last-Event-ID, so pass it along explicitly
+        if (!this.lastEventId) return this.url;
+        const sep = this.url.indexOf('?') === -1 ? '?' : '&';
+        return `${this.url}${sep}last_event_id=${encodeURIComponent(this.lastEventId)}`;
+    }
+
+    reconnectDelay() {
+        // Exponential backoff with full jitter so clients do not reconnect in lockstep
+        const ceiling = Math.min(this.maxReconnectInterval, this.reconnectInterval * Math.pow(2, this.reconnectAttempts));
+        this.reconnectAttempts++;
+        return Math.round(ceiling / 2 + Math.random() * ceiling / 2);
     }
 
     connect() {
@@ -21,11 +39,12 @@ class RealtimeUpdater {
             this.disconnect();
         }
 
-        this.eventSource = new EventSource(this.url);
+        this.eventSource = new EventSource(this.streamUrl());
 
         this.eventSource.onopen = () => {
             console.log('Real-time connection established');
             this.reconnecting = false;
+            this.reconnectAttempts = 0;
             if (this.callbacks.onConnect) {
                 this.callbacks.onConnect();
             }
@@ -35,15 +54,22 @@ class RealtimeUpdater {
         this.eventSource.onmessage = (event) => {
             try {
                 const data = JSON.parse(event.data);
+                if (event.lastEventId) {
+                    this.lastEventId = event.lastEventId;
+                }
                 
-                if (data.type === 'update') {
+                if (data.type === 'challan_added' || data.type === 'challan_changed') {
                     console.log('Real-time update received:', data);
                     if (this.callbacks.onUpdate) {
                         this.callbacks.onUpdate(data);
                     }
-                    this.showNotification('New challan update received!');
-                } else if (data.type === 'init') {
+                    this.showNotification(data.type === 'challan_added' ? 'New challan issued!' : 'Challan status updated!');
+                } else if (data.type === 'init' || data.type === 'resume') {
+                    // 'resume' means only missed deltas follow; 'init' carries a fresh snapshot
                     console.log('Initial state:', data);
+                    if (this.callbacks.onInit) {
+                        this.callbacks.onInit(data);
+                    }
                 } else if (data.type === 'heartbeat') {
                     // Silent heartbeat to keep connection alive
                 }
@@ -61,10 +87,11 @@ class RealtimeUpdater {
                     this.callbacks.onError(error);
                 }
                 
-                // Attempt to reconnect
+                // The browser gave up (e.g. server restart or error response): reconnect with backoff.
+                // While CONNECTING the browser retries by itself using the server's retry hint.
                 if (!this.reconnecting) {
                     this.reconnecting = true;
-                    setTimeout(() => this.connect(), this.reconnectInterval);
+                    setTimeout(() => this.connect(), this.reconnectDelay());
                 }
             }
         };
@@ -122,21 +149,25 @@ class VehicleRealtimeUpdater extends RealtimeUpdater {
     }
 
     handleUpdate(data) {
-        if (data.type === 'update' && data.challans) {
-            // Update challan list in DOM
-            const challanList = document.getElementById('challan-list');
-            if (challanList) {
-                this.updateChallanTable(data.challans);
+        const tbody = document.querySelector('#challan-list tbody');
+        if (!tbody) return;
+
+        if (data.type === 'init') {
+            tbody.innerHTML = data.challans.map(challan => this.challanRow(challan)).join('');
+        } else if (data.type === 'challan_added' || data.type === 'challan_changed') {
+            // Deltas touch one row: replace it if present, otherwise prepend it
+            const existing = tbody.querySelector(`tr[data-challan-id="${data.challan.id}"]`);
+            if (existing) {
+                existing.outerHTML = this.challanRow(data.challan);
+            } else {
+                tbody.insertAdjacentHTML('afterbegin', this.challanRow(data.challan));
             }
         }
     }
 
-    updateChallanTable(challans) {
-        const tbody = document.querySelector('#challan-list tbody');
-        if (!tbody) return;
-
-        tbody.innerHTML = challans.map(challan => `
-            <tr class="animate-fade-in">
+    challanRow(challan) {
+        return `
+            <tr class="animate-fade-in" data-challan-id="${challan.id}">
                 <td>#${challan.id}</td>
                 <td>${challan.violation_type}</td>
                 <td>${challan.location || 'N/A'}</td>
@@ -149,7 +180,7 @@ class VehicleRealtimeUpdater extends RealtimeUpdater {
                 </td>
                 <td>${new Date(challan.created_at).toLocaleString()}</td>
             </tr>
-        `).join('');
+        `;
     }
 }
 
@@ -160,12 +191,8 @@ document.addEventListener('DOMContentLoaded', function() {
     
     if (pageType === 'owner-dashboard' || pageType === 'admin-dashboard') {
         const updater = new RealtimeUpdater({
-            onUpdate: function(data) {
-                // Refresh page data or update specific elements
-                if (data.challans) {
-                    updateChallanCounts(data);
-                }
-            },
+            onInit: updateChallanCounts,
+            onUpdate: updateChallanCounts,
             onConnect: function() {
                 console.log('Connected to real-time updates');
             },
@@ -186,11 +213,13 @@ document.addEventListener('DOMContentLoaded', function() {
     const vehicleId = document.body.getAttribute('data-vehicle-id');
     if (vehicleId) {
         const vehicleUpdater = new VehicleRealtimeUpdater(vehicleId, {
-            onUpdate: function(data) {
-                if (data.challans) {
-                    const vehicleUpdater = new VehicleRealtimeUpdater(vehicleId);
+            onInit: function(data) {
+                if (data.type === 'init') {
                     vehicleUpdater.handleUpdate(data);
                 }
+            },
+            onUpdate: function(data) {
+                vehicleUpdater.handleUpdate(data);
             }
         });
         
@@ -212,10 +241,9 @@ function updateChallanCounts(data) {
         totalChallans.textContent = data.count;
     }
     
-    // Count unpaid challans
-    if (data.challans && unpaidChallans) {
-        const unpaidCount = data.challans.filter(c => c.status === 'Unpaid').length;
-        unpaidChallans.textContent = unpaidCount;
+    // Per-status totals come with every event
+    if (data.counts && unpaidChallans) {
+        unpaidChallans.textContent = data.counts.Unpaid || 0;
     }
 }
 
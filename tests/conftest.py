@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+# Modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db_app():
+    """Bare Flask app on an in-memory SQLite database with every table created"""
+    pytest.importorskip('flask_sqlalchemy')
+    from flask import Flask
+
+    import reference_cache
+    from models import db
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        reference_cache.invalidate()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def vehicle(db_app):
+    from models import db, User, Vehicle
+
+    owner = User(username='owner', email='owner@autofine.test', password_hash='x')
+    db.session.add(owner)
+    db.session.flush()
+    vehicle = Vehicle(license_number='UK07AB1234', owner_id=owner.id)
+    db.session.add(vehicle)
+    db.session.commit()
+    return vehicle
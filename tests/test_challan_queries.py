@@ -0,0 +1,73 @@
+"""
+Keyset pagination across dated challans and challans with no created_at
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('flask_sqlalchemy')
+
+from challan_queries import _keyset_page, challan_list_query, decode_cursor, paginate_challans
+from models import db, Challan
+
+START = datetime(2026, 1, 1, 9, 0)
+
+
+@pytest.fixture
+def challans(vehicle):
+    """Ids of five dated challans (two sharing a timestamp) and three undated ones"""
+    times = [START, START + timedelta(hours=1), START + timedelta(hours=1), START + timedelta(hours=2), START]
+    rows = [Challan(vehicle_id=vehicle.id, violation_type='No Helmet', fine_amount=1000, created_at=t)
+            for t in times]
+    undated = [Challan(vehicle_id=vehicle.id, violation_type='No Helmet', fine_amount=1000) for _ in range(3)]
+    db.session.add_all(rows + undated)
+    db.session.flush()
+    Challan.query.filter(Challan.id.in_([c.id for c in undated])).update(
+        {'created_at': None}, synchronize_session=False
+    )
+    db.session.commit()
+    return [c.id for c in rows], [c.id for c in undated]
+
+
+def expected_order(dated_ids, undated_ids):
+    dated = sorted(((c.created_at, c.id) for c in Challan.query.filter(Challan.id.in_(dated_ids))), reverse=True)
+    return [i for _, i in dated] + sorted(undated_ids, reverse=True)
+
+
+def test_pages_cross_from_dated_to_undated_rows(challans):
+    dated_ids, undated_ids = challans
+    query = challan_list_query({})
+
+    seen, position = [], None
+    while True:
+        rows = _keyset_page(query, position, 3)
+        seen += [r.id for r in rows]
+        if len(rows) < 3:
+            break
+        position = (rows[-1].created_at, rows[-1].id)
+
+    assert seen == expected_order(dated_ids, undated_ids)
+
+
+def test_page_starting_inside_the_undated_segment(challans):
+    _, undated_ids = challans
+    top = max(undated_ids)
+
+    rows = _keyset_page(challan_list_query({}), (None, top), 10)
+
+    assert [r.id for r in rows] == sorted((i for i in undated_ids if i < top), reverse=True)
+
+
+def test_paginate_challans_cursors_cover_every_row_once(challans):
+    dated_ids, undated_ids = challans
+
+    seen, cursor = [], None
+    while True:
+        rows, cursor = paginate_challans({}, cursor=cursor, per_page=2)
+        seen += [r.id for r in rows]
+        if cursor is None:
+            break
+        assert decode_cursor(cursor) == (rows[-1].created_at, rows[-1].id)
+
+    assert seen == expected_order(dated_ids, undated_ids)
@@ -0,0 +1,113 @@
+"""
+SMTPPool against an in-process smtplib stand-in (no network)
+"""
+
+import smtplib
+
+import pytest
+
+import email_service
+
+
+class FakeSMTP:
+    """Records what a real smtplib.SMTP session would have done"""
+
+    instances = []
+    refused = set()
+
+    def __init__(self, host, port, timeout=None):
+        self.host = host
+        self.port = port
+        self.logins = 0
+        self.sent = []
+        self.dropped = False
+        self.closed = False
+        FakeSMTP.instances.append(self)
+
+    def starttls(self):
+        pass
+
+    def login(self, user, pwd):
+        self.logins += 1
+
+    def sendmail(self, sender, recipients, message):
+        if self.dropped or self.closed:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        if recipients[0] in FakeSMTP.refused:
+            raise smtplib.SMTPRecipientsRefused({recipients[0]: (550, b"No such user")})
+        self.sent.append((sender, recipients, message))
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setenv("SMTP_HOST", "localhost")
+    monkeypatch.setenv("SMTP_PORT", "2525")
+    monkeypatch.setenv("SMTP_USER", "noreply@autofine.test")
+    monkeypatch.setenv("SMTP_PASS", "secret")
+    monkeypatch.setattr(email_service.smtplib, "SMTP", FakeSMTP)
+    FakeSMTP.instances = []
+    FakeSMTP.refused = set()
+    pool = email_service.SMTPPool(size=2, idle_seconds=60, max_messages=100)
+    yield pool
+    pool.close_all()
+
+
+def test_session_is_reused_across_sends(pool):
+    assert pool.send_many([("a@example.com", "One", "Body")]) == [None]
+    assert pool.send_many([("b@example.com", "Two", "Body")]) == [None]
+
+    assert len(FakeSMTP.instances) == 1
+    server = FakeSMTP.instances[0]
+    assert server.logins == 1
+    assert [r for _, r, _ in server.sent] == [["a@example.com"], ["b@example.com"]]
+
+
+def test_dropped_session_is_reopened(pool):
+    assert pool.send_many([("a@example.com", "One", "Body")]) == [None]
+    FakeSMTP.instances[0].dropped = True
+
+    assert pool.send_many([("b@example.com", "Two", "Body")]) == [None]
+
+    assert len(FakeSMTP.instances) == 2
+    assert FakeSMTP.instances[0].closed
+    assert [r for _, r, _ in FakeSMTP.instances[1].sent] == [["b@example.com"]]
+
+
+def test_send_many_reports_per_message_errors(pool):
+    FakeSMTP.refused = {"bad@example.com"}
+
+    errors = pool.send_many([
+        ("a@example.com", "One", "Body"),
+        ("bad@example.com", "Two", "Body"),
+        ("c@example.com", "Three", "Body"),
+    ])
+
+    assert errors[0] is None and errors[2] is None
+    assert "bad@example.com" in errors[1]
+    assert len(FakeSMTP.instances) == 1
+    assert len(FakeSMTP.instances[0].sent) == 2
+
+
+def test_send_many_recycles_after_max_messages(pool):
+    pool.max_messages = 2
+
+    errors = pool.send_many([(f"u{i}@example.com", "Hi", "Body") for i in range(5)])
+
+    assert errors == [None] * 5
+    assert [len(s.sent) for s in FakeSMTP.instances] == [2, 2, 1]
+    assert FakeSMTP.instances[0].closed and FakeSMTP.instances[1].closed
+
+
+def test_send_many_without_settings_fails_every_message(pool, monkeypatch):
+    monkeypatch.delenv("SMTP_HOST")
+
+    errors = pool.send_many([("a@example.com", "One", "Body"), ("b@example.com", "Two", "Body")])
+
+    assert len(errors) == 2 and all("not configured" in e for e in errors)
+    assert FakeSMTP.instances == []
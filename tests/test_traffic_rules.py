@@ -0,0 +1,106 @@
+"""
+Fine engine: first and repeat offences, repeat windows and future-dated challans
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('flask_sqlalchemy')
+
+import traffic_rules
+from models import db, Challan
+
+NOW = datetime(2026, 6, 1, 12, 0)
+
+
+def add_challan(vehicle, violation_type, created_at):
+    db.session.add(Challan(
+        vehicle_id=vehicle.id, violation_type=violation_type, fine_amount=0, created_at=created_at
+    ))
+    db.session.commit()
+
+
+# ---- is_repeat ----
+
+def test_no_history_is_not_a_repeat():
+    assert not traffic_rules.is_repeat('No Helmet', None, NOW)
+    assert not traffic_rules.is_repeat('No Helmet', (0, None, None), NOW)
+
+
+def test_any_past_offence_is_a_repeat_without_a_window(monkeypatch):
+    monkeypatch.setattr(traffic_rules, 'repeat_window', lambda violation_type: None)
+
+    history = (1, NOW - timedelta(days=900), NOW - timedelta(days=900))
+    assert traffic_rules.is_repeat('No Helmet', history, NOW)
+
+
+def test_offence_outside_the_window_is_not_a_repeat(monkeypatch):
+    monkeypatch.setattr(traffic_rules, 'repeat_window', lambda violation_type: timedelta(days=365))
+
+    expired = (2, NOW - timedelta(days=800), NOW - timedelta(days=366))
+    recent = (2, NOW - timedelta(days=800), NOW - timedelta(days=364))
+    assert not traffic_rules.is_repeat('No Helmet', expired, NOW)
+    assert traffic_rules.is_repeat('No Helmet', recent, NOW)
+
+
+def test_future_dated_offences_do_not_count(monkeypatch):
+    monkeypatch.setattr(traffic_rules, 'repeat_window', lambda violation_type: None)
+
+    history = (1, NOW + timedelta(days=1), NOW + timedelta(days=1))
+    assert not traffic_rules.is_repeat('No Helmet', history, NOW)
+
+
+def test_future_dated_offence_hiding_a_past_one_is_looked_up(monkeypatch):
+    monkeypatch.setattr(traffic_rules, 'repeat_window', lambda violation_type: timedelta(days=30))
+    calls = []
+
+    def has_offence_between(vehicle_id, violation_type, start, end):
+        calls.append((vehicle_id, violation_type, start, end))
+        return True
+
+    monkeypatch.setattr(traffic_rules, 'has_offence_between', has_offence_between)
+
+    history = (2, NOW - timedelta(days=10), NOW + timedelta(days=5))
+    assert traffic_rules.is_repeat('No Helmet', history, NOW, vehicle_id=7)
+    assert calls == [(7, 'No Helmet', NOW - timedelta(days=30), NOW)]
+    assert not traffic_rules.is_repeat('No Helmet', history, NOW)
+
+
+# ---- calculate_fines ----
+
+def test_first_offence_pays_the_first_fine(vehicle):
+    assert traffic_rules.calculate_fines([('No Helmet', vehicle.id)]) == [(1000, False, False)]
+
+
+def test_previous_offence_makes_a_repeat(vehicle):
+    add_challan(vehicle, 'No Helmet', datetime.utcnow() - timedelta(days=3))
+
+    assert traffic_rules.calculate_fines([('No Helmet', vehicle.id)]) == [(2000, True, False)]
+    # Other violation types are not affected
+    assert traffic_rules.calculate_fines([('Signal Jumping', vehicle.id)]) == [(1000, False, False)]
+
+
+def test_earlier_entries_in_a_batch_count_as_previous_offences(vehicle):
+    fines = traffic_rules.calculate_fines([('Signal Jumping', vehicle.id), ('Signal Jumping', vehicle.id)])
+
+    assert fines == [(1000, False, False), (5000, True, False)]
+
+
+def test_offence_before_the_repeat_window_is_a_first_offence(vehicle, monkeypatch):
+    monkeypatch.setattr(traffic_rules, 'REPEAT_WINDOW_DAYS', 30)
+    add_challan(vehicle, 'No Helmet', datetime.utcnow() - timedelta(days=60))
+
+    assert traffic_rules.calculate_fines([('No Helmet', vehicle.id)]) == [(1000, False, False)]
+
+
+def test_future_dated_challan_is_not_a_previous_offence(vehicle):
+    add_challan(vehicle, 'No Helmet', datetime.utcnow() + timedelta(days=2))
+
+    assert traffic_rules.calculate_fines([('No Helmet', vehicle.id)]) == [(1000, False, False)]
+
+
+def test_court_mandatory_and_unknown_violations(vehicle):
+    fines = traffic_rules.calculate_fines([('Drunk Driving', vehicle.id), ('Unlisted Offence', vehicle.id)])
+
+    assert fines == [(0, False, True), (traffic_rules.DEFAULT_FINE, False, False)]
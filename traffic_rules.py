@@ -1,30 +1,107 @@
-from datetime import datetime
+"""
+Table-driven fine engine for AutoFINE
 
-from models import Challan, Violation, db
+The fine table is compiled from the Violation table plus the statutory
+rules below (which take precedence) and cached as reference data, so
+working out a fine needs no Violation query. Repeat-offender status is the
+only per-vehicle input: `calculate_fines()` resolves it for a whole batch
+of (violation_type, vehicle_id) pairs from the maintained offence counters
+(one lookup, no history scan), and `calculate_fine()` is the single-pair
+case of the same path.
+"""
 
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
 
-def calculate_fine(violation_type: str, vehicle_id: int):
-    prev_count = (
-        Challan.query.filter_by(vehicle_id=vehicle_id, violation_type=violation_type)
-        .filter(Challan.created_at < datetime.utcnow())
-        .count()
-    )
-    subsequent = prev_count > 0
-    court_mandatory = False
-
-    if violation_type == "No Helmet":
-        base = 1000
-        fine = base * 2 if subsequent else base
-    elif violation_type == "Drunk Driving":
-        fine = 0
-        court_mandatory = True
-    elif violation_type == "Signal Jumping":
-        fine = 1000 if not subsequent else 5000
-    elif violation_type == "Triple Riding":
-        fine = 1000
-    else:
-        v = Violation.query.filter_by(violation_type=violation_type).first()
-        fine = v.fine_amount if v else 1000
-
-    return fine, subsequent, court_mandatory
+from models import Violation
+from offence_counters import offence_history, has_offence_between
+from reference_cache import get_violation_fines, invalidate_on, reference_data
+
+# first: fine for a first offence, repeat: fine once the vehicle has a
+# previous challan of the same type (within window_days, if set)
+FineRule = namedtuple('FineRule', 'first repeat court_mandatory window_days', defaults=(None,))
+
+DEFAULT_FINE = 1000
+# Default look-back for repeat offences; 0 means any previous offence counts
+REPEAT_WINDOW_DAYS = int(os.environ.get('REPEAT_OFFENCE_WINDOW_DAYS', '0'))
+
+STATUTORY_RULES = {
+    "No Helmet": FineRule(1000, 2000, False),
+    "Drunk Driving": FineRule(0, 0, True),
+    "Signal Jumping": FineRule(1000, 5000, False),
+    "Triple Riding": FineRule(1000, 1000, False),
+}
+
+
+@reference_data('fine_table')
+def fine_table():
+    """{violation_type: FineRule}, Violation table overlaid with the statutory rules"""
+    table = {v_type: FineRule(fine, fine, False) for v_type, fine in get_violation_fines().items()}
+    table.update(STATUTORY_RULES)
+    return table
+
+
+invalidate_on(Violation, 'fine_table')
+
+
+def fine_rule(violation_type: str, subsequent: bool):
+    """(fine, court_mandatory) for one offence, given whether it is a repeat"""
+    rule = fine_table().get(violation_type)
+    if rule is None:
+        return DEFAULT_FINE, False
+    return (rule.repeat if subsequent else rule.first), rule.court_mandatory
 
+
+def repeat_window(violation_type: str):
+    """timedelta within which a previous offence makes this one a repeat, or None for ever"""
+    rule = fine_table().get(violation_type)
+    days = rule.window_days if rule is not None and rule.window_days is not None else REPEAT_WINDOW_DAYS
+    return timedelta(days=days) if days else None
+
+
+def is_repeat(violation_type: str, history, now=None, vehicle_id=None):
+    """
+    history is (count, first_seen, last_seen) from offence_history(), or None.
+    Only offences created before `now` count, as in the per-challan check
+    this replaced; future-dated challans do not make an offence a repeat.
+    """
+    if not history or not history[0]:
+        return False
+    _, first_seen, last_seen = history
+    now = now or datetime.utcnow()
+    if first_seen is None or first_seen >= now:
+        return False
+    window = repeat_window(violation_type)
+    if window is None:
+        return True
+    if last_seen < now:
+        return last_seen >= now - window
+    # A future-dated challan hides the latest past offence: look it up
+    return vehicle_id is not None and has_offence_between(vehicle_id, violation_type, now - window, now)
+
+
+def calculate_fines(batch):
+    """
+    Fines for many offences at once.
+
+    `batch` is a list of (violation_type, vehicle_id); returns a list of
+    (fine, subsequent, court_mandatory) in the same order. Earlier entries
+    in the batch count as previous offences for later ones, as they would
+    if the challans were issued one after another.
+    """
+    history = offence_history((vehicle_id, violation_type) for violation_type, vehicle_id in batch)
+    now = datetime.utcnow()
+    issued = set()
+    results = []
+    for violation_type, vehicle_id in batch:
+        key = (vehicle_id, violation_type)
+        subsequent = key in issued or is_repeat(violation_type, history.get(key), now, vehicle_id)
+        issued.add(key)
+        fine, court_mandatory = fine_rule(violation_type, subsequent)
+        results.append((fine, subsequent, court_mandatory))
+    return results
+
+
+def calculate_fine(violation_type: str, vehicle_id: int):
+    return calculate_fines([(violation_type, vehicle_id)])[0]